@@ -1,10 +1,15 @@
+import functools
+import time
+
 import gradio as gr
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from solar import REF_SOLAR_DATA
+from solar import get_ref_solar_data
 from batteryopt import run_optimization
-from utils import process_pge_meterdata, merge_solar_and_load_data, build_tariff
+from billing import get_interval_costs
+from jobs import JobQueue, QueueFullError, get_default_mp_context
+from utils import process_pge_meterdata, merge_solar_and_load_data, build_tariff, trim_to_last_year
 try:
     from palmetto import get_palmetto_data
 except TypeError:
@@ -14,6 +19,10 @@ from dotenv import load_dotenv
 load_dotenv(dotenv_path = "../.env")  # load from .env
 
 TRY_PALMETTO = False
+# Background solver jobs: at most MAX_SOLVER_WORKERS run at once, and MAX_PENDING_JOBS wait
+MAX_SOLVER_WORKERS = 2
+MAX_PENDING_JOBS = 8
+JOB_TIMEOUT = 600  # s
 
 def get_data(
         address,
@@ -24,6 +33,8 @@ def get_data(
         hvac_heating_capacity,
         electricity_csv_file=None,
         natural_gas_csv_file=None,
+        telemetry_callback=None,
+        customer_id=None,
     ):
     # Convert text input to float
     solar_size_kw = float(solar_size_kw)
@@ -50,16 +61,24 @@ def get_data(
         except Exception as e:
             print(f"Error getting Palmetto data: {e}")
     else:
-        solar_data = solar_size_kw * REF_SOLAR_DATA
-        elec_usage = process_pge_meterdata(electricity_csv_file.name)
+        solar_data = solar_size_kw * get_ref_solar_data()
+        if customer_id is not None:
+            # Customers ingested with `meterstore.py ingest` are read from the columnar store instead of their CSV
+            from meterstore import load_meter_series
+            elec_usage = trim_to_last_year(load_meter_series(customer_id))
+        else:
+            # A path, or a file object with the path in .name like Gradio's uploads
+            elec_usage = process_pge_meterdata(getattr(electricity_csv_file, 'name', electricity_csv_file))
 
     site_data = merge_solar_and_load_data(elec_usage, solar_data)
     tariff = build_tariff(site_data.index)
-    battery_dispatch = run_optimization(site_data, tariff, batt_e_max=batt_size_kwh)
+    battery_dispatch = run_optimization(site_data, tariff, batt_e_max=batt_size_kwh,
+                                        telemetry_callback=telemetry_callback)
     all_input = pd.concat([site_data, tariff, battery_dispatch], axis=1)
+    all_input['cost'] = get_interval_costs(all_input['P_grid'], all_input['px_buy'], all_input['px_sell'])
     return all_input
 
-def process_submission(
+def get_final_week(
         address,
         solar_size_kw,
         batt_size_kwh,
@@ -68,8 +87,7 @@ def process_submission(
         hvac_heating_capacity,
         csv_file
 ):
-
-    all_input = get_data(       
+    all_input = get_data(
         address,
         solar_size_kw,
         batt_size_kwh,
@@ -77,22 +95,81 @@ def process_submission(
         hvac_heat_pump_present,
         hvac_heating_capacity,
         csv_file)
-    
-
-    final_week = all_input.loc[all_input.index[-1] - pd.DateOffset(days=7):]
+    return all_input.loc[all_input.index[-1] - pd.DateOffset(days=7):]
 
-    # Plot the result
+def plot_final_week(final_week):
     fig, ax = plt.subplots()
     final_week.plot(ax=ax)
     return fig
 
+def process_submission(*inputs):
+    """Run the pipeline synchronously and plot the result"""
+    return plot_final_week(get_final_week(*inputs))
+
+@functools.cache
+def get_job_queue() -> JobQueue:
+    # Workers are forked from a fork server that has imported this module once, rather than from the multithreaded
+    # Gradio server, so they don't import Gradio and the solvers again for every job. It is preloaded by name because
+    # preloading '__main__' has no effect before Python 3.13.
+    return JobQueue(max_workers=MAX_SOLVER_WORKERS, max_pending=MAX_PENDING_JOBS, timeout=JOB_TIMEOUT,
+                    mp_context=get_default_mp_context(preload=['app']))
+
+def format_job_status(status: dict) -> str:
+    if status['status'] == 'queued':
+        return f"Queued ({status['position']} ahead)"
+    if status['status'] == 'running':
+        return f"Running for {time.time() - status['started']:.0f} s"
+    if status['status'] == 'failed':
+        return f"Failed: {status['error'].strip().splitlines()[-1]}"
+    return status['status'].capitalize()
+
+def submit_submission(*inputs):
+    """Queue the pipeline as a background job; returns the job id and its status"""
+    # Workers get the path of the upload rather than Gradio's file object
+    *equipment, csv_file = inputs
+    csv_path = getattr(csv_file, 'name', csv_file)
+    try:
+        job_id = get_job_queue().submit(get_final_week, *equipment, csv_path)
+    except QueueFullError:
+        raise gr.Error("The optimizer is busy with other requests; please try again in a minute.")
+    return job_id, format_job_status(get_job_queue().get_status(job_id))
+
+def poll_submission(job_id):
+    """Status of the job, and its plot once done"""
+    if not job_id:
+        return "", None
+    try:
+        status = get_job_queue().get_status(job_id)
+    except KeyError:
+        return "Expired", None
+    try:
+        fig = get_job_plot(job_id) if status['status'] == 'done' else None
+    except LookupError:
+        return "Expired", None  # the result was retrieved for a plot that has since left get_job_plot's cache
+    return format_job_status(status), fig
+
+@functools.lru_cache(maxsize=16)
+def get_job_plot(job_id):
+    """Plot of a finished job's result, drawn once rather than on every poll; the queue hands out results only once"""
+    fig = plot_final_week(get_job_queue().get_result(job_id))
+    plt.close(fig)
+    return fig
+
+def cancel_submission(job_id):
+    if job_id:
+        try:
+            get_job_queue().cancel(job_id)
+        except KeyError:
+            pass
+    return poll_submission(job_id)[0]
+
 
 if __name__ == '__main__':
 
-    # Define the Gradio interface
-    iface = gr.Interface(
-        fn=process_submission,  # Function to call on submit
-        inputs=[
+    # Define the Gradio interface. Submissions run as background jobs, so the page stays responsive and slow runs
+    # can be cancelled; the status and plot are polled every second.
+    with gr.Blocks() as demo:
+        inputs = [
             gr.Textbox(label="Enter your address:", value="20 West 34th Street, New York, NY 10118"),
             gr.Textbox(label="Enter solar array size (kW):", value="1.0", type="text"),
             gr.Textbox(label="Battery size (kWh):", value="13.5", type="text"),
@@ -100,9 +177,17 @@ if __name__ == '__main__':
             gr.Dropdown(label="Do you have a heat pump?", choices = ["Yes", "No"], value="No", type="value"),
             gr.Textbox(label="What is the heat pump capacity? (in kBtu/hr) ", value="0.0", type="text"),
             gr.File(label="Upload CSV File")
-        ],
-        outputs=[gr.Plot()],
-    )
+        ]
+        with gr.Row():
+            submit_button = gr.Button("Submit", variant="primary")
+            cancel_button = gr.Button("Cancel")
+        job_id = gr.Textbox(label="Job", interactive=False)
+        status = gr.Textbox(label="Status", interactive=False)
+        plot = gr.Plot()
+
+        submit_button.click(submit_submission, inputs=inputs, outputs=[job_id, status])
+        cancel_button.click(cancel_submission, inputs=job_id, outputs=status)
+        demo.load(poll_submission, inputs=job_id, outputs=[status, plot], every=1)
 
     # Launch the Gradio app
-    iface.launch()
+    demo.queue().launch()
@@ -2,8 +2,11 @@ import streamlit as st
 import pandas as pd
 import pathlib
 import os
+import threading
 import plotly.express as px
-from app import get_data
+from jobs import JobQueue, QueueFullError, get_default_mp_context
+from scenariostore import (ScenarioStore, BASELINE, get_all_scenarios, get_scenario_name, get_usage_hash,
+                           precompute_scenarios, solve_scenario)
 
 def get_package_root() -> pathlib.Path:
     return pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
@@ -31,45 +34,54 @@ def read_csv_personal_usage():
     return csv_file
 
 
-def run_scenario(
-        solar_size_kw = 0, 
-        batt_size_kwh = 0, 
-        ev_charging_present = "No",
-        hvac_heat_pump_present = "No",
-        address = "",
-        hvac_heating_capacity = 0.0
-):
-    """ Output average kwh consumption per month"""
-
-    # Default values
-
-    csv_file = read_csv_personal_usage()
-    
-    all_input = get_data(       
-        address,
-        solar_size_kw,
-        batt_size_kwh,
-        ev_charging_present,
-        hvac_heat_pump_present,
-        hvac_heating_capacity,
-        csv_file)
-    
-    df = all_input
-
-    # Function to filter data to last year
-    def filter_last_year(df):
-        max_date = df.index.max().normalize()
-        one_year_ago = max_date - pd.DateOffset(years=1)
-        return df[df.index >= one_year_ago]
-
-    # Filter to last year
-    df_last_year = filter_last_year(df)
-
-    #ATTENTION: is this the right column? The cost look not correct
-    df_last_year["cost"] = df_last_year.apply(lambda x: x.P_grid* x.px_buy if x.P_grid > 0 else x.P_grid * x.px_sell, axis = 1) 
-
-    return df_last_year
-
+# Every combination of options is solved once per usage history into the scenario store (see scenariostore.py).
+# The scenarios shown are solved right away if they aren't stored yet, and the rest are precomputed in a background
+# worker process, so later toggles only read their bills from the store.
+@st.cache_resource
+def get_scenario_store() -> ScenarioStore:
+    return ScenarioStore()
+
+
+@st.cache_resource
+def get_precompute_queue() -> JobQueue:
+    # One worker, so background precomputes never take more than one core from the solves users wait on. The fork
+    # server imports scenariostore (and the solver stack with it) once rather than in every job.
+    return JobQueue(max_workers=1, max_pending=4, mp_context=get_default_mp_context(preload=['scenariostore']))
+
+
+@st.cache_resource
+def get_precompute_jobs() -> tuple[dict, threading.Lock]:
+    """Precompute job id per usage hash, shared by all sessions, and the lock guarding it"""
+    return {}, threading.Lock()
+
+
+def start_precompute(usage_hash, csv_path):
+    """Queue a background precompute of the usage history's missing scenarios, unless one is already queued"""
+    queue = get_precompute_queue()
+    jobs, lock = get_precompute_jobs()
+    # Sessions run in their own threads, so check and submit under the lock to queue one job per usage history
+    with lock:
+        job_id = jobs.get(usage_hash)
+        if job_id is not None:
+            try:
+                if queue.get_status(job_id)['status'] in ('queued', 'running'):
+                    return
+            except KeyError:
+                pass
+        if get_scenario_store().get_missing(usage_hash):
+            try:
+                jobs[usage_hash] = queue.submit(precompute_scenarios, csv_path, get_scenario_store().directory)
+            except QueueFullError:
+                pass  # retried on the next rerun; missing scenarios are solved on demand meanwhile
+
+
+def get_scenario_bills(usage_hash, csv_path, scenario):
+    """Monthly bills of a scenario from the store, solving and storing it first if needed"""
+    store = get_scenario_store()
+    if not store.has(usage_hash, scenario):
+        with st.spinner("Optimizing your energy use..."):
+            solve_scenario(store, usage_hash, csv_path, scenario)
+    return store.read_bills(usage_hash, scenario)
 
 
 # Create tabs
@@ -86,30 +98,15 @@ with tabs[0]:
         csv_file = st.file_uploader("Upload CSV File", type=["csv"])
 
 def select_scenario(option_pv, option_bat, option_bev, option_hvac):
-    """ Select scenarios, currently preselected to computation time"""
-
-    df_default = run_scenario(solar_size_kw = 0)
-
-    if (option_pv == True) & (option_bat==False) & (option_bev==False) & (option_hvac==False): 
-        df = run_scenario(solar_size_kw = 1.0) # Assumption for optimal solar power
-    elif (option_pv == True) & (option_bat==True) & (option_bev==False) & (option_hvac==False):
-        df = run_scenario(solar_size_kw = 1.0, 
-                     batt_size_kwh = 13.5)
-    elif (option_pv == True) & (option_bat==True) & (option_bev==True) & (option_hvac==False):
-        df = run_scenario(solar_size_kw = 1.0, 
-                     batt_size_kwh = 13.5, 
-                     ev_charging_present = "Yes",
-                     )
-    elif (option_pv == True) & (option_bat==True) & (option_bev==True) & (option_hvac==True):
-        df = run_scenario(solar_size_kw = 13.0, 
-                     batt_size_kwh = 13.5, 
-                     ev_charging_present = "Yes",
-                     hvac_heat_pump_present = "Yes",
-                    hvac_heating_capacity = 1.0 
-                     ) 
-    else:
-        df = df_default
-    return df_default, df       
+    """ Monthly bills without any options and with the selected ones"""
+    csv_path = read_csv_personal_usage().name
+    usage_hash = get_usage_hash(csv_path)
+    scenario = get_scenario_name(option_pv, option_bat, option_bev, option_hvac)
+
+    bills = get_scenario_bills(usage_hash, csv_path, scenario)
+    bills_default = get_scenario_bills(usage_hash, csv_path, BASELINE)
+    start_precompute(usage_hash, csv_path)
+    return usage_hash, [BASELINE, scenario], bills_default, bills
 
 with tabs[1]:
     st.header("Your Battery Bot Analysis")
@@ -123,18 +120,20 @@ with tabs[1]:
         option_bat = st.checkbox("Battery")
         option_bev = st.checkbox("Electric Vehicle")
         option_hvac = st.checkbox("Heat Pump HVAC")
-        df_default, df = select_scenario(
+        usage_hash, scenarios, bills_default, bills = select_scenario(
             option_pv,
             option_bat,
             option_bev,
             option_hvac
             )
+        n_stored = len(get_all_scenarios()) - len(get_scenario_store().get_missing(usage_hash))
+        st.caption(f"{n_stored} of {len(get_all_scenarios())} option combinations ready")
 
     # Caclulate Monthly Costs
     with col2:
         st.title('Monthly Cost Overview')
-        monthly_cost = df['cost'].resample('M').sum().reset_index()
-        monthly_cost['Month'] = monthly_cost['Datetime'].dt.strftime('%B %Y')
+        monthly_cost = bills.reset_index()
+        monthly_cost['Month'] = monthly_cost['month'].dt.strftime('%B %Y')
         fig = px.bar(monthly_cost, x='Month', y='cost', title='Monthly Costs (Aggregated)', labels={'cost': 'Cost in USD'}, color='cost', height=500)
 
         st.plotly_chart(fig, use_container_width=True)
@@ -142,13 +141,18 @@ with tabs[1]:
 
     #  Price total
     with col3:
-        old_monthly_cost = df_default["cost"].sum()/12
-        new_monthly_cost = df['cost'].sum()/12
+        old_monthly_cost = bills_default.sum()/12
+        new_monthly_cost = bills.sum()/12
         ten_year_savings = (old_monthly_cost - new_monthly_cost)*12*10 
         st.metric(label="Today's Monthly Price", value=f"${old_monthly_cost:.2f}")
         st.metric(label="New Monthly Price", value=f"${new_monthly_cost:.2f}")
         st.metric(label="Savings over 10 years", value=f"${ten_year_savings:.2f}")
 
+    with st.expander("Solver telemetry"):
+        # Telemetry of the solves behind the results shown, whether they were solved on this run or earlier
+        st.dataframe(pd.concat([get_scenario_store().read_telemetry(usage_hash, scenario).assign(scenario=scenario)
+                                for scenario in dict.fromkeys(scenarios)], ignore_index=True))
+
 
 
     
@@ -1,65 +1,366 @@
-from solar import REF_SOLAR_DATA
+from solar import get_ref_solar_data
 
 import cvxpy as cp
 import pandas as pd
 import numpy as np
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import threading
 import time
+import warnings
 
 from dotenv import load_dotenv
 
+from billing import get_interval_costs, get_elapsed_days, get_daily_average_costs
 from utils import merge_solar_and_load_data
 
 load_dotenv(dotenv_path = "../.env")  # load from .env
 
+logger = logging.getLogger(__name__)
+
+# The default C++ canonicalization backend grows quadratically with horizon length on these problems
+CANON_BACKEND = cp.SCIPY_CANON_BACKEND
+# CVXPY warns about long parameter vectors on the assumption of the C++ backend; the SciPy backend handles them fine
+warnings.filterwarnings("ignore", message="Your problem has too many parameters for efficient DPP compilation")
+
+
+def get_solve_telemetry(prob: cp.Problem, problem_name: str, n: int, build_time: float, wall_time: float) -> dict:
+    """
+    Structured record of one solve, for monitoring and spotting slow solves.
+    :param build_time: Seconds spent constructing the CVXPY problem; 0 when a cached problem was reused.
+    :param wall_time: Seconds spent in Problem.solve, including compilation.
+    """
+    stats = prob.solver_stats
+    return {
+        'problem': problem_name,
+        'n': n,
+        'build_time_s': build_time,
+        'compile_time_s': prob.compilation_time,
+        'solve_time_s': stats.solve_time,
+        'wall_time_s': wall_time,
+        'solver': stats.solver_name,
+        'status': prob.status,
+        'objective': prob.value,
+        'num_iters': stats.num_iters,
+        'n_variables': sum(v.size for v in prob.variables()),
+        'n_constraints': sum(c.size for c in prob.constraints),
+    }
+
+
+def emit_solve_telemetry(record: dict, telemetry_callback=None):
+    """Log a telemetry record, with the full record attached as `telemetry`, and pass it to the callback if given"""
+    logger.info(f"{record['problem']} optimization {record['status']} in {record['wall_time_s']:.3f} seconds "
+                f"(compile {record['compile_time_s']:.3f} s)", extra={'telemetry': record})
+    if telemetry_callback is not None:
+        telemetry_callback(record)
+
+
+def set_initial_dispatch(P_batt_charge: cp.Variable, P_batt_discharge: cp.Variable, P_grid_buy: cp.Variable,
+                         P_grid_sell: cp.Variable, E: cp.Variable, initial_dispatch: pd.DataFrame, e_0: float):
+    """Seed the dispatch variables from a previous result (P_batt, P_grid, E columns) for a warm start"""
+    P_batt = initial_dispatch['P_batt'].to_numpy(dtype=float)
+    P_grid = initial_dispatch['P_grid'].to_numpy(dtype=float)
+    P_batt_charge.value = np.minimum(P_batt, 0)
+    P_batt_discharge.value = np.maximum(P_batt, 0)
+    P_grid_buy.value = np.maximum(P_grid, 0)
+    P_grid_sell.value = np.minimum(P_grid, 0)
+    E.value = np.concatenate([[e_0], initial_dispatch['E'].to_numpy(dtype=float)])
+
+
+def battery_constraints(P_batt_charge: cp.Variable, P_batt_discharge: cp.Variable, E: cp.Variable,
+                        batt_e_max, batt_p_max, eff_charge, eff_discharge_inv,
+                        dt=1.0, backup_reserve=0.2, e_0=None) -> list:
+    """
+    Power and state-of-charge constraints for a single battery, shared by the dispatch and sizing problems.
+    The state-of-charge update is written as a difference of slices of E rather than a dense n x (n+1) transition
+    matrix, so problem size stays linear in the horizon length.
+    :param E: State of charge with one more entry than the power variables; E[0] is the initial state.
+    :param batt_e_max: Energy capacity; may be a constant, Parameter or (for sizing) an affine Expression.
+    :param eff_charge: One-way charging efficiency.
+    :param eff_discharge_inv: Inverse of the one-way discharging efficiency.
+    :param e_0: Initial state of charge; defaults to the backup reserve.
+    :return: List of CVXPY constraints.
+    """
+    e_min = backup_reserve * batt_e_max
+    if e_0 is None:
+        e_0 = e_min
+    return [-batt_p_max <= P_batt_charge,
+            P_batt_charge <= 0,
+            0 <= P_batt_discharge,
+            P_batt_discharge <= batt_p_max,
+            e_min <= E,
+            E <= batt_e_max,
+            E[1:] == E[:-1] - (P_batt_charge * eff_charge + P_batt_discharge * eff_discharge_inv) * dt,
+            E[0] == e_0
+            ]
+
+
+class DispatchProblem:
+    """Parameterized battery dispatch LP for a fixed horizon length.
+
+    The CVXPY problem is built and canonicalized on the first solve only; later solves just update the
+    parameter values (load, solar, prices, battery size and efficiency) and re-run the solver.
+    """
+
+    def __init__(self, n: int, dt: float = 1.0, backup_reserve: float = 0.2):
+        build_start = time.time()
+        self.n = n
+        self._lock = threading.Lock()
+
+        self.load = cp.Parameter(n)
+        self.solar = cp.Parameter(n)
+        self.px_buy = cp.Parameter(n)
+        self.px_sell = cp.Parameter(n)
+        self.e_max = cp.Parameter(nonneg=True)
+        self.p_max = cp.Parameter(nonneg=True)
+        # Division by a parameter is not DPP, so charge and discharge efficiencies are separate parameters
+        self.eff_charge = cp.Parameter(nonneg=True)
+        self.eff_discharge_inv = cp.Parameter(nonneg=True)
+        # Initial state of charge, and bounds on the final one, so horizons can be chained
+        self.e_0 = cp.Parameter(nonneg=True)
+        self.e_end = cp.Parameter(nonneg=True)
+        self.e_end_max = cp.Parameter(nonneg=True)
+        self.backup_reserve = backup_reserve
+
+        self.P_batt_charge = cp.Variable(n)
+        self.P_batt_discharge = cp.Variable(n)
+        self.P_grid_buy = cp.Variable(n)
+        self.P_grid_sell = cp.Variable(n)
+        self.E = cp.Variable(n+1)
+
+        # Power flows are all AC, and are signed relative to the bus: injections to the bus are positive, withdrawals/exports from the bus are negative
+
+        constraints = battery_constraints(self.P_batt_charge, self.P_batt_discharge, self.E,
+                                          self.e_max, self.p_max, self.eff_charge, self.eff_discharge_inv,
+                                          dt=dt, backup_reserve=backup_reserve, e_0=self.e_0)
+        constraints += [self.E[-1] >= self.e_end,
+                        self.E[-1] <= self.e_end_max,
+                        0 <= self.P_grid_buy,
+                        self.P_grid_sell <= 0,
+                        self.P_batt_charge + self.P_batt_discharge + self.P_grid_buy + self.P_grid_sell - self.load + self.solar == 0,
+                        ]
+
+        obj = cp.Minimize(self.P_grid_sell @ self.px_sell + self.P_grid_buy @ self.px_buy)
+
+        self.prob = cp.Problem(obj, constraints)
+        # Reported in the telemetry of the first solve only, since later solves reuse the problem
+        self._build_time = time.time() - build_start
+
+    def solve(self, site_data: pd.DataFrame, tariff: pd.DataFrame, batt_rt_eff=0.85,
+              batt_e_max=13.5, batt_p_max=5, batt_e_0=None, batt_e_end=None,
+              fix_e_end=False, solver=None, solver_opts=None, warm_start=False, initial_dispatch=None,
+              telemetry_callback=None) -> pd.DataFrame:
+        """
+        Solve the dispatch for new inputs. batt_e_0 and batt_e_end default to the backup reserve, which leaves the
+        final state of charge unconstrained.
+        :param fix_e_end: Hold the final state of charge at exactly batt_e_end, rather than at least batt_e_end.
+        :param solver: CVXPY solver name, e.g. cp.OSQP; defaults to CVXPY's choice.
+        :param solver_opts: Extra keyword arguments for the solver, e.g. tolerances.
+        :param warm_start: Passed to CVXPY, which starts OSQP and SCS from the previous solution of this problem;
+            the default interior-point solver, CLARABEL, ignores it.
+        :param initial_dispatch: Previous result to warm-start from instead; implies warm_start.
+        :param telemetry_callback: Called with the solve's telemetry record, see get_solve_telemetry.
+        """
+        assert site_data.shape[0] == self.n, f"Expected {self.n} timesteps, got {site_data.shape[0]}"
+        oneway_eff = np.sqrt(batt_rt_eff)
+        e_min = self.backup_reserve * batt_e_max
+
+        # The parameters and variables are shared state, so one solve at a time per problem
+        with self._lock:
+            self.load.value = site_data['load'].to_numpy(dtype=float)
+            self.solar.value = site_data['solar'].to_numpy(dtype=float)
+            self.px_buy.value = tariff['px_buy'].to_numpy(dtype=float)
+            self.px_sell.value = tariff['px_sell'].to_numpy(dtype=float)
+            self.e_max.value = batt_e_max
+            self.p_max.value = batt_p_max
+            self.eff_charge.value = oneway_eff
+            self.eff_discharge_inv.value = 1 / oneway_eff
+            self.e_0.value = e_min if batt_e_0 is None else batt_e_0
+            self.e_end.value = e_min if batt_e_end is None else batt_e_end
+            self.e_end_max.value = self.e_end.value if fix_e_end else batt_e_max
+            if initial_dispatch is not None:
+                set_initial_dispatch(self.P_batt_charge, self.P_batt_discharge, self.P_grid_buy, self.P_grid_sell,
+                                     self.E, initial_dispatch, self.e_0.value)
+                warm_start = True
+
+            opt_start = time.time()
+            self.prob.solve(solver=solver, canon_backend=CANON_BACKEND, warm_start=warm_start, **(solver_opts or {}))
+            record = get_solve_telemetry(self.prob, 'dispatch', self.n, self._build_time, time.time() - opt_start)
+            self._build_time = 0.0
+
+            res = pd.DataFrame.from_dict({'P_batt': self.P_batt_charge.value + self.P_batt_discharge.value,
+                                'P_grid': self.P_grid_buy.value + self.P_grid_sell.value,
+                                'E': self.E[1:].value}).set_index(site_data.index)
+        emit_solve_telemetry(record, telemetry_callback)
+        return res
+
+
+@functools.lru_cache(maxsize=8)
+def get_dispatch_problem(n: int) -> DispatchProblem:
+    """Cached DispatchProblem for a horizon of n timesteps, so repeated runs only pay the compile cost once."""
+    return DispatchProblem(n)
+
 
 def run_optimization(site_data: pd.DataFrame, tariff: pd.DataFrame, batt_rt_eff=0.85,
-                     batt_e_max=13.5, batt_p_max=5) -> pd.DataFrame:
+                     batt_e_max=13.5, batt_p_max=5, batt_e_0=None, batt_e_end=None, fix_e_end=False,
+                     solver=None, solver_opts=None, warm_start=False, initial_dispatch=None,
+                     telemetry_callback=None) -> pd.DataFrame:
+    """
+    Optimal battery dispatch against the tariff. The problem is compiled once per horizon length, so repeated runs
+    only pay for the solve. fix_e_end, solver, solver_opts, warm_start and initial_dispatch are passed to
+    DispatchProblem.solve.
+    Solve telemetry is logged, and passed to telemetry_callback if given.
+    """
     assert site_data.index.equals(tariff.index), "Dataframes must have the same index"
 
-    dt = 1.0 
+    prob = get_dispatch_problem(site_data.shape[0])
+    return prob.solve(site_data, tariff, batt_rt_eff=batt_rt_eff, batt_e_max=batt_e_max, batt_p_max=batt_p_max,
+                      batt_e_0=batt_e_0, batt_e_end=batt_e_end, fix_e_end=fix_e_end,
+                      solver=solver, solver_opts=solver_opts,
+                      warm_start=warm_start, initial_dispatch=initial_dispatch,
+                      telemetry_callback=telemetry_callback)
+
+
+def run_dp_optimization(site_data: pd.DataFrame, tariff: pd.DataFrame, batt_rt_eff=0.85,
+                        batt_e_max=13.5, batt_p_max=5, soc_steps=201) -> pd.DataFrame:
+    """
+    Solver-free alternative to run_optimization: dynamic programming over a discretized state-of-charge grid.
+    The battery moves between grid points each timestep, so the result is slightly suboptimal; the gap shrinks as
+    soc_steps grows, while runtime grows with soc_steps ** 2.
+    :param soc_steps: Number of state-of-charge grid points between the backup reserve and batt_e_max.
+    :return: DataFrame with P_batt, P_grid and E, like run_optimization.
+    """
+    assert site_data.index.equals(tariff.index), "Dataframes must have the same index"
+
+    dt = 1.0
 
     oneway_eff = np.sqrt(batt_rt_eff)
     backup_reserve = 0.2
     e_min = backup_reserve * batt_e_max
 
     n = site_data.shape[0]
-    E_0 = e_min
-
-    E_transition = np.hstack([np.eye(n), np.zeros(n).reshape(-1,1)])
-
-    P_batt_charge = cp.Variable(n)
-    P_batt_discharge = cp.Variable(n)
-    P_grid_buy = cp.Variable(n)
-    P_grid_sell = cp.Variable(n)
-    E = cp.Variable(n+1)
-
-    # Power flows are all AC, and are signed relative to the bus: injections to the bus are positive, withdrawals/exports from the bus are negative
-
-    constraints = [-batt_p_max <= P_batt_charge,
-                P_batt_charge <= 0,
-                0 <= P_batt_discharge,
-                P_batt_discharge <= batt_p_max,
-                0 <= P_grid_buy,
-                P_grid_sell <= 0,
-                e_min <= E,
-                E <= batt_e_max,
-                E[1:] == E_transition @ E - (P_batt_charge * oneway_eff + P_batt_discharge / oneway_eff) * dt,
-                P_batt_charge + P_batt_discharge + P_grid_buy + P_grid_sell - site_data['load'] + site_data['solar'] == 0,
-                E[0] == E_0
-                ]
-
-    obj = cp.Minimize(P_grid_sell @ tariff['px_sell'] + P_grid_buy @ tariff['px_buy'])
+    net_load = (site_data['load'] - site_data['solar']).to_numpy(dtype=float)
+    px_buy = tariff['px_buy'].to_numpy(dtype=float)
+    px_sell = tariff['px_sell'].to_numpy(dtype=float)
+
+    # On a uniform grid a move from grid point i to i + d costs the same for every i, so each timestep only has
+    # one cost per feasible step d, limited by the power rating
+    e_grid = np.linspace(e_min, batt_e_max, soc_steps)
+    e_step = e_grid[1] - e_grid[0] if soc_steps > 1 else 0.0
+    if e_step > 0:
+        d_lo = -min(int(np.floor(batt_p_max * dt / (oneway_eff * e_step) + 1e-9)), soc_steps - 1)
+        d_hi = min(int(np.floor(batt_p_max * oneway_eff * dt / e_step + 1e-9)), soc_steps - 1)
+    else:
+        d_lo = d_hi = 0
+    dE = np.arange(d_lo, d_hi + 1) * e_step
+    p_batt = np.where(dE > 0, -dE / (oneway_eff * dt), -dE * oneway_eff / dt)
+    p_grid = net_load[:, None] - p_batt[None, :]
+    step_cost = np.where(p_grid > 0, px_buy[:, None], px_sell[:, None]) * p_grid
+
+    # Backward pass: value_to_go[i] is the cheapest cost from grid point i to the end of the horizon.
+    # Padding with inf rules out steps off either end of the grid, and a sliding window lines up value_to_go[i + d]
+    policy = np.empty((n, soc_steps), dtype=np.int16)
+    padded = np.full(soc_steps + d_hi - d_lo, np.inf)
+    value_to_go = padded[-d_lo:soc_steps - d_lo]
+    value_to_go[:] = 0
+    windows = np.lib.stride_tricks.sliding_window_view(padded, d_hi - d_lo + 1)
+    rows = np.arange(soc_steps)
+    for t in range(n - 1, -1, -1):
+        total = step_cost[t] + windows
+        best = total.argmin(axis=1)
+        policy[t] = best
+        value_to_go[:] = total[rows, best]
+
+    # Forward pass from the initial state at the backup reserve
+    steps = np.empty(n, dtype=np.int64)
+    state = 0
+    for t in range(n):
+        steps[t] = policy[t, state]
+        state += steps[t] + d_lo
+    states = np.cumsum(steps + d_lo)
+
+    P_batt = p_batt[steps]
+    res = pd.DataFrame.from_dict({'P_batt': P_batt,
+                                  'P_grid': net_load - P_batt,
+                                  'E': e_grid[states]}).set_index(site_data.index)
+    return res
 
-    prob = cp.Problem(obj, constraints)
 
-    opt_start = time.time()
-    prob.solve()
-    print(f"Optimization done in {time.time() - opt_start :.3f} seconds")
+def _solve_window(args: tuple) -> pd.DataFrame:
+    site_data, tariff, opt_kwargs = args
+    return run_optimization(site_data, tariff, **opt_kwargs)
+
+
+def run_rolling_horizon_optimization(site_data: pd.DataFrame, tariff: pd.DataFrame, batt_rt_eff=0.85,
+                                     batt_e_max=13.5, batt_p_max=5,
+                                     window='1D', lookahead=None,
+                                     parallel=False, max_workers=None, window_soc=None) -> pd.DataFrame:
+    """
+    Dispatch the battery over a sequence of short windows instead of one full-horizon LP.
+
+    By default this is model-predictive control: each window is solved together with `lookahead` of future data,
+    only the window itself is kept, and its final state of charge becomes the next window's initial state.
+    With parallel=True every window instead starts and ends at the same fixed state of charge, window_soc, which
+    makes the windows independent so they are solved in a process pool. Each window is solved over exactly its own
+    span, and the stitched schedule stays consistent across window boundaries.
+    Windows line up with the start of site_data, so daily windows should start at midnight.
+    :param window: Length of each committed window, e.g. '1D' or '7D'.
+    :param lookahead: Extra data each window is optimized over, beyond the committed window; defaults to '1D'.
+        Not supported with parallel=True.
+    :param max_workers: Process pool size for parallel=True; defaults to the number of CPUs.
+    :param window_soc: State of charge at every window boundary with parallel=True, as a fraction of batt_e_max;
+        defaults to the backup reserve.
+    :return: DataFrame with P_batt, P_grid and E, like run_optimization.
+    """
+    assert site_data.index.equals(tariff.index), "Dataframes must have the same index"
 
-    res = pd.DataFrame.from_dict({'P_batt': P_batt_charge.value + P_batt_discharge.value,
-                        'P_grid': P_grid_buy.value + P_grid_sell.value,
-                        'E': E[1:].value}).set_index(site_data.index)
-    return res
+    dt = 1.0
+    backup_reserve = 0.2
+    n = site_data.shape[0]
+    window_steps = int(pd.Timedelta(window) / pd.Timedelta(hours=dt))
+    opt_kwargs = dict(batt_rt_eff=batt_rt_eff, batt_e_max=batt_e_max, batt_p_max=batt_p_max)
+    starts = range(0, n, window_steps)
+
+    if parallel:
+        if lookahead is not None:
+            raise ValueError("Parallel windows end at a fixed state of charge, so they don't take a lookahead")
+        e_target = (backup_reserve if window_soc is None else window_soc) * batt_e_max
+        window_kwargs = dict(opt_kwargs, batt_e_0=e_target, batt_e_end=e_target, fix_e_end=True)
+        windows = [(site_data.iloc[k:k + window_steps], tariff.iloc[k:k + window_steps], window_kwargs)
+                   for k in starts]
+        max_workers = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(windows) // (4 * max_workers))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_solve_window, windows, chunksize=chunksize))
+        return pd.concat(results)
+
+    lookahead_steps = int(pd.Timedelta(lookahead or '1D') / pd.Timedelta(hours=dt))
+    results = []
+    e_0 = None
+    for k in starts:
+        end = min(k + window_steps + lookahead_steps, n)
+        res = run_optimization(site_data.iloc[k:end], tariff.iloc[k:end], batt_e_0=e_0, **opt_kwargs)
+        res = res.iloc[:window_steps]
+        # Solver tolerance can leave E a hair outside its bounds, which would make the next window infeasible
+        e_0 = float(np.clip(res['E'].iloc[-1], backup_reserve * batt_e_max, batt_e_max))
+        results.append(res)
+    return pd.concat(results)
+
+
+def get_rolling_horizon_cost_gap(site_data: pd.DataFrame, tariff: pd.DataFrame, **kwargs) -> dict:
+    """
+    Cost of run_rolling_horizon_optimization against the full-horizon optimum from run_optimization.
+    :param kwargs: Passed to run_rolling_horizon_optimization; the battery parameters also to run_optimization.
+    :return: Dict with the 'rolling' and 'full' average daily costs and their difference 'gap', in $/day.
+    """
+    battery_kwargs = {key: kwargs[key] for key in ('batt_rt_eff', 'batt_e_max', 'batt_p_max') if key in kwargs}
+    full = run_optimization(site_data, tariff, **battery_kwargs)
+    rolling = run_rolling_horizon_optimization(site_data, tariff, **kwargs)
+    full_cost = get_daily_cost_from_pgrid(full['P_grid'], tariff)
+    rolling_cost = get_daily_cost_from_pgrid(rolling['P_grid'], tariff)
+    return {'rolling': rolling_cost, 'full': full_cost, 'gap': rolling_cost - full_cost}
 
 
 def run_endogenous_sizing_optimization(site_data: pd.DataFrame,
@@ -70,10 +371,21 @@ def run_endogenous_sizing_optimization(site_data: pd.DataFrame,
                      batt_block_e_max=13.5,
                      batt_p_max=5,
                                        integer_problem=False,
+                     solver=None,
+                     solver_opts=None,
+                     initial_dispatch=None,
+                     initial_sizes=None,
+                     telemetry_callback=None,
                      ) -> tuple[float, float, pd.DataFrame]:
+    """
+    Assumes that solar data in the site_data is per kW.
+    solver and solver_opts are passed to CVXPY. To warm-start from a previous run, pass its dispatch as
+    initial_dispatch and optionally its (n_batts, s_size_kw) as initial_sizes.
+    Solve telemetry is logged, and passed to telemetry_callback if given.
+    """
     assert site_data.index.equals(tariff.index), "Dataframes must have the same index"
+    build_start = time.time()
 
-    """Assumes that solar data in the site_data is per kW"""
     simulation_years = (site_data.index[-1] - site_data.index[0]).total_seconds() / (365 * 24 * 60 * 60)
 
     dt = 1.0
@@ -81,13 +393,10 @@ def run_endogenous_sizing_optimization(site_data: pd.DataFrame,
     oneway_eff = np.sqrt(batt_rt_eff)
     backup_reserve = 0.2
     n = site_data.shape[0]
-    E_transition = np.hstack([np.eye(n), np.zeros(n).reshape(-1,1)])
 
     s_size_kw = cp.Variable(integer=integer_problem)
     n_batts = cp.Variable(integer=integer_problem)
     batt_e_max = n_batts * batt_block_e_max
-    e_min = backup_reserve * batt_e_max
-    E_0 = e_min
     P_batt_charge = cp.Variable(n)
     P_batt_discharge = cp.Variable(n)
     P_grid_buy = cp.Variable(n)
@@ -96,22 +405,16 @@ def run_endogenous_sizing_optimization(site_data: pd.DataFrame,
 
     # Power flows are all AC, and are signed relative to the bus: injections to the bus are positive, withdrawals/exports from the bus are negative
 
-    constraints = [-batt_p_max <= P_batt_charge,
-                   P_batt_charge <= 0,
-                   0 <= s_size_kw,
-                   s_size_kw <= 15,
-                   0 <= n_batts,
-                   n_batts <= 10,
-                   0 <= P_batt_discharge,
-                   P_batt_discharge <= batt_p_max,
-                   0 <= P_grid_buy,
-                   P_grid_sell <= 0,
-                   e_min <= E,
-                   E <= batt_e_max,
-                   E[1:] == E_transition @ E - (P_batt_charge * oneway_eff + P_batt_discharge / oneway_eff) * dt,
-                   P_batt_charge + P_batt_discharge + P_grid_buy + P_grid_sell - site_data['load'] + s_size_kw * site_data['solar'] == 0,
-                   E[0] == E_0
-                   ]
+    constraints = battery_constraints(P_batt_charge, P_batt_discharge, E, batt_e_max, batt_p_max,
+                                      oneway_eff, 1 / oneway_eff, dt=dt, backup_reserve=backup_reserve)
+    constraints += [0 <= s_size_kw,
+                    s_size_kw <= 15,
+                    0 <= n_batts,
+                    n_batts <= 10,
+                    0 <= P_grid_buy,
+                    P_grid_sell <= 0,
+                    P_batt_charge + P_batt_discharge + P_grid_buy + P_grid_sell - site_data['load'] + s_size_kw * site_data['solar'] == 0,
+                    ]
 
     obj = cp.Minimize(P_grid_sell @ tariff['px_sell'] +
                       P_grid_buy @ tariff['px_buy'] +
@@ -120,10 +423,18 @@ def run_endogenous_sizing_optimization(site_data: pd.DataFrame,
                       )
 
     prob = cp.Problem(obj, constraints)
+    build_time = time.time() - build_start
+
+    warm_start = initial_dispatch is not None or initial_sizes is not None
+    if initial_sizes is not None:
+        n_batts.value, s_size_kw.value = initial_sizes
+    if initial_dispatch is not None:
+        e_0 = backup_reserve * batt_block_e_max * (initial_sizes[0] if initial_sizes is not None else 0)
+        set_initial_dispatch(P_batt_charge, P_batt_discharge, P_grid_buy, P_grid_sell, E, initial_dispatch, e_0)
 
     opt_start = time.time()
-    prob.solve()
-    print(f"Optimization done in {time.time() - opt_start :.3f} seconds")
+    prob.solve(solver=solver, canon_backend=CANON_BACKEND, warm_start=warm_start, **(solver_opts or {}))
+    emit_solve_telemetry(get_solve_telemetry(prob, 'sizing', n, build_time, time.time() - opt_start), telemetry_callback)
 
     res = pd.DataFrame.from_dict({'P_batt': P_batt_charge.value + P_batt_discharge.value,
                         'P_grid': P_grid_buy.value + P_grid_sell.value,
@@ -135,8 +446,10 @@ def optimization_usage_from_batt_solar_size(elec_usage:pd.Series,
                                             tariff: pd.DataFrame,
                                             solar_size_kw: float,
                                             batt_size_kwh:float,
-                                            solar_series_per_kw: pd.Series = REF_SOLAR_DATA,
+                                            solar_series_per_kw: pd.Series = None,
                                             ) -> pd.DataFrame:
+    if solar_series_per_kw is None:
+        solar_series_per_kw = get_ref_solar_data()
     site_data = merge_solar_and_load_data(elec_usage, solar_size_kw * solar_series_per_kw)
     battery_dispatch = run_optimization(site_data, tariff, batt_e_max=batt_size_kwh)
     return battery_dispatch
@@ -146,23 +459,220 @@ def get_daily_cost_from_pgrid(elec_usage:pd.Series,
                               tariff: pd.DataFrame,
                               ) -> float:
     assert isinstance(elec_usage.index, pd.DatetimeIndex), "Must have a Datetimeindex"
-    p_grid_buy = elec_usage.clip(lower=0)
-    p_grid_sell = elec_usage.clip(upper=0)
-    total_cost = ((p_grid_buy @ tariff['px_buy']) + (p_grid_sell @ tariff['px_sell'])).sum()
-    elapsed_days = (elec_usage.index[-1] - elec_usage.index[0]).days
-    return total_cost / elapsed_days
+    total_cost = get_interval_costs(elec_usage.to_numpy(), tariff['px_buy'].to_numpy(),
+                                    tariff['px_sell'].to_numpy()).sum()
+    return total_cost / get_elapsed_days(elec_usage.index)
 
 
 def get_daily_optimized_cost(elec_usage:pd.Series,
                              tariff: pd.DataFrame,
                              solar_size_kw: float,
                              batt_size_kwh:float,
-                             solar_series_per_kw: pd.Series = REF_SOLAR_DATA,) -> float:
+                             solar_series_per_kw: pd.Series = None,) -> float:
+    if solar_series_per_kw is None:
+        solar_series_per_kw = get_ref_solar_data()
     site_data = merge_solar_and_load_data(elec_usage, solar_size_kw * solar_series_per_kw)
     res = run_optimization(site_data, tariff, batt_e_max=batt_size_kwh)
 
     return get_daily_cost_from_pgrid(res['P_grid'], tariff)
 
+def _replay_telemetry(labelled_records, telemetry_callback=None):
+    """Pass telemetry records collected in worker processes to a callback in this process, tagged with their label"""
+    if telemetry_callback is None:
+        return
+    for label, records in labelled_records:
+        for record in records:
+            telemetry_callback(dict(record, scenario=label))
+
+
+def _sweep_batt_sizes(args: tuple) -> tuple[list[float], list[dict]]:
+    site_data_per_kw, tariff, solar_size_kw, batt_sizes_kwh, opt_kwargs = args
+    site_data = site_data_per_kw.assign(solar=solar_size_kw * site_data_per_kw['solar'])
+    costs, records = [], []
+    for batt_size_kwh in batt_sizes_kwh:
+        res = run_optimization(site_data, tariff, batt_e_max=batt_size_kwh, telemetry_callback=records.append,
+                               **opt_kwargs)
+        costs.append(get_daily_cost_from_pgrid(res['P_grid'], tariff))
+    return costs, records
+
+
+def get_daily_optimized_cost_surface(elec_usage: pd.Series,
+                                     tariff: pd.DataFrame,
+                                     solar_sizes_kw,
+                                     batt_sizes_kwh,
+                                     solar_series_per_kw: pd.Series = None,
+                                     max_workers=None,
+                                     telemetry_callback=None,
+                                     **opt_kwargs) -> pd.DataFrame:
+    """
+    Evaluate get_daily_optimized_cost over a grid of solar and battery sizes.
+    Load and solar are merged once, and each solar size is swept over all battery sizes in one worker process,
+    reusing the compiled problem.
+    :param max_workers: Process pool size; defaults to the number of CPUs, and 1 runs serially in this process.
+    :param telemetry_callback: Called in this process with each solve's telemetry record, tagged with its solar size.
+    :param opt_kwargs: Passed through to run_optimization, except batt_e_max, which batt_sizes_kwh sets.
+    :return: Average daily cost, indexed by battery size (kWh) with a column per solar size (kW).
+    """
+    if 'batt_e_max' in opt_kwargs:
+        raise ValueError("batt_e_max is set by batt_sizes_kwh; pass the battery sizes there instead")
+    if solar_series_per_kw is None:
+        solar_series_per_kw = get_ref_solar_data()
+    site_data_per_kw = merge_solar_and_load_data(elec_usage, solar_series_per_kw.copy())
+    batt_sizes_kwh = sorted(batt_sizes_kwh)
+    tasks = [(site_data_per_kw, tariff, solar_size_kw, batt_sizes_kwh, opt_kwargs) for solar_size_kw in solar_sizes_kw]
+    results = _map_scenarios(_sweep_batt_sizes, tasks, max_workers=max_workers)
+    _replay_telemetry(zip(solar_sizes_kw, (records for _, records in results)), telemetry_callback)
+
+    return pd.DataFrame(dict(zip(solar_sizes_kw, (costs for costs, _ in results))),
+                        index=pd.Index(batt_sizes_kwh, name='batt_size_kwh')).rename_axis(columns='solar_size_kw')
+
+
+def _run_scenario(args: tuple) -> tuple[pd.DataFrame, list[dict]]:
+    site_data, tariff, opt_kwargs = args
+    records = []
+    res = run_optimization(site_data, tariff, telemetry_callback=records.append, **opt_kwargs)
+    return res, records
+
+
+def _run_sizing_scenario(args: tuple) -> tuple[tuple[float, float, pd.DataFrame], list[dict]]:
+    site_data, tariff, opt_kwargs = args
+    records = []
+    res = run_endogenous_sizing_optimization(site_data, tariff, telemetry_callback=records.append, **opt_kwargs)
+    return res, records
+
+
+def _map_scenarios(fn, tasks: list, max_workers=None) -> list:
+    """Map fn over tasks in order, in a process pool unless max_workers == 1"""
+    if max_workers == 1:
+        return [fn(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, tasks))
+
+
+def run_scenarios(load_df: pd.DataFrame,
+                  tariff: pd.DataFrame,
+                  solar_size_kw: float = 4.0,
+                  batt_size_kwh: float = 13.5,
+                  solar_series_per_kw: pd.Series = None,
+                  max_workers=None,
+                  telemetry_callback=None,
+                  **opt_kwargs) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """
+    Optimize battery dispatch for every load scenario (column) of load_df, fanned out over a process pool.
+    Solar is aligned to the load once and shared by all scenarios.
+    :param max_workers: Process pool size; defaults to the number of CPUs, and 1 runs serially in this process.
+    :param telemetry_callback: Called in this process with each solve's telemetry record, tagged with its scenario.
+    :param opt_kwargs: Passed through to run_optimization.
+    :return: Battery dispatch per scenario in load_df column order, and a result_stats frame indexed by scenario.
+    """
+    assert load_df.index.equals(tariff.index), "Dataframes must have the same index"
+    if solar_series_per_kw is None:
+        solar_series_per_kw = get_ref_solar_data()
+    solar_data = merge_solar_and_load_data(load_df, solar_size_kw * solar_series_per_kw)['solar']
+
+    tasks = [(pd.concat([elec_usage.rename('load'), solar_data], axis=1), tariff,
+              dict(opt_kwargs, batt_e_max=batt_size_kwh))
+             for _, elec_usage in load_df.items()]
+    results = _map_scenarios(_run_scenario, tasks, max_workers=max_workers)
+    _replay_telemetry(zip(load_df.columns, (records for _, records in results)), telemetry_callback)
+    dispatches = dict(zip(load_df.columns, (res for res, _ in results)))
+
+    p_grid = pd.DataFrame({lbl: res['P_grid'] for lbl, res in dispatches.items()})
+    result_stats = pd.DataFrame({
+        'daily_cost': get_daily_average_costs(p_grid, tariff),
+        'solar_size_kw': solar_size_kw,
+        'batt_size_kwh': batt_size_kwh,
+    }, index=load_df.columns)
+    return dispatches, result_stats
+
+
+def run_sizing_scenarios(load_df: pd.DataFrame,
+                         tariff: pd.DataFrame,
+                         solar_series_per_kw: pd.Series = None,
+                         max_workers=None,
+                         telemetry_callback=None,
+                         **opt_kwargs) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """
+    Run run_endogenous_sizing_optimization for every load scenario (column) of load_df, fanned out over a process pool.
+    :param max_workers: Process pool size; defaults to the number of CPUs, and 1 runs serially in this process.
+    :param telemetry_callback: Called in this process with each solve's telemetry record, tagged with its scenario.
+    :param opt_kwargs: Passed through to run_endogenous_sizing_optimization.
+    :return: Battery dispatch per scenario in load_df column order, and a result_stats frame with the daily
+             electricity cost and optimal sizes per scenario.
+    """
+    assert load_df.index.equals(tariff.index), "Dataframes must have the same index"
+    if solar_series_per_kw is None:
+        solar_series_per_kw = get_ref_solar_data()
+    solar_data = merge_solar_and_load_data(load_df, solar_series_per_kw.copy())['solar']
+    batt_block_e_max = opt_kwargs.get('batt_block_e_max', 13.5)
+
+    tasks = [(pd.concat([solar_data, elec_usage.rename('load')], axis=1), tariff, opt_kwargs)
+             for _, elec_usage in load_df.items()]
+    results = _map_scenarios(_run_sizing_scenario, tasks, max_workers=max_workers)
+    _replay_telemetry(zip(load_df.columns, (records for _, records in results)), telemetry_callback)
+    results = [res for res, _ in results]
+
+    dispatches = {lbl: res for lbl, (_, _, res) in zip(load_df.columns, results)}
+    p_grid = pd.DataFrame({lbl: res['P_grid'] for lbl, res in dispatches.items()})
+    result_stats = pd.DataFrame({
+        'daily_cost': get_daily_average_costs(p_grid, tariff),
+        'n_batts': [n_batts for n_batts, _, _ in results],
+        'solar_size_kw': [s_size_kw for _, s_size_kw, _ in results],
+        'batt_size_kwh': [n_batts * batt_block_e_max for n_batts, _, _ in results],
+    }, index=load_df.columns)
+    return dispatches, result_stats
+
+
+def simple_self_consumption_kernel(net_load: np.ndarray,
+                                   batt_size_kwh=13.5,
+                                   batt_rt_eff=0.85,
+                                   batt_p_max=5,
+                                   dt=1.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Array version of simple_self_consumption: charge from surplus solar, discharge to cover net load.
+    :param net_load: Load minus solar, either one profile of shape (n,) or a batch of shape (homes, n).
+    :param batt_size_kwh: Battery size, a scalar or one per home for a batch; batt_p_max may be either too.
+    :return: P_batt, P_grid and E_batt arrays, each shaped like net_load.
+    """
+    net_load = np.asarray(net_load, dtype=float)
+    oneway_eff = np.sqrt(batt_rt_eff)
+
+    if net_load.ndim == 1 and np.ndim(batt_size_kwh) == 0 and np.ndim(batt_p_max) == 0:
+        # A single profile is fastest as a plain Python loop over floats, avoiding per-step NumPy overhead
+        e, e_max, p_max = 0.0, float(batt_size_kwh), float(batt_p_max)
+        p_batt, e_batt = [], []
+        for net in net_load.tolist():
+            if net < 0:  # Solar is generating
+                p = -min(-net, p_max, (e_max - e) / (oneway_eff * dt))
+                e -= p * oneway_eff * dt
+            else:  # Solar is not generating
+                p = min(net, p_max, e * oneway_eff * dt)
+                e -= p / oneway_eff * dt
+            p_batt.append(p)
+            e_batt.append(e)
+        p_batt = np.array(p_batt)
+        return p_batt, net_load - p_batt, np.array(e_batt)
+
+    # Batches step through time together, vectorized across homes
+    batch = np.atleast_2d(net_load)
+    e_max = np.broadcast_to(np.asarray(batt_size_kwh, dtype=float), batch.shape[:1])
+    p_max = np.broadcast_to(np.asarray(batt_p_max, dtype=float), batch.shape[:1])
+    p_batt = np.empty_like(batch)
+    e_batt = np.empty_like(batch)
+    e = np.zeros(batch.shape[0])
+    for i in range(batch.shape[1]):
+        net = batch[:, i]
+        charging = net < 0
+        charge = -np.minimum(np.minimum(-net, p_max), (e_max - e) / (oneway_eff * dt))
+        discharge = np.minimum(np.minimum(net, p_max), e * oneway_eff * dt)
+        p = np.where(charging, charge, discharge)
+        e = e - np.where(charging, p * oneway_eff, p / oneway_eff) * dt
+        p_batt[:, i] = p
+        e_batt[:, i] = e
+    p_batt, e_batt = p_batt.reshape(net_load.shape), e_batt.reshape(net_load.shape)
+    return p_batt, net_load - p_batt, e_batt
+
+
 def simple_self_consumption(site_data: pd.DataFrame,
                             tariff: pd.DataFrame,
                             batt_rt_eff=0.85,
@@ -171,29 +681,15 @@ def simple_self_consumption(site_data: pd.DataFrame,
     assert site_data.index.equals(tariff.index), "Dataframes must have the same index"
     site_data['net_load'] = site_data['load'] - site_data['solar']
     dt = (site_data.index[1] - site_data.index[0]).total_seconds() / 3600  # Time step in hours
-    oneway_eff = np.sqrt(batt_rt_eff)
-    n = len(site_data)
-
-    # Initialize battery state of charge (SOC)
-    e_batt = np.zeros(n+1)
-    p_batt = np.zeros(n)
-    p_grid = np.zeros(n)
-
-    for i, (t, s) in enumerate(site_data.iterrows()):
-        if s['net_load'] < 0:  # Solar is generating
-            charge_power = -min(-s['net_load'], batt_p_max, (batt_size_kwh - e_batt[i]) / (oneway_eff * dt))
-            p_batt[i] = charge_power
-            e_batt[i+1] = e_batt[i] - charge_power * oneway_eff * dt
-            p_grid[i] = s['net_load'] - charge_power
-        else:  # Solar is not generating
-            # Discharge the battery (limited by power, efficiency, and capacity)
-            discharge_power = min(s['net_load'], batt_p_max, e_batt[i] * oneway_eff * dt)
-            p_batt[i] = discharge_power  # Positive for discharging
-            e_batt[i+1] = e_batt[i] - discharge_power / oneway_eff * dt
-            p_grid[i] = s['net_load'] - discharge_power
+
+    p_batt, p_grid, e_batt = simple_self_consumption_kernel(site_data['net_load'].to_numpy(),
+                                                            batt_size_kwh=batt_size_kwh,
+                                                            batt_rt_eff=batt_rt_eff,
+                                                            batt_p_max=batt_p_max,
+                                                            dt=dt)
 
     return pd.DataFrame({
         'P_batt': p_batt,
         'P_grid': p_grid,
-        'E_batt': e_batt[1:]
+        'E_batt': e_batt
     }, index=site_data.index)
@@ -1,34 +1,226 @@
-import requests
-import json
+import functools
+import pathlib
+import threading
 import time
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 import pandas as pd
 
+from cachestore import atomic_write
+
 load_dotenv(dotenv_path = "../.env")  # load from .env
 
 BAYOU_API_KEY = os.getenv("BAYOU_API_KEY")
 BAYOU_DOMAIN = "staging.bayou.energy"
+INTERVAL_TIME_COLUMNS = ['start', 'end', 'created_at', 'updated_at']
+
+
+class BayouClient:
+    """
+    Client for the Bayou API over a pooled HTTP session.
+    Requests time out, and connection errors and 429/5xx responses are retried with exponential backoff. Waiting for a
+    customer's intervals polls with exponential backoff up to poll_timeout. Many customers can be fetched concurrently
+    with at most max_workers requests in flight.
+    :param base_url: API root; point this at a local stand-in server for tests.
+    :param timeout: (connect, read) timeout in seconds for each request.
+    """
+
+    def __init__(self, api_key: str | None = BAYOU_API_KEY, base_url: str = f"https://{BAYOU_DOMAIN}",
+                 timeout: tuple[float, float] = (5.0, 60.0), max_retries: int = 3, backoff_factor: float = 0.5,
+                 max_workers: int = 8, poll_interval: float = 1.0, max_poll_interval: float = 30.0,
+                 poll_timeout: float = 600.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_timeout = poll_timeout
+
+        self.session = requests.Session()
+        self.session.auth = (api_key, '')
+        self.session.headers.update({'accept': 'application/json'})
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, path: str, params: dict | None = None) -> dict | list:
+        try:
+            response = self.session.get(f'{self.base_url}/api/v2/{path}', params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error making request to Bayou API: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Response status code: {e.response.status_code}")
+                print(f"Response body: {e.response.text}")
+            raise
+
+    def get_customers(self) -> list:
+        return self.get('customers')
+
+    def get_customer_info(self, customer_id: int) -> dict:
+        return self.get(f'customers/{customer_id}')
+
+    def wait_for_intervals(self, customer_id: int) -> dict:
+        """
+        Poll the customer's metadata until its intervals are ready, backing off exponentially between polls.
+        :return: The customer's metadata from the last poll.
+        """
+        deadline = time.monotonic() + self.poll_timeout
+        delay = self.poll_interval
+        customer = self.get_customer_info(customer_id)
+        while not customer['intervals_are_ready']:
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Intervals for Bayou customer {customer_id} not ready after {self.poll_timeout} s")
+            time.sleep(delay)
+            delay = min(2 * delay, self.max_poll_interval)
+            customer = self.get_customer_info(customer_id)
+        return customer
+
+    def get_intervals(self, customer_id: int, updated_after: str | None = None) -> dict:
+        """
+        Intervals for each meter of a customer, once they are ready.
+        :param updated_after: ISO timestamp; only intervals created or updated after it are returned.
+        """
+        self.wait_for_intervals(customer_id)
+        return self.fetch_intervals(customer_id, updated_after)
+
+    def fetch_intervals(self, customer_id: int, updated_after: str | None = None) -> dict:
+        """Intervals for each meter of a customer, without waiting for them to be ready"""
+        params = {'updated_after': updated_after} if updated_after is not None else None
+        return self.get(f'customers/{customer_id}/intervals', params=params)
+
+    def get_electric_intervals_dataframe(self, customer_id: int) -> pd.DataFrame:
+        # The metadata from the readiness poll also gives the meter types, so it is only fetched until ready
+        customer = self.wait_for_intervals(customer_id)
+        electric_meter_ids = get_electric_meter_ids(customer)
+        intervals = self.fetch_intervals(customer_id)
+        return format_intervals(get_raw_intervals(intervals), electric_meter_ids)
+
+    def get_electric_intervals_for_customers(self, customer_ids: list[int]) -> dict[int, pd.DataFrame]:
+        """Electric intervals for many customers, fetched concurrently; repeated ids are fetched once"""
+        customer_ids = list(dict.fromkeys(customer_ids))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(customer_ids, executor.map(self.get_electric_intervals_dataframe, customer_ids)))
+
+
+@functools.cache
+def get_default_client() -> BayouClient:
+    return BayouClient()
+
+
+def get_electric_meter_ids(customer_info: dict) -> list:
+    electric_meter_ids = []
+    for acc_num in customer_info['account_numbers']:
+        for meter in acc_num['meters']:
+            if meter['type'] == 'electric':
+                electric_meter_ids.append(meter['id'])
+    return electric_meter_ids
+
+
+def get_raw_intervals(intervals: dict) -> pd.DataFrame:
+    """Flatten a Bayou intervals response into one frame of interval records with a 'meter_id' column"""
+    frames = [pd.DataFrame.from_records(data=meter['intervals']).assign(meter_id=meter['id'])
+              for meter in intervals['meters'] if meter['intervals']]
+    if not frames:
+        return pd.DataFrame(columns=INTERVAL_TIME_COLUMNS + ['meter_id'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def format_intervals(raw_intervals: pd.DataFrame, meter_ids: list) -> pd.DataFrame:
+    """Intervals of the given meters with parsed timestamps and a 'length' column, sorted by start"""
+    intervals_df = raw_intervals[raw_intervals['meter_id'].isin(meter_ids)].copy()
+
+    for col in INTERVAL_TIME_COLUMNS:
+        intervals_df[col] = pd.to_datetime(intervals_df[col])
+
+    intervals_df['length'] = intervals_df['end'] - intervals_df['start']
+    intervals_df = intervals_df.sort_values(by=['start'], ascending=True)
+
+    return intervals_df
+
+
+class BayouIntervalCache:
+    """
+    Persistent per-customer cache of Bayou interval records, stored as one Parquet file per customer.
+    Each refresh only requests intervals updated after the newest cached 'updated_at', and merges them into the
+    cache, replacing earlier versions of the same meter interval. A response holding intervals older than that is taken
+    to be a full response (the API ignored updated_after), and replaces the cache instead. Only the small customer metadata request is
+    repeated, to wait for readiness and to look up the customer's electric meters.
+    """
+
+    def __init__(self, directory: pathlib.Path, client: BayouClient | None = None):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.client = client or get_default_client()
+        self._locks = defaultdict(threading.Lock)
+
+    def get_path(self, customer_id: int) -> pathlib.Path:
+        return self.directory / f'customer_{customer_id}.parquet'
+
+    def read(self, customer_id: int) -> pd.DataFrame | None:
+        try:
+            return pd.read_parquet(self.get_path(customer_id))
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, customer_id: int) -> tuple[dict, pd.DataFrame]:
+        """
+        Fetch intervals updated since the last refresh and merge them into the customer's cache file.
+        :return: The customer's metadata and all of their cached raw interval records.
+        """
+        with self._locks[customer_id]:
+            customer = self.client.wait_for_intervals(customer_id)
+            cached = self.read(customer_id)
+            updated_after = None
+            if cached is not None and len(cached):
+                updated_after = pd.to_datetime(cached['updated_at'], utc=True).max()
+            new = get_raw_intervals(self.client.fetch_intervals(
+                customer_id, None if updated_after is None else updated_after.isoformat()))
+            if len(new) == 0 and cached is not None:
+                return customer, cached
+
+            # Intervals updated exactly at updated_after may be returned by an inclusive filter, so only older ones
+            # show that the filter was ignored
+            is_full = updated_after is None or (pd.to_datetime(new['updated_at'], utc=True) < updated_after).any()
+            raw = new if is_full else pd.concat([cached, new], ignore_index=True)
+            raw = raw.drop_duplicates(subset=['meter_id', 'start'], keep='last').reset_index(drop=True)
+            atomic_write(self.get_path(customer_id), lambda f: raw.to_parquet(f, index=False))
+            return customer, raw
+
+    def get_electric_intervals_dataframe(self, customer_id: int) -> pd.DataFrame:
+        customer, raw = self.refresh(customer_id)
+        return format_intervals(raw, get_electric_meter_ids(customer))
+
+
+@functools.cache
+def get_default_interval_cache() -> BayouIntervalCache:
+    return BayouIntervalCache(pathlib.Path(os.path.dirname(os.path.abspath(__file__))) / 'data' / 'bayou_intervals')
+
 
 def get_all_bayou_customers() -> dict:
     """
     Get all customers for your Bayou account.
     :return: List of dicts containing. Each dict is a customer.
     """
-    url = f'https://{BAYOU_DOMAIN}/api/v2/customers'
-    headers = {'accept': 'application/json'}
-    auth = (BAYOU_API_KEY, '')
-
-    try:
-        response = requests.get(url, headers=headers, auth=auth)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error making request to Bayou API: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status code: {e.response.status_code}")
-            print(f"Response body: {e.response.text}")
-        raise
+    return get_default_client().get_customers()
 
 def get_bayou_customer_info(customer_id: int) -> dict:
     """
@@ -36,29 +228,10 @@ def get_bayou_customer_info(customer_id: int) -> dict:
     :param customer_id: Bayou numerical id of the customer.
     :return: Dict of metadata.
     """
-    url = f'https://{BAYOU_DOMAIN}/api/v2/customers/{customer_id}'
-    headers = {'accept': 'application/json'}
-    auth = (BAYOU_API_KEY, '')
-
-    try:
-        response = requests.get(url, headers=headers, auth=auth)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error making request to Bayou API: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status code: {e.response.status_code}")
-            print(f"Response body: {e.response.text}")
-        raise
+    return get_default_client().get_customer_info(customer_id)
 
 def get_all_electric_meter_ids_for_customer(customer_id: int) -> list:
-    customer_info = get_bayou_customer_info(customer_id)
-    electric_meter_ids = []
-    for acc_num in customer_info['account_numbers']:
-        for meter in acc_num['meters']:
-            if meter['type'] == 'electric':
-                electric_meter_ids.append(meter['id'])
-    return electric_meter_ids
+    return get_electric_meter_ids(get_bayou_customer_info(customer_id))
 
 def get_all_bayou_intervals_for_customer(customer_id: int) -> dict:
     """
@@ -66,43 +239,7 @@ def get_all_bayou_intervals_for_customer(customer_id: int) -> dict:
     :param customer_id: Bayou numerical id of the customer.
     :return: List of dicts containing the customer's utility energy usage.
     """
-    customer = get_bayou_customer_info(customer_id)
-    while not customer['intervals_are_ready']:
-        time.sleep(1)
-        customer = get_bayou_customer_info(customer_id)
-
-    url = f'https://{BAYOU_DOMAIN}/api/v2/customers/{customer_id}/intervals'
-    headers = {'accept': 'application/json'}
-    auth = (BAYOU_API_KEY, '')
-
-    try:
-        response = requests.get(url, headers=headers, auth=auth)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error making request to Bayou API: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status code: {e.response.status_code}")
-            print(f"Response body: {e.response.text}")
-        raise
+    return get_default_client().get_intervals(customer_id)
 
 def get_dataframe_of_electric_intervals_for_customer(customer_id: int) -> pd.DataFrame:
-    electric_meter_ids = get_all_electric_meter_ids_for_customer(customer_id=customer_id)
-    intervals = get_all_bayou_intervals_for_customer(customer_id=customer_id)
-    intervals_df = None
-    for meter in intervals['meters']:
-        print('meter_id:', meter['id'])
-        if meter['id'] in electric_meter_ids:
-            df = pd.DataFrame.from_records(data=meter['intervals'])
-            if intervals_df is None:
-                intervals_df = df
-            else:
-                intervals_df = intervals_df.append(df, ignore_index=True)
-
-    for col in ['start', 'end', 'created_at', 'updated_at']:
-        intervals_df[col] = pd.to_datetime(intervals_df[col])
-
-    intervals_df['length'] = intervals_df['end'] - intervals_df['start']
-    intervals_df = intervals_df.sort_values(by=['start'], ascending=True)
-
-    return intervals_df
\ No newline at end of file
+    return get_default_interval_cache().get_electric_intervals_dataframe(customer_id)
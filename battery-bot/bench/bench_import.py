@@ -0,0 +1,49 @@
+"""
+Cold-start benchmark: time to import the package modules, and to first access the reference solar data, each in a
+fresh interpreter. Results are written to a JSON file, like bench_optimizer.py:
+
+    python bench/bench_import.py bench/import_results.json
+"""
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+
+import click
+
+PACKAGE_ROOT = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+
+CASES = {
+    "import solar": "import solar",
+    "import utils": "import utils",
+    "import batteryopt": "import batteryopt",
+    "import batteryopt + reference solar data": "import batteryopt, solar; solar.get_ref_solar_data()",
+}
+TIMER = "import time; start = time.perf_counter(); {stmt}; print(time.perf_counter() - start)"
+
+
+def time_cold_start(stmt: str) -> float:
+    out = subprocess.run([sys.executable, "-c", TIMER.format(stmt=stmt)], cwd=PACKAGE_ROOT,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+@click.command()
+@click.argument("output_file", type=click.Path())
+@click.option("--repeat", type=int, default=5, help="Fresh interpreters per case")
+def main(output_file, repeat):
+    results = []
+    for case, stmt in CASES.items():
+        times = [time_cold_start(stmt) for _ in range(repeat)]
+        result = {"case": case, "median_s": statistics.median(times), "min_s": min(times), "times_s": times}
+        print(f"{case:45s} {result['median_s']:.3f} s")
+        results.append(result)
+
+    with open(output_file, "w") as f:
+        json.dump({"results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
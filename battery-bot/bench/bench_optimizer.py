@@ -0,0 +1,172 @@
+"""
+Benchmarks for the battery optimizers on the bundled PG&E reference data.
+
+Each case runs in a fresh process so peak memory is measured per case. Results are written to a JSON file that can
+be compared against a run from another commit:
+
+    python bench/bench_optimizer.py bench/results.json
+    python bench/bench_optimizer.py bench/results_new.json --compare bench/results.json
+"""
+import json
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import time
+import multiprocessing
+import traceback
+
+import click
+
+PACKAGE_ROOT = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+sys.path.insert(0, str(PACKAGE_ROOT))
+
+REF_ELEC_LOAD_DATA_FILE = PACKAGE_ROOT / "data" / "pge-e78ff14c-c8c0-11ec-8cc7-0200170a3297-DailyUsageData" / "pge_electric_usage_interval_data_Service 1_1_2024-02-01_to_2025-01-31.csv"
+
+HORIZONS = {
+    "1 day": 24,
+    "1 week": 24 * 7,
+    "1 month": 24 * 30,
+    "1 year": 24 * 365,
+}
+CASES = ["run_optimization", "run_endogenous_sizing_optimization", "run_endogenous_sizing_optimization_integer",
+         "simple_self_consumption"]
+SOLAR_SIZE_KW = 4.0
+
+
+def load_site_data(n: int):
+    from solar import get_ref_solar_data
+    from utils import process_pge_meterdata, merge_solar_and_load_data, build_tariff
+
+    elec_usage = process_pge_meterdata(REF_ELEC_LOAD_DATA_FILE).iloc[:n]
+    site_data = merge_solar_and_load_data(elec_usage, get_ref_solar_data())
+    return site_data, build_tariff(site_data.index)
+
+
+def run_case(case: str, horizon: str) -> dict:
+    """Run one benchmark case; called in a fresh worker process"""
+    import batteryopt
+
+    site_data, tariff = load_site_data(HORIZONS[horizon])
+    dispatch_data = site_data.assign(solar=SOLAR_SIZE_KW * site_data['solar'])
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    result = {"case": case, "horizon": horizon, "n": site_data.shape[0]}
+    telemetry = []
+    start = time.perf_counter()
+    if case == "run_optimization":
+        batteryopt.run_optimization(dispatch_data, tariff, telemetry_callback=telemetry.append)
+        result["wall_s"] = time.perf_counter() - start
+        # The second solve on the same horizon reuses the compiled problem
+        resolve_start = time.perf_counter()
+        batteryopt.run_optimization(dispatch_data, tariff, telemetry_callback=telemetry.append)
+        result["resolve_wall_s"] = time.perf_counter() - resolve_start
+        result["resolve_compile_s"] = telemetry[1]["compile_time_s"]
+    elif case.startswith("run_endogenous_sizing_optimization"):
+        batteryopt.run_endogenous_sizing_optimization(site_data, tariff, integer_problem=case.endswith("_integer"),
+                                                      telemetry_callback=telemetry.append)
+        result["wall_s"] = time.perf_counter() - start
+    elif case == "simple_self_consumption":
+        batteryopt.simple_self_consumption(dispatch_data, tariff)
+        result["wall_s"] = time.perf_counter() - start
+    else:
+        raise ValueError(f"Unknown benchmark case {case}")
+
+    if telemetry:
+        first = telemetry[0]
+        result.update(build_s=first["build_time_s"], compile_s=first["compile_time_s"], solve_s=first["solve_time_s"],
+                      solver=first["solver"], status=first["status"], num_iters=first["num_iters"])
+
+    # ru_maxrss is in kB on Linux
+    result["peak_rss_mb"] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    return result
+
+
+def get_metadata() -> dict:
+    import cvxpy
+    import numpy
+    import pandas
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PACKAGE_ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cvxpy": cvxpy.__version__,
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "installed_solvers": cvxpy.installed_solvers(),
+    }
+
+
+def _run_case_in_child(conn, case: str, horizon: str):
+    try:
+        conn.send(("ok", run_case(case, horizon)))
+    except BaseException:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def run_case_in_fresh_process(case: str, horizon: str) -> dict:
+    """Run one benchmark case in a newly spawned process, so peak RSS and compile caches don't carry over"""
+    context = multiprocessing.get_context("spawn")
+    recv_conn, send_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_in_child, args=(send_conn, case, horizon))
+    process.start()
+    send_conn.close()
+    try:
+        status, result = recv_conn.recv()
+    except EOFError:
+        status, result = "error", None
+    process.join()
+    if result is None:
+        result = f"Worker exited with code {process.exitcode}"
+    if status == "error":
+        raise RuntimeError(f"Benchmark case {case} ({horizon}) failed:\n{result}")
+    return result
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    baseline = {(r["case"], r["horizon"]): r for r in baseline}
+    print(f"{'case':45s} {'horizon':8s} {'wall_s':>9s} {'baseline':>9s} {'ratio':>6s}")
+    for r in results:
+        b = baseline.get((r["case"], r["horizon"]))
+        if b is None:
+            continue
+        print(f"{r['case']:45s} {r['horizon']:8s} {r['wall_s']:9.3f} {b['wall_s']:9.3f} {r['wall_s'] / b['wall_s']:6.2f}")
+
+
+@click.command()
+@click.argument("output_file", type=click.Path())
+@click.option("--case", "cases", multiple=True, type=click.Choice(CASES), help="Cases to run; defaults to all")
+@click.option("--horizon", "horizons", multiple=True, type=click.Choice(list(HORIZONS)), help="Horizons to run; defaults to all")
+@click.option("--compare", "baseline_file", type=click.Path(exists=True), default=None, help="Earlier results to compare against")
+def main(output_file, cases, horizons, baseline_file):
+    cases = cases or CASES
+    horizons = horizons or list(HORIZONS)
+
+    results = []
+    for case in cases:
+        for horizon in horizons:
+            result = run_case_in_fresh_process(case, horizon)
+            print(json.dumps(result))
+            results.append(result)
+
+    with open(output_file, "w") as f:
+        json.dump({"metadata": get_metadata(), "results": results}, f, indent=2)
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark for building Palmetto request bodies from a usage history, as list-of-records payloads and from usage
+columns. Results are written to a JSON file, like bench_optimizer.py:
+
+    python bench/bench_palmetto_payload.py bench/palmetto_payload_results.json
+"""
+import json
+import os
+import pathlib
+import statistics
+import sys
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+sys.path.insert(0, str(PACKAGE_ROOT))
+
+HISTORIES = {
+    "1 year hourly": "1h",
+    "1 year 15 min": "15min",
+}
+
+
+def get_usage_series(freq: str) -> pd.Series:
+    idx = pd.date_range("2023-04-01", "2024-03-31 23:45", freq=freq, tz="US/Pacific")
+    return pd.Series(np.random.default_rng(0).gamma(2.0, 0.3, len(idx)), index=idx, name="load")
+
+
+def build_records_body(s: pd.Series) -> bytes:
+    from palmetto import build_palmetto_payload
+    from utils import series_to_palmetto_records
+
+    payload = build_palmetto_payload("468 Noe St, San Francisco, CA 94114", known_kwh_usage=series_to_palmetto_records(s))
+    return json.dumps(payload).encode()
+
+
+def build_columns_body(s: pd.Series) -> bytes:
+    from palmetto import build_palmetto_payload, get_palmetto_request_body
+    from utils import series_to_palmetto_usage
+
+    payload = build_palmetto_payload("468 Noe St, San Francisco, CA 94114", known_kwh_usage=series_to_palmetto_usage(s))
+    return get_palmetto_request_body(payload)
+
+
+CASES = {
+    "records + json.dumps": build_records_body,
+    "usage columns": build_columns_body,
+}
+
+
+@click.command()
+@click.argument("output_file", type=click.Path())
+@click.option("--repeat", type=int, default=5, help="Builds per case")
+def main(output_file, repeat):
+    results = []
+    for history, freq in HISTORIES.items():
+        s = get_usage_series(freq)
+        for case, build in CASES.items():
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                body = build(s)
+                times.append(time.perf_counter() - start)
+            result = {"case": case, "history": history, "n": len(s), "bytes": len(body),
+                      "median_s": statistics.median(times), "min_s": min(times), "times_s": times}
+            print(f"{case:25s} {history:15s} {result['median_s'] * 1000:8.1f} ms")
+            results.append(result)
+
+    with open(output_file, "w") as f:
+        json.dump({"results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
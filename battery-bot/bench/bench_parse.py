@@ -0,0 +1,49 @@
+"""
+Parse-time benchmark for the PG&E Green Button exports bundled in data/. Results are written to a JSON file, like
+bench_optimizer.py:
+
+    python bench/bench_parse.py bench/parse_results.json
+"""
+import json
+import os
+import pathlib
+import statistics
+import sys
+import time
+
+import click
+
+PACKAGE_ROOT = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+sys.path.insert(0, str(PACKAGE_ROOT))
+
+PGE_DATA_DIR = PACKAGE_ROOT / "data" / "pge-e78ff14c-c8c0-11ec-8cc7-0200170a3297-DailyUsageData"
+CASES = {
+    "electric usage": ("pge_electric_usage_interval_data_Service 1_1_2024-02-01_to_2025-01-31.csv", "USAGE (kWh)"),
+    "electric cost": ("pge_electric_usage_interval_data_Service 1_1_2024-02-01_to_2025-01-31.csv", "COST"),
+    "gas usage": ("pge_natural_gas_usage_interval_data_Service 2_2_2024-02-01_to_2025-01-31.csv", "USAGE (therms)"),
+}
+
+
+@click.command()
+@click.argument("output_file", type=click.Path())
+@click.option("--repeat", type=int, default=10, help="Parses per case")
+def main(output_file, repeat):
+    from utils import process_pge_meterdata
+
+    results = []
+    for case, (fname, extract_col) in CASES.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process_pge_meterdata(PGE_DATA_DIR / fname, extract_col)
+            times.append(time.perf_counter() - start)
+        result = {"case": case, "median_s": statistics.median(times), "min_s": min(times), "times_s": times}
+        print(f"{case:20s} {result['median_s'] * 1000:.1f} ms")
+        results.append(result)
+
+    with open(output_file, "w") as f:
+        json.dump({"results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
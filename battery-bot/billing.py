@@ -0,0 +1,130 @@
+"""
+Vectorized electricity billing.
+
+Grid power is positive for imports and negative for exports. Imports are charged at px_buy and exports credited at
+px_sell, each interval at its own price. The array functions take grid power as a 1-D array for one scenario or a
+2-D (scenarios, intervals) array for many, and prices as 1-D arrays shared by all scenarios or 2-D arrays with one
+row per scenario (e.g. from tariff.get_price_matrix).
+
+Under net billing, export credits offset import charges in the same and later months but never fixed charges. Any
+credit left at a true-up is paid out at surplus_credit_fraction of its value, and otherwise forfeited. True-ups fall at
+the end of a given calendar month each year (true_up_month), and credit still carried at the end of the index is
+settled in its last month; without a true_up_month, the whole index is a single true-up period. Without net billing,
+credits are simply netted against charges, and bills can be negative.
+"""
+import numpy as np
+import pandas as pd
+
+
+def get_interval_costs(p_grid, px_buy, px_sell, dt: float = 1.0) -> np.ndarray:
+    """Energy cost in $ of each interval; negative for export credits"""
+    p_grid = np.asarray(p_grid, dtype=float)
+    return np.where(p_grid > 0, px_buy, px_sell) * p_grid * dt
+
+
+def sum_by_period(interval_costs: np.ndarray, period_codes: np.ndarray, n_periods: int) -> np.ndarray:
+    """
+    Sum interval costs into periods, for all scenarios in one bincount.
+    :param period_codes: Period number (0 to n_periods - 1) of each interval.
+    :return: (periods,) or (scenarios, periods) array of totals.
+    """
+    costs = np.atleast_2d(interval_costs)
+    n_scenarios = costs.shape[0]
+    codes = (np.arange(n_scenarios)[:, None] * n_periods + period_codes[None, :]).ravel()
+    totals = np.bincount(codes, weights=costs.ravel(), minlength=n_scenarios * n_periods)
+    totals = totals.reshape(n_scenarios, n_periods)
+    return totals if np.ndim(interval_costs) == 2 else totals[0]
+
+
+def apply_net_billing(monthly_energy: np.ndarray, surplus_credit_fraction: float = 0.0,
+                      true_up: np.ndarray | None = None) -> np.ndarray:
+    """
+    Carry export credits forward month by month, for all scenarios at once.
+    :param monthly_energy: (months,) or (scenarios, months) net energy charges; negative months are credits.
+    :param true_up: (months,) bool array of the months whose end settles the carried credit; the last month always
+        does. Defaults to settling only in the last month.
+    :return: Energy charges per month after credits, with true-up payouts as negative charges.
+    """
+    energy = np.atleast_2d(monthly_energy).astype(float)
+    n_months = energy.shape[1]
+    true_up = np.zeros(n_months, dtype=bool) if true_up is None else np.asarray(true_up, dtype=bool).copy()
+    true_up[-1] = True
+    billed = np.zeros_like(energy)
+    credit = np.zeros(energy.shape[0])
+    for month in range(n_months):
+        net = energy[:, month]
+        applied = np.minimum(credit, np.clip(net, 0, None))
+        billed[:, month] = np.clip(net, 0, None) - applied
+        credit = credit - applied + np.clip(-net, 0, None)
+        if true_up[month]:
+            billed[:, month] -= surplus_credit_fraction * credit
+            credit = np.zeros_like(credit)
+    return billed if np.ndim(monthly_energy) == 2 else billed[0]
+
+
+def get_month_codes(idx: pd.DatetimeIndex) -> tuple[np.ndarray, pd.PeriodIndex]:
+    """Month number of each timestamp, counting from the first month in idx, and the months covered"""
+    month_index = idx.year * 12 + idx.month - 1
+    first = month_index.min()
+    codes = np.asarray(month_index - first)
+    months = pd.period_range(pd.Period(year=first // 12, month=first % 12 + 1, freq='M'), periods=codes.max() + 1,
+                             freq='M')
+    return codes, months
+
+
+def get_monthly_fixed_charges(idx: pd.DatetimeIndex, fixed_charges: dict | None) -> np.ndarray:
+    """
+    Fixed charges per month of idx, as returned by get_month_codes.
+    :param fixed_charges: Dict with optional 'per_day' and 'per_month' charges in $, as in tariff definitions.
+    """
+    codes, months = get_month_codes(idx)
+    fixed_charges = fixed_charges or {}
+    charges = np.zeros(len(months))
+    if fixed_charges.get('per_day'):
+        day_codes, _ = get_month_codes(idx.normalize().unique())
+        charges += fixed_charges['per_day'] * np.bincount(day_codes, minlength=len(months))
+    if fixed_charges.get('per_month'):
+        charges[np.unique(codes)] += fixed_charges['per_month']
+    return charges
+
+
+def get_monthly_bills(p_grid: pd.Series | pd.DataFrame,
+                      tariff: pd.DataFrame,
+                      fixed_charges: dict | None = None,
+                      net_billing: bool = False,
+                      surplus_credit_fraction: float = 0.0,
+                      true_up_month: int | None = None,
+                      dt: float = 1.0) -> pd.DataFrame:
+    """
+    Monthly bills for one or many scenarios on the same index.
+    :param p_grid: Grid power; a Series for one scenario or a DataFrame with one column per scenario.
+    :param tariff: Frame with 'px_buy' and 'px_sell' columns on p_grid's index, e.g. from utils.build_tariff.
+    :param fixed_charges: See get_monthly_fixed_charges; e.g. a tariff definition's 'fixed_charges'.
+    :param true_up_month: Calendar month (1-12) at whose end net billing credits are settled each year; None settles
+        once, at the end of the index.
+    :return: Frame indexed by month with one column per scenario.
+    """
+    assert p_grid.index.equals(tariff.index), "Dataframes must have the same index"
+    frame = p_grid.to_frame() if isinstance(p_grid, pd.Series) else p_grid
+    costs = get_interval_costs(frame.to_numpy().T, tariff['px_buy'].to_numpy(), tariff['px_sell'].to_numpy(), dt)
+    codes, months = get_month_codes(p_grid.index)
+    monthly = sum_by_period(costs, codes, len(months))
+    if net_billing:
+        true_up = None if true_up_month is None else months.month == true_up_month
+        monthly = apply_net_billing(monthly, surplus_credit_fraction, true_up)
+    monthly = monthly + get_monthly_fixed_charges(p_grid.index, fixed_charges)
+    return pd.DataFrame(monthly.T, index=months.rename('month'), columns=frame.columns)
+
+
+def get_annual_bills(p_grid: pd.Series | pd.DataFrame, tariff: pd.DataFrame, **kwargs) -> pd.Series:
+    """Total bill per scenario over the whole index; keyword arguments as for get_monthly_bills"""
+    return get_monthly_bills(p_grid, tariff, **kwargs).sum()
+
+
+def get_elapsed_days(idx: pd.DatetimeIndex) -> int:
+    return (idx[-1] - idx[0]).days
+
+
+def get_daily_average_costs(p_grid: pd.Series | pd.DataFrame, tariff: pd.DataFrame, **kwargs) -> pd.Series:
+    """Total bill per scenario divided by the whole days the index spans; keyword arguments as for get_monthly_bills"""
+    return get_annual_bills(p_grid, tariff, **kwargs) / get_elapsed_days(p_grid.index)
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory least-recently-used cache with a fixed number of entries.
+    If max_bytes is given, entries are also evicted until the sizes passed to put() add up to at most max_bytes.
+    """
+
+    def __init__(self, maxsize: int = 128, max_bytes: int | None = None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value, size: int = 0):
+        with self._lock:
+            self._bytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while self._data and (len(self._data) > self.maxsize or
+                                  (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                evicted, _ = self._data.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._bytes -= self._sizes.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+def atomic_write(path: pathlib.Path, write):
+    """
+    Call write with a temporary binary file next to path, then rename it to path, so readers never see a partial file
+    and a failed write leaves neither a truncated file nor the temporary one.
+    """
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def touch(path: pathlib.Path):
+    """Mark a cache file as recently used, so size-based eviction removes it last"""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict_to_size(directory: pathlib.Path, max_bytes: int, suffixes: tuple[str, ...]) -> list[pathlib.Path]:
+    """
+    Delete the least recently used cache entries in directory until its total size is at most max_bytes.
+    An entry is a file ending in suffixes[0] plus sidecar files with the same stem and the other suffixes;
+    recency is the modified time of the first file, see touch().
+    :return: Paths of the evicted entries' first files.
+    """
+    entries = []
+    total = 0
+    for path in directory.glob(f"*{suffixes[0]}"):
+        stem = path.name[:-len(suffixes[0])]
+        files = [directory / (stem + suffix) for suffix in suffixes]
+        try:
+            mtime = path.stat().st_mtime
+            size = sum(f.stat().st_size for f in files if f.exists())
+        except FileNotFoundError:
+            continue  # evicted concurrently
+        entries.append((mtime, path, files, size))
+        total += size
+
+    evicted = []
+    for _, path, files, size in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        for f in files:
+            f.unlink(missing_ok=True)
+        total -= size
+        evicted.append(path)
+    return evicted
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def get_request_key(payload) -> str:
+    """sha256 of the canonical JSON of a request payload, so equal payloads map to the same key regardless of key order"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of JSON-serializable responses keyed on the request payload (see get_request_key).
+    A directory of JSON files, trimmed to max_bytes by evicting the least recently used responses, with the most
+    recent ones (up to memory_entries and max_memory_bytes of JSON) also kept in memory. Entries older than ttl seconds
+    are refetched, and concurrent requests for the same payload share a single call to fetch.
+    """
+
+    def __init__(self, directory: pathlib.Path, ttl: float = 7 * 24 * 3600, max_bytes: int = 200 * 2**20,
+                 memory_entries: int = 64, max_memory_bytes: int = 16 * 2**20):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memory = LRUCache(maxsize=memory_entries, max_bytes=max_memory_bytes)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, key: str) -> pathlib.Path:
+        return self.directory / f'{key}.json'
+
+    def _is_fresh(self, created: float) -> bool:
+        return time.time() - created < self.ttl
+
+    def get(self, payload):
+        """Cached response for the payload, or None if there is no fresh entry"""
+        key = get_request_key(payload)
+        entry = self._memory.get(key)
+        if entry is None:
+            path = self.get_path(key)
+            try:
+                with open(path) as f:
+                    text = f.read()
+                entry = json.loads(text)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+            touch(path)
+            self._memory.put(key, entry, len(text))
+        if not self._is_fresh(entry['created']):
+            return None
+        return entry['response']
+
+    def put(self, payload, response):
+        key = get_request_key(payload)
+        entry = {'created': time.time(), 'response': response}
+        path = self.get_path(key)
+        # Write then rename, so concurrent readers never see a partial file
+        text = json.dumps(entry)
+        atomic_write(path, lambda f: f.write(text.encode()))
+        self._memory.put(key, entry, len(text))
+        with self._lock:
+            for evicted in evict_to_size(self.directory, self.max_bytes, ('.json',)):
+                self._memory.pop(evicted.name[:-len('.json')])
+
+    def get_or_fetch(self, payload, fetch):
+        """
+        Cached response for the payload, calling fetch(payload) on a miss. If an identical request is already in
+        flight, wait for its result instead of calling fetch again.
+        """
+        response = self.get(payload)
+        if response is not None:
+            return response
+
+        key = get_request_key(payload)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            # An identical request may have completed between the cache check and becoming the leader
+            response = self.get(payload)
+            if response is None:
+                response = fetch(payload)
+                self.put(payload, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
@@ -0,0 +1,239 @@
+"""
+Background job queue for running the optimization pipeline outside web requests.
+
+Jobs wait in a bounded FIFO queue and run in at most max_workers worker processes at a time, so solver work is capped
+at a known number of cores however many users submit. Submitting to a full queue raises QueueFullError instead of
+piling up work. Each job gets its own process, which is what makes cancelling a running solve possible: the process
+is terminated. Workers are started with forkserver (or spawn where that isn't available) rather than by forking the
+caller, which is typically a multithreaded web server, so fn and its arguments must be picklable. A finished job's
+result is handed out once: get_result drops it, and unretrieved results are forgotten along with the oldest jobs.
+
+    queue = JobQueue(max_workers=2, max_pending=8)
+    job_id = queue.submit(get_data, address, ...)
+    queue.get_status(job_id)   # {'status': 'running', ...}
+    queue.cancel(job_id)
+    queue.get_result(job_id, timeout=60)
+"""
+import multiprocessing
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = {DONE, FAILED, CANCELLED}
+
+
+class QueueFullError(RuntimeError):
+    """Raised by JobQueue.submit when max_pending jobs are already waiting"""
+
+
+class JobCancelledError(RuntimeError):
+    pass
+
+
+class JobFailedError(RuntimeError):
+    pass
+
+
+def get_default_mp_context(preload: list[str] | None = None):
+    """
+    forkserver context where available, else spawn.
+    :param preload: Modules the fork server imports once, so workers don't import them on every job, e.g. ['app'].
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    if preload:
+        context.set_forkserver_preload(preload)
+    return context
+
+
+def _run_job(conn, fn, args, kwargs):
+    """Entry point of a job's worker process; sends ('ok', result) or ('error', traceback) back over conn"""
+    try:
+        result = fn(*args, **kwargs)
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+    else:
+        conn.send(('ok', result))
+    finally:
+        conn.close()
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs, each run in its own worker process.
+    :param max_workers: Jobs running at once.
+    :param max_pending: Jobs waiting to run at once; further submissions raise QueueFullError.
+    :param max_finished: Finished jobs whose status and result are kept; the oldest are forgotten first.
+    :param timeout: Seconds a job may run before it is terminated and marked failed; None for no limit.
+    :param mp_context: multiprocessing context for the worker processes; see get_default_mp_context.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 8, max_finished: int = 64,
+                 timeout: float | None = None, mp_context=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.timeout = timeout
+        self._mp_context = mp_context or get_default_mp_context()
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, fn, *args, **kwargs) -> str:
+        """
+        Queue fn(*args, **kwargs) to run in a worker process. fn's result must be picklable.
+        :return: Id of the job.
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFullError(f"{len(self._pending)} jobs are already waiting; try again later")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id, 'status': QUEUED, 'fn': fn, 'args': args, 'kwargs': kwargs,
+                'submitted': time.time(), 'started': None, 'finished': None, 'result': None, 'error': None,
+                'retrieved': False, 'process': None,
+            }
+            self._pending.append(job_id)
+            self._dispatch()
+        return job_id
+
+    def _dispatch(self):
+        """Start queued jobs while worker slots are free; called with the lock held"""
+        while self._pending and self._running < self.max_workers:
+            job = self._jobs[self._pending.popleft()]
+            recv_conn, send_conn = self._mp_context.Pipe(duplex=False)
+            try:
+                process = self._mp_context.Process(target=_run_job, daemon=True,
+                                                   args=(send_conn, job['fn'], job['args'], job['kwargs']))
+                process.start()
+            except Exception:
+                # E.g. fn or its arguments can't be pickled for the worker
+                recv_conn.close()
+                send_conn.close()
+                job.update(status=FAILED, error=traceback.format_exc(), finished=time.time(), fn=None, args=None,
+                           kwargs=None)
+                self._changed.notify_all()
+                continue
+            # Only the worker holds the sending end, so recv() sees EOF if the worker dies without a result
+            send_conn.close()
+            job.update(status=RUNNING, started=time.time(), process=process, fn=None, args=None, kwargs=None)
+            self._running += 1
+            threading.Thread(target=self._watch, args=(job, recv_conn), daemon=True).start()
+
+    def _watch(self, job: dict, conn):
+        """Wait for a running job's result, then free its slot"""
+        outcome = None
+        try:
+            if conn.poll(self.timeout):
+                outcome = conn.recv()
+            else:
+                job['process'].terminate()
+                outcome = ('error', f"TimeoutError: job ran for more than {self.timeout} s")
+        except (EOFError, OSError):
+            pass  # terminated by cancel(), or the worker crashed
+        finally:
+            conn.close()
+
+        process = job['process']
+        process.join()
+        with self._lock:
+            if job['status'] == RUNNING:
+                if outcome is None:
+                    job.update(status=FAILED, error=f"Worker process exited with code {process.exitcode}")
+                elif outcome[0] == 'ok':
+                    job.update(status=DONE, result=outcome[1])
+                else:
+                    job.update(status=FAILED, error=outcome[1])
+                job['finished'] = time.time()
+            job['process'] = None
+            self._running -= 1
+            self._forget_finished()
+            self._dispatch()
+            self._changed.notify_all()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _get_job(self, job_id: str) -> dict:
+        try:
+            return self._jobs[job_id]
+        except KeyError:
+            raise KeyError(f"Unknown job {job_id!r}") from None
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a queued job, or terminate a running one.
+        :return: False if the job had already finished.
+        """
+        with self._lock:
+            job = self._get_job(job_id)
+            if job['status'] in FINISHED:
+                return False
+            if job['status'] == QUEUED:
+                self._pending.remove(job_id)
+                job.update(fn=None, args=None, kwargs=None)
+            else:
+                job['process'].terminate()  # the watcher frees the slot once the process has exited
+            job.update(status=CANCELLED, finished=time.time())
+            self._changed.notify_all()
+            return True
+
+    def get_status(self, job_id: str) -> dict:
+        """
+        Status of a job without its result.
+        :return: Dict with 'id', 'status', 'error', 'position' (in the queue, 0 = next; None unless queued), and the
+            'submitted', 'started' and 'finished' times.
+        """
+        with self._lock:
+            job = self._get_job(job_id)
+            position = self._pending.index(job_id) if job['status'] == QUEUED else None
+            return {key: job[key] for key in ('id', 'status', 'error', 'submitted', 'started', 'finished')} | {
+                'position': position}
+
+    def get_result(self, job_id: str, timeout: float | None = None):
+        """
+        Wait for a job to finish and return its result. The queue drops the result, so it can be retrieved only once.
+        :raises TimeoutError: If the job hasn't finished within timeout seconds.
+        :raises LookupError: If the result was already retrieved.
+        :raises JobCancelledError, JobFailedError: If the job was cancelled or raised; the error has its traceback.
+        """
+        with self._lock:
+            job = self._get_job(job_id)
+            if not self._changed.wait_for(lambda: job['status'] in FINISHED, timeout):
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout} s")
+            if job['status'] == CANCELLED:
+                raise JobCancelledError(f"Job {job_id} was cancelled")
+            if job['status'] == FAILED:
+                raise JobFailedError(f"Job {job_id} failed:\n{job['error']}")
+            if job['retrieved']:
+                raise LookupError(f"Result of job {job_id} was already retrieved")
+            result, job['result'], job['retrieved'] = job['result'], None, True
+            return result
+
+    def get_counts(self) -> dict:
+        """Number of jobs in each status"""
+        with self._lock:
+            counts = dict.fromkeys([QUEUED, RUNNING, DONE, FAILED, CANCELLED], 0)
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+            return counts
+
+    def shutdown(self, cancel_pending: bool = True):
+        """Cancel queued jobs (unless cancel_pending is False) and terminate running ones"""
+        with self._lock:
+            job_ids = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] == RUNNING or (cancel_pending and job['status'] == QUEUED)]
+        for job_id in job_ids:
+            self.cancel(job_id)
@@ -0,0 +1,162 @@
+"""
+Columnar store of customers' PG&E meter exports.
+
+The ingest command parses a directory of Green Button CSV exports once, in parallel, into a Hive-partitioned Parquet
+dataset with one file per customer and meter:
+
+    python meterstore.py ingest data/exports data/meterstore --workers 4
+
+    data/meterstore/customer=<customer>/meter=electric_service_1/data.parquet
+
+A customer is the top-level directory of an export under the source directory (PG&E downloads unpack into one
+directory per account), and a meter is the fuel and service number from the export's filename. Downstream code loads
+a customer's series by key, reading only the requested column.
+"""
+import logging
+import os
+import pathlib
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from cachestore import atomic_write
+from constants import TIMEZONE
+from utils import read_pge_meterdata
+
+logger = logging.getLogger(__name__)
+
+PGE_EXPORT_PATTERN = re.compile(r"pge_(electric|natural_gas)_usage_interval_data_Service (\d+)_")
+PARTITIONING = ds.partitioning(pa.schema([("customer", pa.string()), ("meter", pa.string())]), flavor="hive")
+DATA_FILE = "data.parquet"
+
+
+def get_package_root() -> pathlib.Path:
+    return pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_default_store_dir() -> pathlib.Path:
+    return get_package_root() / "data" / "meterstore"
+
+
+def get_export_key(path: pathlib.Path, source_dir: pathlib.Path) -> tuple[str, str] | None:
+    """
+    (customer, meter) key of an export file, or None if the file isn't a recognized PG&E export.
+    """
+    match = PGE_EXPORT_PATTERN.match(path.name)
+    relative = path.relative_to(source_dir)
+    if match is None or len(relative.parts) < 2:
+        return None
+    fuel, service = match.groups()
+    return relative.parts[0], f"{fuel}_service_{service}"
+
+
+def normalize_meterdata(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalize parsed intervals (see utils.read_pge_meterdata) to 'usage' and 'cost' columns on a UTC index.
+    Sub-hourly intervals are summed to hours; hourly and daily data are kept as they are.
+    """
+    usage_col = next(col for col in data.columns if col.startswith("USAGE"))
+    data = data[[usage_col, "COST"]].set_axis(["usage", "cost"], axis=1)
+    data = data[~data.index.duplicated(keep="last")].sort_index()
+    if len(data) > 1 and data.index.to_series().diff().min() < pd.Timedelta("1h"):
+        data = data.resample("1h").sum(min_count=1).dropna(how="all")
+    data.index = data.index.tz_convert("UTC").rename("Datetime")
+    return data
+
+
+def ingest_meter(args: tuple) -> tuple[str, str, int]:
+    """Parse all exports for one (customer, meter) key and write its partition; called in a worker process"""
+    (customer, meter), files, store_dir = args
+    # Exports covering different date ranges are combined, with later files winning on overlap
+    data = normalize_meterdata(pd.concat([read_pge_meterdata(f) for f in sorted(files)]))
+    usage_unit = "therms" if meter.startswith("natural_gas") else "kWh"
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    table = table.replace_schema_metadata({**table.schema.metadata, b"usage_unit": usage_unit.encode()})
+
+    partition = store_dir / f"customer={customer}" / f"meter={meter}"
+    partition.mkdir(parents=True, exist_ok=True)
+    atomic_write(partition / DATA_FILE, lambda f: pq.write_table(table, f))
+    return customer, meter, len(data)
+
+
+def ingest_meter_exports(source_dir: pathlib.Path, store_dir: pathlib.Path,
+                         max_workers: int | None = None) -> list[tuple[str, str, int]]:
+    """
+    Parse every PG&E export under source_dir into the store at store_dir, one worker task per customer and meter.
+    Existing partitions for the same keys are replaced.
+    :return: (customer, meter, number of intervals) for each partition written.
+    """
+    source_dir = pathlib.Path(source_dir)
+    store_dir = pathlib.Path(store_dir)
+    files_by_key = defaultdict(list)
+    for path in source_dir.rglob("*.csv"):
+        key = get_export_key(path, source_dir)
+        if key is None:
+            logger.warning("Skipping %s: not a PG&E export in a customer directory", path)
+            continue
+        files_by_key[key].append(path)
+
+    tasks = [(key, files, store_dir) for key, files in sorted(files_by_key.items())]
+    if max_workers == 1:
+        return [ingest_meter(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(ingest_meter, tasks))
+
+
+def load_meter_series(customer: str, meter: str = "electric_service_1", column: str = "usage",
+                      store_dir: pathlib.Path | None = None) -> pd.Series:
+    """
+    Load one customer's meter series from the store, in local time, reading only the requested column.
+    Named 'load' like utils.process_pge_meterdata, so it can be passed to merge_solar_and_load_data.
+    """
+    store_dir = pathlib.Path(store_dir or get_default_store_dir())
+    path = store_dir / f"customer={customer}" / f"meter={meter}" / DATA_FILE
+    if not path.exists():
+        raise KeyError(f"No meter data for customer {customer!r}, meter {meter!r} in {store_dir}")
+    data = pq.read_table(path, columns=["Datetime", column]).to_pandas()
+    s = data[column].rename("load")
+    s.index = data.index.tz_convert(TIMEZONE)
+    return s
+
+
+def load_fleet(customers: list[str] | None = None, meter: str = "electric_service_1", column: str = "usage",
+               store_dir: pathlib.Path | None = None) -> pd.DataFrame:
+    """
+    Load a meter series for many customers at once as a wide DataFrame with one column per customer.
+    Partitions are pruned by customer and meter, so only the requested files and column are read.
+    :param customers: Customers to load; defaults to all customers with this meter.
+    """
+    store_dir = pathlib.Path(store_dir or get_default_store_dir())
+    dataset = ds.dataset(store_dir, format="parquet", partitioning=PARTITIONING)
+    condition = ds.field("meter") == meter
+    if customers is not None:
+        condition = condition & ds.field("customer").isin(list(customers))
+    table = dataset.to_table(columns=["Datetime", "customer", column], filter=condition)
+    data = table.to_pandas(ignore_metadata=True).pivot(index="Datetime", columns="customer", values=column)
+    data.index = data.index.tz_convert(TIMEZONE)
+    return data
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("source_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("store_dir", type=click.Path(file_okay=False), default=str(get_default_store_dir()))
+@click.option("--workers", type=int, default=None, help="Worker processes; defaults to the number of CPUs")
+def ingest(source_dir, store_dir, workers):
+    """Ingest the PG&E exports under SOURCE_DIR into the meter store at STORE_DIR"""
+    for customer, meter, n in ingest_meter_exports(source_dir, store_dir, max_workers=workers):
+        print(f"{customer} {meter}: {n} intervals")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,16 +1,35 @@
+import functools
+import itertools
+import json
+import numpy as np
 import pandas as pd
+import pathlib
 import requests
 import os
+import threading
+import time
 import click
+from concurrent.futures import ThreadPoolExecutor
 
+from cachestore import ResponseCache
 from constants import FROM_DATETIME_PALMETTO_FUTURE, TO_DATETIME_PALMETTO_FUTURE
-from utils import process_pge_meterdata, series_to_palmetto_records
+from utils import process_pge_meterdata, series_to_palmetto_usage
 
 PALMETTO_API_URL = "https://ei.palmetto.com/api/v0/bem/calculate"
+# (connect, read) timeout in seconds; a year of hourly estimates can take a while to calculate
+PALMETTO_TIMEOUT = (5.0, 120.0)
 from dotenv import load_dotenv
 load_dotenv(dotenv_path = "../.env")  # load from .env
 
-def get_palmetto_data(
+
+@functools.cache
+def get_palmetto_response_cache() -> ResponseCache:
+    """Responses are reused for a week; Palmetto's estimates for a given request don't change faster than that"""
+    cache_dir = pathlib.Path(os.path.dirname(os.path.abspath(__file__))) / "data" / "palmetto_cache"
+    return ResponseCache(cache_dir, ttl=7 * 24 * 3600, max_bytes=200 * 2**20)
+
+
+def build_palmetto_payload(
         address: str,
         granularity = "hour",
         solar_size_kw = 0.0,
@@ -19,26 +38,7 @@ def get_palmetto_data(
         hvac_heat_pump_present = False,
         hvac_heating_capacity = 0.0,
         known_kwh_usage = None,
-    ) -> pd.DataFrame:
-    """
-    Get solar data from Palmetto API for a given address
-    
-    Args:
-        address (str): The address to get solar data for
-        
-    Returns:
-        Dict containing solar data from Palmetto
-    """
-    api_key = os.getenv("PALMETTO_API_KEY")
-    if not api_key:
-        raise ValueError("PALMETTO_API_KEY environment variable is not set")
-
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "X-API-Key": api_key
-    }
-
+    ) -> dict:
     customer_payload = {
         "parameters": {
             "from_datetime": FROM_DATETIME_PALMETTO_FUTURE,
@@ -105,18 +105,80 @@ def get_palmetto_data(
     }
     if known_kwh_usage is not None:
         customer_payload["consumption"]['actuals'] = known_kwh_usage
-    
+    return customer_payload
+
+
+ACTUALS_PLACEHOLDER = "__palmetto_actuals__"
+
+
+def iter_usage_json(usage: dict, block_size: int = 4096):
+    """
+    Serialize Palmetto usage columns (see utils.get_palmetto_usage) to a JSON array of interval records, yielding
+    strings of up to block_size records. Values are formatted for the whole array at once; non-finite values become
+    null.
+    """
+    values = usage['value'].astype(str)
+    values[~np.isfinite(usage['value'])] = 'null'
+    record = '{"from_datetime":"%s","to_datetime":"%s","variable":' + json.dumps(usage['variable']) + ',"value":%s}'
+    yield '['
+    for i in range(0, len(values), block_size):
+        block = zip(usage['from_datetime'][i:i + block_size].tolist(), usage['to_datetime'][i:i + block_size].tolist(),
+                    values[i:i + block_size].tolist())
+        yield (',' if i else '') + ','.join([record % row for row in block])
+    yield ']'
+
+
+def iter_palmetto_request_body(customer_payload: dict, block_size: int = 4096):
+    """
+    JSON request body for a payload, as a generator of bytes blocks; see get_palmetto_request_body.
+    Usage columns under consumption.actuals are serialized with iter_usage_json instead of being converted to records.
+    """
+    actuals = customer_payload.get("consumption", {}).get("actuals")
+    if not isinstance(actuals, dict):
+        yield json.dumps(customer_payload).encode()
+        return
+    payload = dict(customer_payload, consumption=dict(customer_payload["consumption"], actuals=ACTUALS_PLACEHOLDER))
+    head, tail = json.dumps(payload).split(json.dumps(ACTUALS_PLACEHOLDER))
+    yield head.encode()
+    for block in iter_usage_json(actuals, block_size):
+        yield block.encode()
+    yield tail.encode()
+
+
+def get_palmetto_request_body(customer_payload: dict) -> bytes:
+    """
+    JSON request body for a payload. The blocks are joined rather than streamed, so requests sends a Content-Length
+    header instead of chunked transfer encoding, which the Palmetto API isn't documented to accept.
+    """
+    return b"".join(iter_palmetto_request_body(customer_payload))
+
+
+def post_palmetto_request(customer_payload: dict, timeout: tuple[float, float] = PALMETTO_TIMEOUT) -> list:
+    """
+    POST a calculate request to the Palmetto API, with the body from get_palmetto_request_body.
+    :param timeout: (connect, read) timeout in seconds; raises requests.Timeout when exceeded.
+    :return: List of interval records from the response.
+    """
+    api_key = os.getenv("PALMETTO_API_KEY")
+    if not api_key:
+        raise ValueError("PALMETTO_API_KEY environment variable is not set")
+
+    headers = {
+        "accept": "application/json",
+        "content-type": "application/json",
+        "X-API-Key": api_key
+    }
+
     try:
-        response = requests.post(PALMETTO_API_URL, headers=headers, json=customer_payload)
+        response = requests.post(PALMETTO_API_URL, headers=headers, data=get_palmetto_request_body(customer_payload),
+                                 timeout=timeout)
         response.raise_for_status()
         
         # Print the response for debugging
         # print("Palmetto API Response:")
         # print(json.dumps(response.json(), indent=2))
         response_json = response.json()
-        data = response_json['data']
-        interval_data = pd.DataFrame(data['intervals'])
-        return interval_data
+        return response_json['data']['intervals']
     except requests.exceptions.RequestException as e:
         print(f"Error making request to Palmetto API: {e}")
         if hasattr(e, 'response') and e.response is not None:
@@ -125,23 +187,139 @@ def get_palmetto_data(
         raise
 
 
+def get_palmetto_data(
+        address: str,
+        granularity = "hour",
+        solar_size_kw = 0.0,
+        batt_size_kwh = 0.0,
+        ev_charging_present = False,
+        hvac_heat_pump_present = False,
+        hvac_heating_capacity = 0.0,
+        known_kwh_usage = None,
+        use_cache = True,
+    ) -> pd.DataFrame:
+    """
+    Get solar data from Palmetto API for a given address
+    
+    Args:
+        address (str): The address to get solar data for
+        known_kwh_usage: Usage history, as a list of interval records or as usage columns from
+            utils.get_palmetto_usage, which serialize much faster
+        use_cache (bool): Reuse the response to an identical earlier request, see get_palmetto_response_cache
+        
+    Returns:
+        Dict containing solar data from Palmetto
+    """
+    customer_payload = build_palmetto_payload(address, granularity, solar_size_kw, batt_size_kwh, ev_charging_present,
+                                              hvac_heat_pump_present, hvac_heating_capacity, known_kwh_usage)
+    if use_cache:
+        intervals = get_palmetto_response_cache().get_or_fetch(customer_payload, post_palmetto_request)
+    else:
+        intervals = post_palmetto_request(customer_payload)
+    return pd.DataFrame(intervals)
+
+
+class RateLimiter:
+    """Spaces out calls to at most `rate` per second across threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        time.sleep(start - now)
+
+
+def post_palmetto_request_with_retry(customer_payload: dict, rate_limiter: RateLimiter | None = None,
+                                     max_retries: int = 3, backoff: float = 1.0) -> list:
+    """
+    post_palmetto_request, retrying connection errors, timeouts and 429/5xx responses with exponential backoff.
+    Each attempt waits for the rate limiter, if given.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            return post_palmetto_request(customer_payload)
+        except requests.exceptions.RequestException as e:
+            status = e.response.status_code if getattr(e, 'response', None) is not None else None
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or attempt == max_retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def get_equipment_variants(ev_options=(True, False), hvac_options=(True, False), **kwargs) -> dict[str, dict]:
+    """
+    Scenario variants for every combination of EV charging and heat pump, named like the columns of
+    data/scenario_data.csv. Extra keyword arguments (e.g. solar_size_kw) are passed to every variant.
+    """
+    return {f"load__ev_{ev}__hvac_{hvac}": dict(kwargs, ev_charging_present=ev, hvac_heat_pump_present=hvac)
+            for ev, hvac in itertools.product(ev_options, hvac_options)}
+
+
+def get_palmetto_variants(
+        address: str,
+        variants: dict[str, dict],
+        known_kwh_usage = None,
+        granularity = "hour",
+        variable = "consumption.electricity",
+        max_workers = 4,
+        requests_per_second = 2.0,
+        max_retries = 3,
+        backoff = 1.0,
+        use_cache = True,
+    ) -> pd.DataFrame:
+    """
+    Request several equipment scenarios for one address or usage history concurrently, and combine them.
+    :param variants: Column name -> keyword arguments for get_palmetto_data, e.g. from get_equipment_variants().
+    :param requests_per_second: Limit on upstream requests, shared by all workers; cached variants don't count.
+    :param max_retries: Retries per variant, waiting backoff * 2**attempt seconds in between.
+    :return: Wide DataFrame indexed by 'from_datetime' with one column of `variable` per variant, in the layout of
+        data/scenario_data.csv.
+    """
+    rate_limiter = RateLimiter(requests_per_second)
+
+    def fetch(kwargs: dict) -> pd.DataFrame:
+        customer_payload = build_palmetto_payload(address, granularity=granularity, known_kwh_usage=known_kwh_usage,
+                                                  **kwargs)
+        post = functools.partial(post_palmetto_request_with_retry, rate_limiter=rate_limiter, max_retries=max_retries,
+                                 backoff=backoff)
+        if use_cache:
+            intervals = get_palmetto_response_cache().get_or_fetch(customer_payload, post)
+        else:
+            intervals = post(customer_payload)
+        df = pd.DataFrame.from_records(intervals)
+        return df[df['variable'] == variable].set_index('from_datetime')['value']
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(fetch, variants.values())
+        return pd.DataFrame(dict(zip(variants, results)))
+
+
 @click.command()
 @click.argument("output_file", type=click.Path())
 @click.option("--address", type=str, default=None, help="Address for which to estimate load")
 @click.option("--interval_data", type=click.Path(), default=None, help="PGE utility export")
 @click.option("--ev", type=bool, default=False, help="EV charging present")
 @click.option("--hvac", type=bool, default=False, help="HVAC heat pump present")
+@click.option("--no-cache", is_flag=True, default=False, help="Always call the Palmetto API")
 def get_palmetto_data_cli(
         address,
         interval_data,
         ev,
         hvac,
-        known_kwh_usage,
+        no_cache,
         output_file
 ):
     assert address is not None or interval_data is not None, "Must provide either address or interval data"
     if interval_data:
-        interval_data = series_to_palmetto_records(process_pge_meterdata(interval_data))
+        interval_data = series_to_palmetto_usage(process_pge_meterdata(interval_data))
 
     granularity = "hour"
     solar_size_kw = 1.0
@@ -156,7 +334,8 @@ def get_palmetto_data_cli(
         ev_charging_present=ev,
         hvac_heat_pump_present=hvac,
         hvac_heating_capacity=hvac_heating_capacity,
-        known_kwh_usage=interval_data
+        known_kwh_usage=interval_data,
+        use_cache=not no_cache,
     )
     res.to_csv(output_file, index=False)
 
@@ -0,0 +1,253 @@
+"""
+Precomputed equipment scenarios for a usage history, served from a columnar result store.
+
+Every combination of PV, battery, EV and heat pump (SCENARIO_OPTIONS) is solved once per usage history and persisted
+as a Hive-partitioned Parquet dataset, one directory per usage history and scenario. Scenarios are stored under their
+effective scenario (see get_effective_scenario), so combinations that give app.get_data the same inputs share a solve:
+
+    data/scenarios/usage=<sha256 of the usage CSV>/scenario=pv-battery/dispatch.parquet
+                                                                      /bills.parquet
+                                                                      /telemetry.parquet
+
+dispatch holds the hourly results over the last year in float32, bills the monthly bills computed with
+billing.get_monthly_bills, and telemetry the solver telemetry records. bills is written last, so a scenario is in the
+store once its bills file exists. The store is trimmed to max_bytes by deleting the least recently used usage
+histories. Front ends solve the scenario they need first, then queue precompute_scenarios in
+the background for the rest, and read everything else from the store:
+
+    python scenariostore.py precompute data/.../pge_electric_usage_interval_data_Service 1_1_....csv
+"""
+import hashlib
+import itertools
+import os
+import pathlib
+import shutil
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from app import TRY_PALMETTO, get_data
+from billing import get_monthly_bills
+from cachestore import atomic_write
+
+SCENARIO_OPTIONS = ('pv', 'battery', 'ev', 'heat_pump')
+BASELINE = 'baseline'
+
+# Equipment sizes assumed when an option is selected
+SOLAR_SIZE_KW = 1.0
+BATT_SIZE_KWH = 13.5
+HVAC_HEATING_CAPACITY = 1.0
+
+PARTITIONING = ds.partitioning(pa.schema([("usage", pa.string()), ("scenario", pa.string())]), flavor="hive")
+DISPATCH_FILE = "dispatch.parquet"
+BILLS_FILE = "bills.parquet"
+TELEMETRY_FILE = "telemetry.parquet"
+
+
+def get_package_root() -> pathlib.Path:
+    return pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_default_store_dir() -> pathlib.Path:
+    return get_package_root() / "data" / "scenarios"
+
+
+def get_scenario_name(pv: bool = False, battery: bool = False, ev: bool = False, heat_pump: bool = False) -> str:
+    """Name of a combination of options, e.g. 'pv-battery', or 'baseline' when none is selected"""
+    selected = [option for option, present in zip(SCENARIO_OPTIONS, (pv, battery, ev, heat_pump)) if present]
+    return '-'.join(selected) or BASELINE
+
+
+def get_all_scenarios() -> list[str]:
+    """Names of all combinations of options, with fewer options first"""
+    combinations = sorted(itertools.product([False, True], repeat=len(SCENARIO_OPTIONS)), key=sum)
+    return [get_scenario_name(*combination) for combination in combinations]
+
+
+def get_scenario_inputs(scenario: str) -> dict:
+    """Equipment arguments to app.get_data for a scenario"""
+    options = set() if scenario == BASELINE else set(scenario.split('-'))
+    if not options <= set(SCENARIO_OPTIONS):
+        raise ValueError(f"Unknown options {sorted(options - set(SCENARIO_OPTIONS))} in scenario {scenario!r}")
+    return {
+        'solar_size_kw': SOLAR_SIZE_KW if 'pv' in options else 0.0,
+        'batt_size_kwh': BATT_SIZE_KWH if 'battery' in options else 0.0,
+        'ev_charging_present': "Yes" if 'ev' in options else "No",
+        'hvac_heat_pump_present': "Yes" if 'heat_pump' in options else "No",
+        'hvac_heating_capacity': HVAC_HEATING_CAPACITY if 'heat_pump' in options else 0.0,
+    }
+
+
+def get_effective_scenario(scenario: str) -> str:
+    """
+    The scenario with the options that don't change app.get_data's result dropped, e.g. 'pv-ev' -> 'pv' unless
+    TRY_PALMETTO; the EV and heat pump options only enter the load through the Palmetto API.
+    """
+    inputs = get_scenario_inputs(scenario)
+    return get_scenario_name(inputs['solar_size_kw'] > 0, inputs['batt_size_kwh'] > 0,
+                             TRY_PALMETTO and inputs['ev_charging_present'] == "Yes",
+                             TRY_PALMETTO and inputs['hvac_heat_pump_present'] == "Yes")
+
+
+def get_usage_hash(csv_path: pathlib.Path) -> str:
+    with open(csv_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def filter_last_year(df: pd.DataFrame) -> pd.DataFrame:
+    max_date = df.index.max().normalize()
+    one_year_ago = max_date - pd.DateOffset(years=1)
+    return df[df.index >= one_year_ago]
+
+
+def _write_parquet(df: pd.DataFrame, path: pathlib.Path, preserve_index: bool):
+    atomic_write(path, lambda f: df.to_parquet(f, index=preserve_index))
+
+
+class ScenarioStore:
+    """
+    Scenario results for many usage histories, see the module docstring for the layout.
+    :param max_bytes: Size the store is trimmed to after each write, by deleting the usage histories read or written
+        least recently; the one just written is kept.
+    """
+
+    def __init__(self, directory: pathlib.Path | None = None, max_bytes: int = 500 * 2**20):
+        self.directory = pathlib.Path(directory or get_default_store_dir())
+        self.max_bytes = max_bytes
+
+    def get_usage_dir(self, usage_hash: str) -> pathlib.Path:
+        return self.directory / f"usage={usage_hash}"
+
+    def get_partition(self, usage_hash: str, scenario: str) -> pathlib.Path:
+        return self.get_usage_dir(usage_hash) / f"scenario={get_effective_scenario(scenario)}"
+
+    def has(self, usage_hash: str, scenario: str) -> bool:
+        return (self.get_partition(usage_hash, scenario) / BILLS_FILE).exists()
+
+    def get_missing(self, usage_hash: str, scenarios: list[str] | None = None) -> list[str]:
+        return [scenario for scenario in scenarios or get_all_scenarios() if not self.has(usage_hash, scenario)]
+
+    def write(self, usage_hash: str, scenario: str, dispatch: pd.DataFrame, telemetry: list[dict] = ()):
+        """Store a scenario's dispatch (as returned by app.get_data), its monthly bills, and its solve telemetry"""
+        partition = self.get_partition(usage_hash, scenario)
+        partition.mkdir(parents=True, exist_ok=True)
+        numeric = dispatch.select_dtypes(include='number').columns
+        _write_parquet(dispatch.astype({col: np.float32 for col in numeric}), partition / DISPATCH_FILE, True)
+        _write_parquet(pd.DataFrame.from_records(list(telemetry)), partition / TELEMETRY_FILE, False)
+        bills = get_monthly_bills(dispatch['P_grid'], dispatch[['px_buy', 'px_sell']]).iloc[:, 0].rename('cost')
+        bills.index = bills.index.to_timestamp()
+        _write_parquet(bills.reset_index(), partition / BILLS_FILE, False)
+        self.touch(usage_hash)
+        self.evict(keep=usage_hash)
+
+    def touch(self, usage_hash: str):
+        """Mark a usage history as recently used, so eviction removes it last"""
+        try:
+            os.utime(self.get_usage_dir(usage_hash))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep: str | None = None) -> list[str]:
+        """
+        Delete the least recently used usage histories, other than keep, until the store is at most max_bytes.
+        :return: Hashes of the evicted usage histories.
+        """
+        entries = []
+        total = 0
+        for usage_dir in self.directory.glob("usage=*"):
+            try:
+                mtime = usage_dir.stat().st_mtime
+                size = sum(f.stat().st_size for f in usage_dir.rglob("*") if f.is_file())
+            except FileNotFoundError:
+                continue  # evicted concurrently
+            entries.append((mtime, usage_dir, size))
+            total += size
+
+        evicted = []
+        for _, usage_dir, size in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            usage_hash = usage_dir.name[len("usage="):]
+            if usage_hash == keep:
+                continue
+            shutil.rmtree(usage_dir, ignore_errors=True)
+            total -= size
+            evicted.append(usage_hash)
+        return evicted
+
+    def read_bills(self, usage_hash: str, scenario: str) -> pd.Series:
+        """Monthly bills in $, indexed by the first day of each month"""
+        bills = pd.read_parquet(self.get_partition(usage_hash, scenario) / BILLS_FILE)
+        self.touch(usage_hash)
+        return bills.set_index('month')['cost']
+
+    def read_dispatch(self, usage_hash: str, scenario: str, columns: list[str] | None = None) -> pd.DataFrame:
+        """Hourly results of a scenario, reading only the requested columns"""
+        return pd.read_parquet(self.get_partition(usage_hash, scenario) / DISPATCH_FILE, columns=columns)
+
+    def read_telemetry(self, usage_hash: str, scenario: str) -> pd.DataFrame:
+        return pd.read_parquet(self.get_partition(usage_hash, scenario) / TELEMETRY_FILE)
+
+    def read_all_bills(self, usage_hash: str, scenarios: list[str] | None = None) -> pd.DataFrame:
+        """Monthly bills of every stored scenario (or of the given ones) for a usage history, one column per scenario"""
+        paths = [str(path) for path in self.get_usage_dir(usage_hash).glob(f"*/{BILLS_FILE}")]
+        if not paths:
+            return pd.DataFrame()
+        dataset = ds.dataset(paths, format="parquet", partitioning=PARTITIONING, partition_base_dir=str(self.directory))
+        bills = dataset.to_table(columns=["month", "scenario", "cost"]).to_pandas(ignore_metadata=True)
+        bills = bills.pivot(index="month", columns="scenario", values="cost")
+        self.touch(usage_hash)
+        # Equivalent scenarios share their effective scenario's column
+        effective = {scenario: get_effective_scenario(scenario) for scenario in scenarios or get_all_scenarios()}
+        stored = [scenario for scenario in effective if effective[scenario] in bills.columns]
+        return pd.DataFrame({scenario: bills[effective[scenario]] for scenario in stored}).rename_axis(
+            columns="scenario")
+
+
+def solve_scenario(store: ScenarioStore, usage_hash: str, csv_path: pathlib.Path, scenario: str,
+                   address: str = "") -> None:
+    """Solve one scenario for the usage history in csv_path and write it to the store"""
+    telemetry = []
+    all_input = get_data(address, **get_scenario_inputs(scenario),
+                         electricity_csv_file=str(csv_path),
+                         telemetry_callback=telemetry.append)
+    store.write(usage_hash, scenario, filter_last_year(all_input), telemetry)
+
+
+def precompute_scenarios(csv_path: pathlib.Path, store_dir: pathlib.Path | None = None, address: str = "",
+                         scenarios: list[str] | None = None) -> list[str]:
+    """
+    Solve every scenario (or the given ones) for a usage history that isn't in the store yet, once per effective
+    scenario. Each scenario is checked just before it is solved, so scenarios that another process stored in the
+    meantime are skipped.
+    :return: Names of the effective scenarios solved.
+    """
+    store = ScenarioStore(store_dir)
+    usage_hash = get_usage_hash(csv_path)
+    solved = []
+    for scenario in dict.fromkeys(map(get_effective_scenario, scenarios or get_all_scenarios())):
+        if not store.has(usage_hash, scenario):
+            solve_scenario(store, usage_hash, csv_path, scenario, address)
+            solved.append(scenario)
+    return solved
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--store-dir", type=click.Path(file_okay=False), default=str(get_default_store_dir()))
+def precompute(csv_path, store_dir):
+    """Solve every scenario for the PG&E usage export CSV_PATH into the store"""
+    solved = precompute_scenarios(pathlib.Path(csv_path), store_dir)
+    print(f"Solved {len(solved)} scenarios: {', '.join(solved) or 'all were already stored'}")
+
+
+if __name__ == "__main__":
+    cli()
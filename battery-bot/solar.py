@@ -1,7 +1,11 @@
+import functools
+import json
+import numpy as np
 import pandas as pd
-import pvlib
 import pathlib
+import threading
 from constants import LATITUDE, LONGITUDE, TIMEZONE
+from cachestore import LRUCache, atomic_write, touch, evict_to_size
 import os
 
 def get_package_root() -> pathlib.Path:
@@ -12,10 +16,14 @@ def get_expected_solar_output(latitude: float, longitude: float, start_yr: int,
     # Note: get_pvgis_hourly only requests full years of data, and only requests in UTC.  
     # To get a full local-tz set of continuous hours regardless of leap years we need a year on either side of a leap year
     # Note: The 7.75% loss factor is a correction estimate from aligning the PVGIS calculation with the ModelChain reference model
+    # Note: The tilt defaults to the latitude
+    import pvlib  # slow to import, and only needed on a cache miss
 
+    if surface_tilt is None:
+        surface_tilt = latitude
     pvgis_hourly = pvlib.iotools.get_pvgis_hourly(latitude, longitude,
                                             start=str(start_yr), end=end_yr,
-                                            surface_tilt=latitude, surface_azimuth=surface_azimuth,
+                                            surface_tilt=surface_tilt, surface_azimuth=surface_azimuth,
                                             pvcalculation=True, peakpower=1.0,
                                             loss=7.75, trackingtype=0,
                                             )
@@ -26,15 +34,144 @@ def get_expected_solar_output(latitude: float, longitude: float, start_yr: int,
     return solar_ac_estimate
     
 
-def get_or_cache_weather_data(latitude: float, longitude: float, start_yr: int, end_yr: int, timezone: str) -> pd.Series:
-    cache_file = get_package_root() / f'data/weather_{latitude}_{longitude}_{start_yr}_{end_yr}.csv'
-    try:
-        weather_data = pd.read_csv(cache_file, index_col=0, parse_dates=[0]).squeeze()
+def write_binary_series(s: pd.Series, path: pathlib.Path):
+    """
+    Save a regularly spaced series as a float64 .npy array plus a .json sidecar with the start timestamp, frequency,
+    timezone, name and length, which is much faster to load than a CSV. The sidecar is written last, so it marks a
+    complete entry.
+    :param path: Path of the .npy file.
+    """
+    freq = pd.infer_freq(s.index)
+    if freq is None:
+        raise ValueError("Series must have a regular frequency to be stored in binary form")
+    tz = s.index.tz
+    metadata = {
+        'start': s.index[0].isoformat(),
+        'freq': freq,
+        # Named zones are restored by name; fixed offsets are carried by the start timestamp
+        'tz': getattr(tz, 'zone', None) or getattr(tz, 'key', None),
+        'name': s.name,
+        'length': len(s),
+    }
+    atomic_write(path, lambda f: np.save(f, s.to_numpy(dtype=np.float64)))
+    atomic_write(path.with_suffix('.json'), lambda f: f.write(json.dumps(metadata).encode()))
+
+
+def read_binary_series(path: pathlib.Path) -> pd.Series:
+    """
+    Load a series saved with write_binary_series. The values are a read-only memory map of the file, so pages are only
+    read as they are used; copy the series before modifying it.
+    """
+    with open(path.with_suffix('.json')) as f:
+        metadata = json.load(f)
+    values = np.load(path, mmap_mode='r')
+    if metadata.get('length') != len(values):
+        # E.g. a crash between writing the values and the sidecar of an entry being overwritten
+        raise ValueError(f"{path} doesn't match its sidecar")
+    start = pd.Timestamp(metadata['start'])
+    if metadata['tz'] is not None:
+        start = start.tz_convert(metadata['tz'])
+    index = pd.date_range(start, periods=len(values), freq=metadata['freq'])
+    return pd.Series(values, index=index, name=metadata['name'], copy=False)
+
+
+def fetch_solar_profile(latitude: float, longitude: float, start_yr: int, end_yr: int, timezone: str,
+                        surface_tilt: float | None = None, surface_azimuth: float = 180) -> pd.Series:
+    """
+    Default fetch for SolarProfileStore: a bundled data/weather_<lat>_<lon>_<start>_<end>.csv export for a south-facing
+    array tilted at the latitude, if there is one, otherwise PVGIS via get_expected_solar_output.
+    """
+    bundled = get_package_root() / f'data/weather_{latitude}_{longitude}_{start_yr}_{end_yr}.csv'
+    default_orientation = surface_tilt in (None, round(latitude, 2)) and surface_azimuth == 180
+    if default_orientation and bundled.exists():
+        weather_data = pd.read_csv(bundled, index_col=0, parse_dates=[0]).squeeze()
         weather_data.index = pd.DatetimeIndex(weather_data.index, tz=pd.Timestamp(weather_data.index[0]).tzinfo)
-    except FileNotFoundError:
-        weather_data = get_expected_solar_output(latitude, longitude, start_yr, end_yr, timezone)
-        weather_data.to_csv(cache_file)
-    return weather_data
+        return weather_data
+    return get_expected_solar_output(latitude, longitude, start_yr, end_yr, timezone, surface_tilt=surface_tilt,
+                                     surface_azimuth=surface_azimuth)
+
+
+def get_or_cache_weather_data(latitude: float, longitude: float, start_yr: int, end_yr: int, timezone: str) -> pd.Series:
+    """Per-kW solar profile for a south-facing array tilted at the latitude, from the default SolarProfileStore"""
+    return get_solar_profile_store().get(latitude, longitude, start_yr, end_yr, timezone)
+
+
+class SolarProfileStore:
+    """
+    Cache of per-kW solar profiles keyed on location, orientation, year range and timezone.
+    Profiles are kept in an in-memory LRU on top of a directory of binary files (see write_binary_series), which is
+    trimmed to max_bytes by evicting the least recently used profiles. Misses call `fetch`, which defaults to
+    fetch_solar_profile (bundled exports, then PVGIS); tests and offline runs can pass a local stand-in with the same
+    signature.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_bytes: int = 100 * 2**20, memory_entries: int = 32,
+                 fetch=fetch_solar_profile):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.fetch = fetch
+        self._memory = LRUCache(maxsize=memory_entries)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(latitude: float, longitude: float, start_yr: int, end_yr: int, timezone: str,
+                surface_tilt: float | None = None, surface_azimuth: float = 180) -> tuple:
+        if surface_tilt is None:
+            surface_tilt = latitude
+        return (round(latitude, 4), round(longitude, 4), round(surface_tilt, 2), round(surface_azimuth, 2),
+                start_yr, end_yr, timezone)
+
+    def get_path(self, key: tuple) -> pathlib.Path:
+        latitude, longitude, surface_tilt, surface_azimuth, start_yr, end_yr, timezone = key
+        tz_name = timezone.replace('/', '-')
+        return self.directory / (f'solar_{latitude}_{longitude}_tilt{surface_tilt}_az{surface_azimuth}'
+                                 f'_{start_yr}_{end_yr}_{tz_name}.npy')
+
+    def get(self, latitude: float, longitude: float, start_yr: int, end_yr: int, timezone: str,
+            surface_tilt: float | None = None, surface_azimuth: float = 180) -> pd.Series:
+        """Per-kW solar profile for the site; arguments as for get_expected_solar_output"""
+        key = self.get_key(latitude, longitude, start_yr, end_yr, timezone, surface_tilt, surface_azimuth)
+        profile = self._memory.get(key)
+        if profile is None:
+            path = self.get_path(key)
+            try:
+                profile = read_binary_series(path)
+                touch(path)
+            except (FileNotFoundError, ValueError):
+                profile = self.fetch(latitude, longitude, start_yr, end_yr, timezone,
+                                     surface_tilt=key[2], surface_azimuth=surface_azimuth)
+                with self._lock:
+                    write_binary_series(profile, path)
+                    evict_to_size(self.directory, self.max_bytes, ('.npy', '.json'))
+                profile = read_binary_series(path) if path.exists() else profile
+            self._memory.put(key, profile)
+        return profile.copy()
+
+
+@functools.cache
+def get_solar_profile_store() -> SolarProfileStore:
+    """Default SolarProfileStore, under data/solar_profiles"""
+    return SolarProfileStore(get_package_root() / 'data' / 'solar_profiles')
+
+
+@functools.cache
+def _load_ref_solar_data() -> pd.Series:
+    return get_or_cache_weather_data(latitude=LATITUDE, longitude=LONGITUDE, start_yr=2019, end_yr=2021, timezone=TIMEZONE)
+
+
+def get_ref_solar_data() -> pd.Series:
+    """
+    Reference data: San Francisco, around the 2020 leap year, per kW of solar.
+    Loaded on first use rather than at import; returns a copy, so callers can modify it without altering the cache.
+    """
+    return _load_ref_solar_data().copy()
+
 
-# Reference data: San Francisco, around the 2020 leap year
-REF_SOLAR_DATA = get_or_cache_weather_data(latitude=LATITUDE, longitude=LONGITUDE, start_yr=2019, end_yr=2021, timezone=TIMEZONE)
+def __getattr__(name):
+    # REF_SOLAR_DATA used to be computed at import time; it stays importable but is loaded on first access, and is
+    # then a plain module attribute that callers can write to, as before
+    if name == 'REF_SOLAR_DATA':
+        globals()['REF_SOLAR_DATA'] = get_ref_solar_data()
+        return globals()['REF_SOLAR_DATA']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,134 @@
+"""
+Time-of-use tariff engine.
+
+A tariff is a plain dict of rate rules, so plans can be written inline or loaded from JSON:
+
+    {
+        'name': 'E-TOU-C',
+        'seasons': {'summer': [6, 7, 8, 9], 'winter': [1, 2, 3, 4, 5, 10, 11, 12]},
+        'buy': [
+            {'price': 0.40},
+            {'price': 0.52, 'start': '16:00', 'end': '21:00', 'days': 'weekday', 'seasons': ['summer']},
+        ],
+        'sell': [{'price': 0.05}],
+        'fixed_charges': {'per_day': 0.0, 'per_month': 0.0},
+    }
+
+'buy' prices imports and 'sell' credits exports, in $/kWh; 'fixed_charges' are billed by billing.get_monthly_bills.
+Within each list the last matching rule wins, so a plan is a base price followed by its TOU periods. A rule with no
+start/end applies all day; start and end are inclusive local times like DataFrame.between_time, and wrap past midnight
+when start > end. 'days' is 'all' (the default), 'weekday' or 'weekend', and 'seasons' (default all) names entries of
+the tariff's 'seasons' map of months.
+
+Tariffs compile to NumPy price arrays for a DatetimeIndex. Compiled arrays are cached per tariff and index span and
+frequency, so pricing many homes on the same calendar compiles each plan once.
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from cachestore import LRUCache
+
+PRICE_COLUMNS = {'buy': 'px_buy', 'sell': 'px_sell'}
+DAYS = {'all', 'weekday', 'weekend'}
+
+# The flat-plus-evening-peak plan the optimizers were written against
+SIMPLE_TOU_TARIFF = {
+    'name': 'Simple TOU',
+    'buy': [
+        {'price': 0.40},
+        {'price': 0.52, 'start': '16:00', 'end': '21:00'},
+    ],
+    'sell': [
+        {'price': 0.05},
+        {'price': 0.20, 'start': '16:00', 'end': '22:00'},
+    ],
+}
+
+_compiled_cache = LRUCache(maxsize=256)
+
+
+def get_tariff_key(tariff: dict) -> str:
+    """Canonical JSON of a tariff definition, used to identify it in caches"""
+    return json.dumps(tariff, sort_keys=True, separators=(',', ':'))
+
+
+def _get_index_key(idx: pd.DatetimeIndex) -> tuple:
+    if idx.freq is not None:
+        return (idx[0].value if len(idx) else None, len(idx), idx.freqstr, str(idx.tz))
+    return (hashlib.blake2b(idx.asi8.tobytes(), digest_size=16).hexdigest(), len(idx), None, str(idx.tz))
+
+
+def _parse_minute(t: str) -> int:
+    hour, minute = t.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def _rule_mask(rule: dict, seasons: dict, minute: np.ndarray, weekday: np.ndarray, month: np.ndarray) -> np.ndarray:
+    mask = np.ones(minute.shape, dtype=bool)
+    if 'start' in rule or 'end' in rule:
+        start = _parse_minute(rule.get('start', '00:00'))
+        end = _parse_minute(rule.get('end', '23:59'))
+        if start <= end:
+            mask &= (minute >= start) & (minute <= end)
+        else:
+            mask &= (minute >= start) | (minute <= end)
+
+    days = rule.get('days', 'all')
+    if days not in DAYS:
+        raise ValueError(f"Unknown days {days!r}; expected one of {sorted(DAYS)}")
+    if days == 'weekday':
+        mask &= weekday < 5
+    elif days == 'weekend':
+        mask &= weekday >= 5
+
+    if 'seasons' in rule:
+        try:
+            months = [m for season in rule['seasons'] for m in seasons[season]]
+        except KeyError as e:
+            raise ValueError(f"Unknown season {e.args[0]!r}") from None
+        mask &= np.isin(month, months)
+    return mask
+
+
+def _compile_prices(rules: list[dict], seasons: dict, minute: np.ndarray, weekday: np.ndarray,
+                    month: np.ndarray) -> np.ndarray:
+    prices = np.full(minute.shape, np.nan)
+    for rule in rules:
+        prices[_rule_mask(rule, seasons, minute, weekday, month)] = rule['price']
+    if np.isnan(prices).any():
+        raise ValueError("Tariff rules don't cover every interval; start with a rule without conditions")
+    return prices
+
+
+def compile_tariff(tariff: dict, idx: pd.DatetimeIndex) -> dict[str, np.ndarray]:
+    """
+    Price arrays for each interval in idx, evaluated in the index's own (local) time.
+    :return: Dict with read-only 'px_buy' and 'px_sell' arrays.
+    """
+    key = (get_tariff_key(tariff), _get_index_key(idx))
+    compiled = _compiled_cache.get(key)
+    if compiled is None:
+        minute = (idx.hour * 60 + idx.minute).to_numpy()
+        weekday = idx.dayofweek.to_numpy()
+        month = idx.month.to_numpy()
+        seasons = tariff.get('seasons', {})
+        compiled = {}
+        for side, column in PRICE_COLUMNS.items():
+            prices = _compile_prices(tariff[side], seasons, minute, weekday, month)
+            prices.flags.writeable = False
+            compiled[column] = prices
+        _compiled_cache.put(key, compiled)
+    return compiled
+
+
+def get_tariff_frame(tariff: dict, idx: pd.DatetimeIndex) -> pd.DataFrame:
+    """Prices for idx as a DataFrame with 'px_buy' and 'px_sell' columns, as used by the optimizers"""
+    return pd.DataFrame(compile_tariff(tariff, idx), index=idx)
+
+
+def get_price_matrix(tariffs: list[dict], idx: pd.DatetimeIndex, column: str = 'px_buy') -> np.ndarray:
+    """Prices of several plans on the same index, stacked into a (plans, intervals) array"""
+    return np.stack([compile_tariff(tariff, idx)[column] for tariff in tariffs])
@@ -1,10 +1,17 @@
 import os
-import time
-from solar import REF_SOLAR_DATA
+import subprocess
+import sys
+from solar import get_ref_solar_data
 import pandas as pd
 import numpy as np
+import cvxpy as cp
+import pytest
 from batteryopt import (optimization_usage_from_batt_solar_size, get_daily_optimized_cost,
-                        get_daily_cost_from_pgrid, simple_self_consumption, run_endogenous_sizing_optimization)
+                        get_daily_cost_from_pgrid, simple_self_consumption, run_endogenous_sizing_optimization,
+                        run_optimization, get_dispatch_problem, run_rolling_horizon_optimization,
+                        get_rolling_horizon_cost_gap,
+                        run_scenarios, run_sizing_scenarios, run_dp_optimization,
+                        simple_self_consumption_kernel, get_daily_optimized_cost_surface)
 from utils import merge_solar_and_load_data, build_tariff
 from test.utils import elec_usage, ng_cost, get_test_root
 import logging
@@ -37,6 +44,140 @@ def test_batt_opt_cost(elec_usage, solar_size_kw=1.0, batt_size_kwh=13.5):
                                                   batt_size_kwh=batt_size_kwh)
     assert average_daily_cost >= 0, "Total cost should be non-negative"
 
+def test_cached_dispatch_problem(elec_usage):
+    elec_usage = elec_usage.iloc[:24 * 7]
+    site_data = merge_solar_and_load_data(elec_usage, SOLAR_SIZE_KW * get_ref_solar_data())
+    tariff = build_tariff(site_data.index)
+
+    get_dispatch_problem.cache_clear()
+    telemetry = []
+    first = run_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX, telemetry_callback=telemetry.append)
+    prob = get_dispatch_problem(site_data.shape[0])
+    other = run_optimization(site_data, tariff, batt_e_max=2 * BATT_SIZE_EMAX, batt_rt_eff=0.9)
+    again = run_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX, telemetry_callback=telemetry.append)
+
+    assert get_dispatch_problem(site_data.shape[0]) is prob, "Problem should be reused for the same horizon"
+    assert other['E'].max() > BATT_SIZE_EMAX, "Battery size parameter should be updated between solves"
+    assert np.isclose(get_daily_cost_from_pgrid(first['P_grid'], tariff),
+                      get_daily_cost_from_pgrid(again['P_grid'], tariff)), "Re-solve should match the first solve"
+    assert [record['status'] for record in telemetry] == ['optimal', 'optimal'], "Each solve should report telemetry"
+    assert telemetry[0]['build_time_s'] > 0 and telemetry[1]['build_time_s'] == 0, "Only the first solve builds"
+    assert telemetry[0]['n_variables'] == 5 * site_data.shape[0] + 1
+
+
+PEAK_RSS_SCRIPT = """
+import resource, sys
+import numpy as np
+import pandas as pd
+from batteryopt import run_optimization
+n = int(sys.argv[1])
+idx = pd.date_range("2024-01-01", periods=n, freq="1h", tz="US/Pacific")
+rng = np.random.default_rng(0)
+site_data = pd.DataFrame({"load": rng.uniform(0, 2, n), "solar": rng.uniform(0, 1, n)}, index=idx)
+tariff = pd.DataFrame({"px_buy": 0.4, "px_sell": 0.05}, index=idx)
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+run_optimization(site_data, tariff)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+
+def peak_rss_increase_kb(n: int) -> int:
+    """Peak RSS growth (kB on Linux) of building and solving an n-step dispatch problem in a fresh interpreter"""
+    out = subprocess.run([sys.executable, "-c", PEAK_RSS_SCRIPT, str(n)], cwd=get_test_root().parent,
+                         capture_output=True, text=True, check=True)
+    return int(out.stdout.strip().splitlines()[-1])
+
+
+def test_dispatch_memory_linear_in_horizon():
+    # A dense n x (n+1) transition matrix alone would add ~1.2 GB between these horizons
+    small, large = 24 * 30, 24 * 180
+    kb_per_step = (peak_rss_increase_kb(large) - peak_rss_increase_kb(small)) / (large - small)
+    assert kb_per_step < 25, f"Peak memory grew {kb_per_step:.1f} kB per timestep"
+
+
+def test_rolling_horizon_cost_gap(elec_usage):
+    elec_usage = elec_usage.iloc[:24 * 28]
+    site_data = merge_solar_and_load_data(elec_usage, 3 * SOLAR_SIZE_KW * get_ref_solar_data())
+    tariff = build_tariff(site_data.index)
+
+    oneway_eff = np.sqrt(BATT_RT_EFF)
+    for kwargs, max_gap in [(dict(window='1D', lookahead='1D'), 0.05),
+                            # Pinning the state of charge at every midnight costs more than weekly boundaries
+                            (dict(window='1D', parallel=True, max_workers=2), 0.4),
+                            (dict(window='7D', parallel=True, max_workers=2, window_soc=0.5), 0.05)]:
+        rolling = run_rolling_horizon_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX, **kwargs)
+        assert rolling.index.equals(site_data.index), "Windows should cover the full horizon exactly once"
+        # The stitched schedule follows the state-of-charge update, across window boundaries too
+        p_batt = rolling['P_batt'].to_numpy()[1:]
+        expected_e = rolling['E'].to_numpy()[:-1] - np.where(p_batt < 0, p_batt * oneway_eff, p_batt / oneway_eff)
+        np.testing.assert_allclose(rolling['E'].to_numpy()[1:], expected_e, atol=1e-5)
+
+        costs = get_rolling_horizon_cost_gap(site_data, tariff, batt_e_max=BATT_SIZE_EMAX, **kwargs)
+        assert costs['rolling'] == pytest.approx(get_daily_cost_from_pgrid(rolling['P_grid'], tariff))
+        assert costs['gap'] >= -1e-6, "Rolling horizon cannot beat the full-horizon optimum"
+        assert costs['gap'] <= max_gap, f"Rolling horizon cost gap {costs['gap']:.3f} $/day is too large"
+
+    with pytest.raises(ValueError):
+        run_rolling_horizon_optimization(site_data, tariff, parallel=True, lookahead='1D')
+
+
+def test_dp_cost_gap(elec_usage):
+    elec_usage = elec_usage.iloc[:24 * 28]
+    site_data = merge_solar_and_load_data(elec_usage, 3 * SOLAR_SIZE_KW * get_ref_solar_data())
+    tariff = build_tariff(site_data.index)
+
+    lp_cost = get_daily_cost_from_pgrid(run_optimization(site_data, tariff)['P_grid'], tariff)
+    for soc_steps, max_gap in [(51, 0.15), (201, 0.05)]:
+        dp = run_dp_optimization(site_data, tariff, soc_steps=soc_steps)
+        assert np.allclose(dp['P_batt'] + dp['P_grid'], site_data['load'] - site_data['solar']), "Power must balance"
+        assert dp['P_batt'].abs().max() <= 5 + 1e-9, "Battery power must respect the power rating"
+        assert dp['E'].between(0.2 * 13.5 - 1e-9, 13.5 + 1e-9).all(), "State of charge must stay within bounds"
+        gap = get_daily_cost_from_pgrid(dp['P_grid'], tariff) - lp_cost
+        assert -1e-6 <= gap <= max_gap, f"DP with {soc_steps} SOC steps is {gap:.3f} $/day off the LP"
+
+
+def test_cost_surface(elec_usage):
+    elec_usage = elec_usage.iloc[:24 * 7]
+    tariff = build_tariff(elec_usage.index)
+    solar_sizes_kw, batt_sizes_kwh = [0.0, 4.0], [0.0, 13.5, 27.0]
+
+    surface = get_daily_optimized_cost_surface(elec_usage, tariff, solar_sizes_kw, batt_sizes_kwh, max_workers=2)
+    assert surface.shape == (len(batt_sizes_kwh), len(solar_sizes_kw)), "Surface should cover the full grid"
+    assert np.isclose(surface.loc[13.5, 4.0], get_daily_optimized_cost(elec_usage, tariff, 4.0, 13.5)), \
+        "Surface should match single-point evaluation"
+    assert (surface.diff().iloc[1:] <= 1e-6).all().all(), "Cost should not increase with battery size"
+    assert (surface.diff(axis=1).iloc[:, 1:] <= 1e-6).all().all(), "Cost should not increase with solar size"
+
+    # Other battery parameters pass through, but the grid sets the battery size
+    smaller_inverter = get_daily_optimized_cost_surface(elec_usage, tariff, [4.0], [13.5], max_workers=1, batt_p_max=2.0)
+    assert smaller_inverter.loc[13.5, 4.0] >= surface.loc[13.5, 4.0] - 1e-6
+    with pytest.raises(ValueError):
+        get_daily_optimized_cost_surface(elec_usage, tariff, [4.0], [13.5], batt_e_max=10.0)
+
+
+def test_warm_start(elec_usage):
+    elec_usage = elec_usage.iloc[:24 * 28]
+    site_data = merge_solar_and_load_data(elec_usage, 3 * SOLAR_SIZE_KW * get_ref_solar_data())
+    tariff = build_tariff(site_data.index)
+    prob = get_dispatch_problem(site_data.shape[0])
+
+    run_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX, solver=cp.SCS)
+    run_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX + 0.5, solver=cp.SCS)
+    cold_iters = prob.prob.solver_stats.num_iters
+
+    previous = run_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX, solver=cp.SCS)
+    run_optimization(site_data, tariff, batt_e_max=BATT_SIZE_EMAX + 0.5, solver=cp.SCS, warm_start=True)
+    warm_iters = prob.prob.solver_stats.num_iters
+    assert warm_iters < cold_iters, "Warm-starting from a nearby solution should take fewer iterations"
+
+    n_batts, s_size_kw, res = run_endogenous_sizing_optimization(site_data.assign(solar=site_data['solar'] / 3), tariff,
+                                                                 solver=cp.HIGHS,
+                                                                 solver_opts={'time_limit': 60.0},
+                                                                 initial_dispatch=previous,
+                                                                 initial_sizes=(1, 3.0))
+    assert res.shape[0] == site_data.shape[0], "Sizing should solve with the requested solver"
+
+
 def test_notech_cost(elec_usage):
     tariff = build_tariff(elec_usage.index)
     average_daily_cost = get_daily_cost_from_pgrid(elec_usage, tariff=tariff)
@@ -44,7 +185,7 @@ def test_notech_cost(elec_usage):
 
 def test_simple_self_consumption(elec_usage):
     tariff = build_tariff(elec_usage.index)
-    site_data = merge_solar_and_load_data(elec_usage, SOLAR_SIZE_KW * REF_SOLAR_DATA)
+    site_data = merge_solar_and_load_data(elec_usage, SOLAR_SIZE_KW * get_ref_solar_data())
 
     simple_sc = simple_self_consumption(site_data,
                                         tariff,
@@ -56,6 +197,24 @@ def test_simple_self_consumption(elec_usage):
     assert average_daily_cost >= 0, "Total cost should be non-negative"
 
 
+def test_simple_self_consumption_batch(elec_usage):
+    site_data = merge_solar_and_load_data(elec_usage, 3 * SOLAR_SIZE_KW * get_ref_solar_data())
+    net_load = (site_data['load'] - site_data['solar']).to_numpy()
+    net_loads = np.stack([net_load, 2 * net_load, 0.5 * net_load])
+    batt_sizes = np.array([0.0, BATT_SIZE_EMAX, 2 * BATT_SIZE_EMAX])
+
+    p_batt, p_grid, e_batt = simple_self_consumption_kernel(net_loads, batt_sizes, batt_rt_eff=BATT_RT_EFF,
+                                                            batt_p_max=BATT_SIZE_PMAX)
+    assert p_batt.shape == p_grid.shape == e_batt.shape == net_loads.shape, "Results should stack like the inputs"
+    assert np.all(p_batt[0] == 0), "A zero-size battery should never dispatch"
+    for k in range(len(batt_sizes)):
+        single = simple_self_consumption_kernel(net_loads[k], batt_sizes[k], batt_rt_eff=BATT_RT_EFF,
+                                                batt_p_max=BATT_SIZE_PMAX)
+        for batch_res, single_res in zip((p_batt, p_grid, e_batt), single):
+            assert np.allclose(batch_res[k], single_res), "Batched and single-profile kernels should agree"
+        assert e_batt[k].max() <= batt_sizes[k] + 1e-9, "Battery should not charge beyond its size"
+
+
 def load_palmetto_df(infile: os.PathLike) -> pd.DataFrame:
     # Because of bad tz-naive indexing we need to drop-reindex-interpolate over the bad timestamps
     load_df = pd.read_csv(infile, index_col=0, parse_dates=[0])
@@ -77,19 +236,17 @@ def test_all_scenarios():
     solar_size_kw = 4.0
     batt_size_kwh = 13.5
 
-    result_stats = pd.DataFrame(columns=["daily_cost", "solar_size_kw", "batt_size_kwh"],
-                                index=load_df.columns)
-
-    for lbl, elec_usage in load_df.items():
-        battery_dispatch = optimization_usage_from_batt_solar_size(elec_usage.rename("load"),
-                                                                   tariff=tariff,
-                                                                   solar_size_kw=solar_size_kw,
-                                                                   batt_size_kwh=batt_size_kwh)
-
-        result_stats.loc[lbl, "daily_cost"] = get_daily_cost_from_pgrid(battery_dispatch['P_grid'], tariff) * 30
-        result_stats.loc[lbl, "solar_size_kw"] = solar_size_kw
-        result_stats.loc[lbl, "batt_size_kwh"] = batt_size_kwh
-
+    telemetry = []
+    dispatches, result_stats = run_scenarios(load_df, tariff,
+                                             solar_size_kw=solar_size_kw,
+                                             batt_size_kwh=batt_size_kwh,
+                                             telemetry_callback=telemetry.append)
+    assert list(dispatches) == list(load_df.columns), "Scenario results should come back in column order"
+    assert [record["scenario"] for record in telemetry] == list(load_df.columns), "Each scenario should report telemetry"
+    assert all(record["status"] == "optimal" for record in telemetry), "All scenarios should solve to optimality"
+    result_stats["daily_cost"] = result_stats["daily_cost"] * 30
+
+    for lbl, battery_dispatch in dispatches.items():
         battery_dispatch.to_csv(output_root / (lbl + "_battery_dispatch.csv"))
 
     result_stats.to_csv(output_root / "result_stats.csv")
@@ -123,27 +280,26 @@ def test_all_scenarios_incl_sizing(ng_cost, elec_usage):
     load_df = load_palmetto_df(infile)
     load_df = load_df.loc[load_df.index[0]:load_df.index[0] + duration]
     tariff = build_tariff(load_df.index)
-    solar_series_per_kw = REF_SOLAR_DATA
-    solar_data = merge_solar_and_load_data(load_df, solar_series_per_kw)['solar']
+    solar_series_per_kw = get_ref_solar_data()
+
+    dispatches, sizing_stats = run_sizing_scenarios(load_df * load_multiplier,
+                                                    tariff=tariff,
+                                                    solar_series_per_kw=solar_series_per_kw,
+                                                    solar_annualized_cost_per_kw=solar_annualized_cost_per_kw,
+                                                    batt_annualized_cost_per_unit=batt_annualized_cost_per_unit,
+                                                    batt_rt_eff=batt_rt_eff,
+                                                    batt_block_e_max=batt_block_e_max,
+                                                    batt_p_max=batt_p_max,
+                                                    integer_problem=integer_problem,
+                                                    telemetry_callback=lambda record: logger.info(
+                                                        f"{record['scenario']}: optimization done in {record['wall_time_s']} seconds"),
+                                                    )
 
     result_stats = pd.DataFrame(columns=["energy_cost", "equipment_cost", "solar_size_kw", "batt_size_kwh"],
                                 index=load_df.columns)
 
-    for lbl, elec_usage in load_df.items():
-        opt_start = time.time()
-        res = run_endogenous_sizing_optimization(pd.concat([solar_data, elec_usage.rename("load") * load_multiplier], axis=1),
-                                                 tariff=tariff,
-                                                 solar_annualized_cost_per_kw=solar_annualized_cost_per_kw,
-                                                 batt_annualized_cost_per_unit=batt_annualized_cost_per_unit,
-                                                 batt_rt_eff=batt_rt_eff,
-                                                 batt_block_e_max=batt_block_e_max,
-                                                 batt_p_max=batt_p_max,
-                                                 integer_problem=integer_problem,
-                                                 )
-
-        opt_end = time.time()
-        logger.info(f"Optimization done in {opt_end - opt_start} seconds")
-        n_batts, s_size_kw, battery_dispatch = res
+    for lbl, battery_dispatch in dispatches.items():
+        n_batts, s_size_kw = sizing_stats.loc[lbl, "n_batts"], sizing_stats.loc[lbl, "solar_size_kw"]
 
         if "ev_False" in lbl:
             result_stats.loc[lbl, "transport_fuel_cost"] = ice_vehicle_fuel_cost_monthly
@@ -155,10 +311,10 @@ def test_all_scenarios_incl_sizing(ng_cost, elec_usage):
         else:
             result_stats.loc[lbl, "natural_gas_bill"] = 0
 
-        result_stats.loc[lbl, "electricity_cost"] = get_daily_cost_from_pgrid(battery_dispatch['P_grid'], tariff) * 30
+        result_stats.loc[lbl, "electricity_cost"] = sizing_stats.loc[lbl, "daily_cost"] * 30
         result_stats.loc[lbl, "equipment_cost"] = (n_batts * batt_annualized_cost_per_unit + s_size_kw * solar_annualized_cost_per_kw) / 365 * 30
         result_stats.loc[lbl, "solar_size_kw"] = s_size_kw
-        result_stats.loc[lbl, "batt_size_kwh"] = n_batts * batt_block_e_max
+        result_stats.loc[lbl, "batt_size_kwh"] = sizing_stats.loc[lbl, "batt_size_kwh"]
 
         battery_dispatch.to_csv(output_root / (lbl + "_battery_dispatch.csv"), float_format="%.3f")
 
@@ -0,0 +1,157 @@
+import json
+import re
+from urllib.parse import urlsplit, parse_qs
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import pandas as pd
+
+from bayou import BayouClient, BayouIntervalCache
+
+
+def make_customer(customer_id: int, ready: bool) -> dict:
+    return {
+        'id': customer_id,
+        'intervals_are_ready': ready,
+        'account_numbers': [{'meters': [{'id': 10 * customer_id, 'type': 'electric'},
+                                        {'id': 10 * customer_id + 1, 'type': 'gas'}]}],
+    }
+
+
+def make_interval(hour: int, kwh: float, updated_at: str = '2024-01-02T00:00:00Z') -> dict:
+    return {'start': f'2024-01-01T{hour:02d}:00:00-08:00', 'end': f'2024-01-01T{hour + 1:02d}:00:00-08:00',
+            'net_electricity_consumption': kwh, 'created_at': '2024-01-02T00:00:00Z', 'updated_at': updated_at}
+
+
+def make_intervals(customer_id: int) -> dict:
+    return {'meters': [{'id': 10 * customer_id, 'intervals': [make_interval(1, 0.5), make_interval(0, 0.4)]},
+                       {'id': 10 * customer_id + 1, 'intervals': [make_interval(0, 9.9)]}]}
+
+
+class FakeBayouHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Bayou API: customer 1's intervals take two polls to be ready, and every customer's first
+    intervals request fails with a 503"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        requests_seen = self.server.requests_seen
+        with self.server.lock:
+            requests_seen[url.path] += 1
+            count = requests_seen[url.path]
+        match = re.fullmatch(r'/api/v2/customers/(\d+)(/intervals)?', url.path)
+        if match is None:
+            return self.send_json(404, {'error': 'not found'})
+        customer_id = int(match.group(1))
+        if match.group(2):
+            if count == 1:
+                return self.send_json(503, {'error': 'unavailable'})
+            intervals = self.server.intervals.get(customer_id) or make_intervals(customer_id)
+            updated_after = parse_qs(url.query).get('updated_after')
+            if updated_after and not self.server.ignore_updated_after:
+                # The filter is inclusive, so intervals updated exactly at updated_after are returned again
+                updated_after = pd.Timestamp(updated_after[0])
+                intervals = {'meters': [{'id': meter['id'], 'intervals': [
+                    i for i in meter['intervals'] if pd.Timestamp(i['updated_at']) >= updated_after]}
+                    for meter in intervals['meters']]}
+            self.server.responses.append(intervals)
+            return self.send_json(200, intervals)
+        return self.send_json(200, make_customer(customer_id, ready=customer_id != 1 or count > 2))
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def bayou_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBayouHandler)
+    server.requests_seen = Counter()
+    server.lock = threading.Lock()
+    server.intervals = {}
+    server.ignore_updated_after = False
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_bayou_client(bayou_server):
+    base_url = f'http://127.0.0.1:{bayou_server.server_address[1]}'
+    with BayouClient(api_key='test', base_url=base_url, backoff_factor=0, poll_interval=0.01, max_workers=4) as client:
+        results = client.get_electric_intervals_for_customers([1, 2, 3, 2])
+
+    assert list(results) == [1, 2, 3]
+    for df in results.values():
+        assert df['net_electricity_consumption'].tolist() == [0.4, 0.5]  # electric meter only, sorted by start
+        assert (df['length'] == df['end'] - df['start']).all()
+
+    seen = bayou_server.requests_seen
+    assert seen['/api/v2/customers/1'] == 3  # polled until ready
+    assert seen['/api/v2/customers/2'] == 1  # metadata fetched once, despite the repeated id
+    assert seen['/api/v2/customers/2/intervals'] == 2  # retried after the 503
+
+
+def test_bayou_client_poll_timeout(bayou_server):
+    base_url = f'http://127.0.0.1:{bayou_server.server_address[1]}'
+    with BayouClient(api_key='test', base_url=base_url, poll_interval=0.05, poll_timeout=0.01) as client:
+        with pytest.raises(TimeoutError):
+            client.wait_for_intervals(1)
+
+
+def test_bayou_interval_cache(bayou_server, tmp_path):
+    base_url = f'http://127.0.0.1:{bayou_server.server_address[1]}'
+    with BayouClient(api_key='test', base_url=base_url, backoff_factor=0) as client:
+        cache = BayouIntervalCache(tmp_path, client=client)
+        first = cache.get_electric_intervals_dataframe(2)
+        assert first['net_electricity_consumption'].tolist() == [0.4, 0.5]
+
+        # Nothing changed, so the repeat fetch only transfers the intervals on the updated_after boundary
+        second = cache.get_electric_intervals_dataframe(2)
+        pd.testing.assert_frame_equal(first.reset_index(drop=True), second.reset_index(drop=True))
+
+        # A corrected interval replaces the cached version of the same interval
+        intervals = make_intervals(2)
+        intervals['meters'][0]['intervals'].append(make_interval(1, 0.7, updated_at='2024-01-03T00:00:00Z'))
+        bayou_server.intervals[2] = intervals
+        third = cache.get_electric_intervals_dataframe(2)
+        assert third['net_electricity_consumption'].tolist() == [0.4, 0.7]
+
+        # Only the boundary interval comes back now, and it is merged rather than taken for a full response
+        fourth = cache.get_electric_intervals_dataframe(2)
+        assert sum(len(meter['intervals']) for meter in bayou_server.responses[-1]['meters']) == 1
+        assert fourth['net_electricity_consumption'].tolist() == [0.4, 0.7]
+
+        # A customer without intervals yet gets an empty cache entry
+        bayou_server.intervals[3] = {'meters': [{'id': 30, 'intervals': []}]}
+        assert cache.get_electric_intervals_dataframe(3).empty
+        assert cache.get_electric_intervals_dataframe(3).empty
+
+
+def test_bayou_interval_cache_full_response(bayou_server, tmp_path):
+    # A server without updated_after support returns every interval on each request
+    bayou_server.ignore_updated_after = True
+    base_url = f'http://127.0.0.1:{bayou_server.server_address[1]}'
+    with BayouClient(api_key='test', base_url=base_url, backoff_factor=0) as client:
+        cache = BayouIntervalCache(tmp_path, client=client)
+        intervals = make_intervals(2)
+        intervals['meters'][0]['intervals'][0]['updated_at'] = '2024-01-03T00:00:00Z'
+        bayou_server.intervals[2] = intervals
+        assert cache.get_electric_intervals_dataframe(2)['net_electricity_consumption'].tolist() == [0.4, 0.5]
+
+        # The full response holds an interval older than the cache's newest, so it replaces the cache, and
+        # intervals the server no longer has are dropped
+        bayou_server.intervals[2] = {'meters': [{'id': 20, 'intervals': [make_interval(0, 0.4)]}]}
+        assert cache.get_electric_intervals_dataframe(2)['net_electricity_consumption'].tolist() == [0.4]
+        assert len(cache.read(2)) == 1
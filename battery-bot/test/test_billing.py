@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from billing import (get_interval_costs, sum_by_period, apply_net_billing, get_monthly_bills, get_annual_bills,
+                     get_daily_average_costs)
+from tariff import SIMPLE_TOU_TARIFF, get_tariff_frame
+
+IDX = pd.date_range('2024-02-01', '2025-01-31 23:00', freq='h', tz='US/Pacific')
+
+
+def get_p_grid(seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    return pd.Series(rng.normal(0.3, 1.0, len(IDX)), index=IDX)
+
+
+def test_interval_costs_match_rowwise():
+    tariff = get_tariff_frame(SIMPLE_TOU_TARIFF, IDX)
+    p_grid = get_p_grid()
+    rowwise = pd.concat([p_grid.rename('P_grid'), tariff], axis=1).apply(
+        lambda x: x.P_grid * x.px_buy if x.P_grid > 0 else x.P_grid * x.px_sell, axis=1)
+    np.testing.assert_allclose(get_interval_costs(p_grid, tariff['px_buy'], tariff['px_sell']), rowwise)
+
+    # The dot-product formula the optimizers used before
+    dot = tariff['px_buy'] @ p_grid.clip(lower=0) + tariff['px_sell'] @ p_grid.clip(upper=0)
+    assert np.isclose(get_annual_bills(p_grid, tariff).iloc[0], dot)
+
+
+def test_batch_matches_single_scenario():
+    tariff = get_tariff_frame(SIMPLE_TOU_TARIFF, IDX)
+    p_grid = pd.DataFrame({f'scenario_{i}': get_p_grid(i) for i in range(4)})
+    batch = get_monthly_bills(p_grid, tariff)
+    assert list(batch.columns) == list(p_grid.columns)
+    assert len(batch) == 12
+    for col in p_grid:
+        pd.testing.assert_series_equal(batch[col], get_monthly_bills(p_grid[col].rename(col), tariff)[col])
+
+    days = (IDX[-1] - IDX[0]).days
+    pd.testing.assert_series_equal(get_daily_average_costs(p_grid, tariff), batch.sum() / days)
+
+
+def test_sum_by_period():
+    costs = np.array([[1.0, 2.0, 3.0, 4.0], [10.0, 20.0, 30.0, 40.0]])
+    codes = np.array([0, 0, 2, 2])
+    np.testing.assert_array_equal(sum_by_period(costs, codes, 3), [[3, 0, 7], [30, 0, 70]])
+    np.testing.assert_array_equal(sum_by_period(costs[0], codes, 3), [3, 0, 7])
+
+
+def test_fixed_charges():
+    tariff = get_tariff_frame(SIMPLE_TOU_TARIFF, IDX)
+    p_grid = pd.Series(0.0, index=IDX)
+    bills = get_monthly_bills(p_grid, tariff, fixed_charges={'per_day': 0.5, 'per_month': 10.0})
+    assert np.isclose(bills.iloc[0, 0], 29 * 0.5 + 10.0)  # February 2024
+    assert np.isclose(bills.sum().iloc[0], 366 * 0.5 + 12 * 10.0)
+
+
+def test_net_billing_carries_credits_forward():
+    np.testing.assert_allclose(apply_net_billing(np.array([-5.0, 3.0, 4.0, -1.0])), [0, 0, 2, 0])
+    np.testing.assert_allclose(apply_net_billing(np.array([-5.0, 3.0, 4.0, -1.0]), surplus_credit_fraction=0.5),
+                               [0, 0, 2, -0.5])
+    # A true-up after the second month settles the 2 left over then, so the third month's charge isn't offset
+    np.testing.assert_allclose(apply_net_billing(np.array([-5.0, 3.0, 4.0, -1.0]), surplus_credit_fraction=0.5,
+                                                 true_up=np.array([False, True, False, False])), [0, -1, 4, -0.5])
+    batch = apply_net_billing(np.array([[-5.0, 3.0, 4.0, -1.0], [1.0, 1.0, 1.0, 1.0]]))
+    np.testing.assert_allclose(batch, [[0, 0, 2, 0], [1, 1, 1, 1]])
+
+
+def test_net_billing_never_below_fixed_charges():
+    tariff = get_tariff_frame(SIMPLE_TOU_TARIFF, IDX)
+    p_grid = pd.Series(-2.0, index=IDX)  # exports every hour
+    fixed_charges = {'per_month': 10.0}
+    bills = get_monthly_bills(p_grid, tariff, fixed_charges=fixed_charges, net_billing=True)
+    np.testing.assert_allclose(bills.iloc[:, 0], 10.0)
+    assert (get_monthly_bills(p_grid, tariff, fixed_charges=fixed_charges).iloc[:, 0] < 0).all()
+
+
+def test_true_up_month():
+    tariff = get_tariff_frame(SIMPLE_TOU_TARIFF, IDX)
+    # Exports through July 2024, imports from August: credits settled at the end of July don't offset later imports
+    p_grid = pd.Series(np.where(IDX < '2024-08-01', -1.0, 1.0), index=IDX)
+    annual = get_monthly_bills(p_grid, tariff, net_billing=True)
+    july = get_monthly_bills(p_grid, tariff, net_billing=True, true_up_month=7)
+    assert (july.loc['2024-08':, 0] > 0).all()
+    assert july.iloc[:, 0].sum() > annual.iloc[:, 0].sum()
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from cachestore import LRUCache, ResponseCache, atomic_write, get_request_key
+
+
+def test_request_key_is_canonical():
+    assert get_request_key({'a': 1, 'b': [1, 2]}) == get_request_key({'b': [1, 2], 'a': 1})
+    assert get_request_key({'a': 1}) != get_request_key({'a': 2})
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'entry.json'
+    atomic_write(path, lambda f: f.write(b'old'))
+
+    def failing_write(f):
+        f.write(b'partial')
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(path, failing_write)
+    # The previous contents survive, and the temporary file is cleaned up
+    assert path.read_bytes() == b'old'
+    assert [p.name for p in tmp_path.iterdir()] == ['entry.json']
+
+
+def test_response_cache(tmp_path):
+    calls = []
+
+    def fetch(payload):
+        calls.append(payload)
+        return {'value': payload['x'] * 2}
+
+    cache = ResponseCache(tmp_path, ttl=60)
+    assert cache.get_or_fetch({'x': 1}, fetch) == {'value': 2}
+    assert cache.get_or_fetch({'x': 1}, fetch) == {'value': 2}
+    assert len(calls) == 1
+
+    # A new process sees the disk store
+    assert ResponseCache(tmp_path).get_or_fetch({'x': 1}, fetch) == {'value': 2}
+    assert len(calls) == 1
+
+    expired = ResponseCache(tmp_path, ttl=0)
+    assert expired.get({'x': 1}) is None
+    expired.get_or_fetch({'x': 1}, fetch)
+    assert len(calls) == 2
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=300)
+    for i in range(5):
+        cache.put({'x': i}, 'y' * 100)
+        time.sleep(0.01)
+    files = list(tmp_path.glob('*.json'))
+    assert 0 < len(files) < 5
+    assert cache.get({'x': 4}) == 'y' * 100
+    assert cache.get({'x': 0}) is None
+
+
+def test_memory_is_bounded_by_bytes(tmp_path):
+    lru = LRUCache(maxsize=10, max_bytes=250)
+    for i in range(3):
+        lru.put(i, 'y' * 100, 100)
+    assert 0 not in lru and len(lru) == 2
+    lru.put(3, 'y' * 300, 300)  # larger than the whole budget, so nothing is kept
+    assert len(lru) == 0
+
+    cache = ResponseCache(tmp_path, max_memory_bytes=300)
+    for i in range(5):
+        cache.put({'x': i}, 'y' * 100)
+    assert len(cache._memory) == 2
+    # Responses evicted from memory are still served from disk
+    assert cache.get({'x': 0}) == 'y' * 100
+
+
+def test_response_cache_single_flight(tmp_path):
+    cache = ResponseCache(tmp_path)
+    calls = []
+    release = threading.Event()
+
+    def slow_fetch(payload):
+        calls.append(payload)
+        release.wait(5)
+        return 'response'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch({'x': 1}, slow_fetch)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ['response'] * 4
+    assert len(calls) == 1
+
+    def failing_fetch(payload):
+        raise RuntimeError("upstream error")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_fetch({'x': 2}, failing_fetch)
+    assert cache.get({'x': 2}) is None
@@ -0,0 +1,112 @@
+import os
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFullError, JobCancelledError, JobFailedError
+
+
+def add(a, b):
+    return a + b
+
+
+def sleep_then_return(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def fail():
+    raise ValueError("bad input")
+
+
+def get_pid():
+    return os.getpid()
+
+
+def wait_for_status(queue, job_id, status, timeout=10):
+    deadline = time.monotonic() + timeout
+    while queue.get_status(job_id)['status'] != status:
+        assert time.monotonic() < deadline, f"Job never became {status}"
+        time.sleep(0.01)
+
+
+def test_result_and_status():
+    queue = JobQueue(max_workers=1)
+    job_id = queue.submit(add, 1, b=2)
+    assert queue.get_result(job_id, timeout=10) == 3
+    # Results are handed out once, so the queue doesn't hold on to them
+    with pytest.raises(LookupError):
+        queue.get_result(job_id)
+    status = queue.get_status(job_id)
+    assert status['status'] == 'done'
+    assert status['submitted'] <= status['started'] <= status['finished']
+    # Each job runs in its own worker process
+    assert queue.get_result(queue.submit(get_pid), timeout=10) != os.getpid()
+
+
+def test_failed_job_keeps_traceback():
+    queue = JobQueue(max_workers=1)
+    job_id = queue.submit(fail)
+    with pytest.raises(JobFailedError, match="ValueError: bad input"):
+        queue.get_result(job_id, timeout=10)
+    assert queue.get_status(job_id)['status'] == 'failed'
+
+
+def test_unpicklable_job_fails_and_frees_slot():
+    queue = JobQueue(max_workers=1)
+    job_id = queue.submit(lambda: None)  # workers aren't forked from this process, so fn must be picklable
+    status = queue.get_status(job_id)
+    assert status['status'] == 'failed' and status['position'] is None
+    assert 'pickle' in status['error'].lower()
+    with pytest.raises(JobFailedError):
+        queue.get_result(job_id, timeout=10)
+    assert queue.get_result(queue.submit(add, 1, 1), timeout=10) == 2
+
+
+def test_concurrency_limit_and_backpressure():
+    queue = JobQueue(max_workers=1, max_pending=2)
+    running = queue.submit(sleep_then_return, 0.5, 'first')
+    wait_for_status(queue, running, 'running')
+    queued = [queue.submit(add, i, 1) for i in range(2)]
+    assert [queue.get_status(job_id)['position'] for job_id in queued] == [0, 1]
+    assert queue.get_counts()['running'] == 1
+    with pytest.raises(QueueFullError):
+        queue.submit(add, 0, 0)
+
+    assert queue.get_result(running, timeout=10) == 'first'
+    assert [queue.get_result(job_id, timeout=10) for job_id in queued] == [1, 2]
+
+
+def test_cancel_running_and_queued():
+    queue = JobQueue(max_workers=1)
+    running = queue.submit(sleep_then_return, 60, None)
+    queued = queue.submit(add, 1, 1)
+    wait_for_status(queue, running, 'running')
+
+    assert queue.cancel(queued)
+    start = time.monotonic()
+    assert queue.cancel(running)
+    with pytest.raises(JobCancelledError):
+        queue.get_result(running, timeout=10)
+    assert queue.get_status(queued)['status'] == 'cancelled'
+    assert not queue.cancel(running)
+
+    # The terminated worker's slot is freed for the next job
+    assert queue.get_result(queue.submit(add, 2, 2), timeout=10) == 4
+    assert time.monotonic() - start < 10
+
+
+def test_timeout():
+    queue = JobQueue(max_workers=1, timeout=0.2)
+    job_id = queue.submit(sleep_then_return, 60, None)
+    with pytest.raises(JobFailedError, match="TimeoutError"):
+        queue.get_result(job_id, timeout=10)
+
+
+def test_finished_jobs_are_forgotten():
+    queue = JobQueue(max_workers=1, max_finished=2)
+    job_ids = [queue.submit(add, i, 0) for i in range(4)]
+    queue.get_result(job_ids[-1], timeout=10)
+    with pytest.raises(KeyError):
+        queue.get_status(job_ids[0])
+    assert queue.get_status(job_ids[-1])['status'] == 'done'
@@ -0,0 +1,51 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from meterstore import ingest_meter_exports, load_meter_series, load_fleet
+from test.utils import REF_ELEC_LOAD_DATA_FILE, REF_NG_LOAD_DATA_FILE
+from utils import read_pge_meterdata
+
+
+def test_ingest_and_load(tmp_path):
+    source_dir = tmp_path / "exports"
+    store_dir = tmp_path / "store"
+    for customer in ["customer_a", "customer_b"]:
+        (source_dir / customer).mkdir(parents=True)
+        shutil.copy(REF_ELEC_LOAD_DATA_FILE, source_dir / customer)
+    shutil.copy(REF_NG_LOAD_DATA_FILE, source_dir / "customer_a")
+
+    written = ingest_meter_exports(source_dir, store_dir, max_workers=1)
+    assert sorted((customer, meter) for customer, meter, _ in written) == [
+        ("customer_a", "electric_service_1"), ("customer_a", "natural_gas_service_2"),
+        ("customer_b", "electric_service_1")]
+
+    parsed = read_pge_meterdata(REF_ELEC_LOAD_DATA_FILE)
+    s = load_meter_series("customer_a", store_dir=store_dir)
+    assert s.name == 'load'
+    assert s.index.equals(parsed.index)
+    np.testing.assert_allclose(s.values, parsed['USAGE (kWh)'].values)
+
+    gas_cost = load_meter_series("customer_a", "natural_gas_service_2", column="cost", store_dir=store_dir)
+    np.testing.assert_allclose(gas_cost.values, read_pge_meterdata(REF_NG_LOAD_DATA_FILE)['COST'].values)
+
+    fleet = load_fleet(store_dir=store_dir)
+    assert sorted(fleet.columns) == ["customer_a", "customer_b"]
+    pd.testing.assert_series_equal(fleet["customer_b"], s, check_names=False)
+    assert list(load_fleet(["customer_b"], store_dir=store_dir).columns) == ["customer_b"]
+
+
+def test_ingest_in_worker_processes(tmp_path):
+    source_dir = tmp_path / "exports"
+    for customer in ["customer_a", "customer_b", "customer_c"]:
+        (source_dir / customer).mkdir(parents=True)
+        shutil.copy(REF_ELEC_LOAD_DATA_FILE, source_dir / customer)
+    shutil.copy(REF_NG_LOAD_DATA_FILE, source_dir / "customer_a")
+
+    # The process pool writes the same partitions, and returns them in the same order, as the serial path
+    serial = ingest_meter_exports(source_dir, tmp_path / "serial", max_workers=1)
+    parallel = ingest_meter_exports(source_dir, tmp_path / "parallel", max_workers=2)
+    assert parallel == serial and len(parallel) == 4
+    pd.testing.assert_frame_equal(load_fleet(store_dir=tmp_path / "parallel"),
+                                  load_fleet(store_dir=tmp_path / "serial"))
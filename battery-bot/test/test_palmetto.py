@@ -1,7 +1,14 @@
-from palmetto import get_palmetto_data
-from utils import series_to_palmetto_records
+import palmetto
+from cachestore import ResponseCache
+from palmetto import (get_palmetto_data, get_palmetto_variants, get_equipment_variants, build_palmetto_payload,
+                      iter_palmetto_request_body, post_palmetto_request_with_retry)
+from utils import series_to_palmetto_records, series_to_palmetto_usage
+import json
+import numpy as np
 import pandas as pd
 import pytest
+import requests
+import time
 from test.utils import elec_usage, get_test_root
 import logging
 
@@ -25,6 +32,83 @@ def test_palmetto_data_from_address():
     assert consumption.equals(imports)
 
 
+def test_palmetto_data_cached(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_post(payload):
+        calls.append(payload)
+        return [{'from_datetime': '2024-04-01T00:00:00', 'to_datetime': '2024-04-01T01:00:00',
+                 'variable': 'consumption.electricity', 'value': 1.5}]
+
+    monkeypatch.setattr(palmetto, 'post_palmetto_request', fake_post)
+    monkeypatch.setattr(palmetto, 'get_palmetto_response_cache', lambda: ResponseCache(tmp_path))
+    first = get_palmetto_data(address="468 Noe St, San Francisco, CA 94114", ev_charging_present=True)
+    second = get_palmetto_data(address="468 Noe St, San Francisco, CA 94114", ev_charging_present=True)
+    pd.testing.assert_frame_equal(first, second)
+    assert len(calls) == 1
+
+    get_palmetto_data(address="468 Noe St, San Francisco, CA 94114", ev_charging_present=False)
+    assert len(calls) == 2
+
+
+def test_palmetto_variants(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_post(payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise requests.exceptions.ConnectionError("connection reset")
+        time.sleep(0.3)
+        hypothetical = {a['name']: a['value'] for a in payload['consumption']['attributes']['hypothetical']}
+        value = 1000.0 * (1 + hypothetical['ev_charging'] + 2 * hypothetical['hvac_heat_pump'])
+        return [{'from_datetime': f'2024-04-01T0{h}:00:00', 'to_datetime': f'2024-04-01T0{h + 1}:00:00',
+                 'variable': variable, 'value': value}
+                for h in range(3) for variable in ['consumption.electricity', 'grid.electricity.import']]
+
+    monkeypatch.setattr(palmetto, 'post_palmetto_request', fake_post)
+    monkeypatch.setattr(palmetto, 'get_palmetto_response_cache', lambda: ResponseCache(tmp_path))
+    variants = get_equipment_variants(solar_size_kw=1.0)
+
+    start = time.perf_counter()
+    res = get_palmetto_variants("468 Noe St, San Francisco, CA 94114", variants, requests_per_second=100,
+                                backoff=0.01)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 1.0, "variants should be requested concurrently"
+    assert len(calls) == 5  # one retry
+    assert list(res.columns) == ['load__ev_True__hvac_True', 'load__ev_True__hvac_False',
+                                 'load__ev_False__hvac_True', 'load__ev_False__hvac_False']
+    assert res.index.name == 'from_datetime'
+    assert res.iloc[0].tolist() == [4000.0, 2000.0, 3000.0, 1000.0]
+
+
+def test_palmetto_request_timeout_is_retried(monkeypatch):
+    timeouts = []
+
+    def fake_post(url, headers, data, timeout):
+        assert isinstance(data, bytes), "the body should be sent with a Content-Length, not chunked"
+        timeouts.append(timeout)
+        raise requests.exceptions.Timeout("read timed out")
+
+    monkeypatch.setenv('PALMETTO_API_KEY', 'test-key')
+    monkeypatch.setattr(palmetto.requests, 'post', fake_post)
+    payload = build_palmetto_payload("468 Noe St, San Francisco, CA 94114")
+    with pytest.raises(requests.exceptions.Timeout):
+        post_palmetto_request_with_retry(payload, max_retries=2, backoff=0.01)
+    assert timeouts == [palmetto.PALMETTO_TIMEOUT] * 3
+
+
+def test_streamed_request_body(elec_usage):
+    address = "468 Noe St, San Francisco, CA 94114"
+    records_payload = build_palmetto_payload(address, known_kwh_usage=series_to_palmetto_records(elec_usage))
+    usage = series_to_palmetto_usage(elec_usage)
+    body = b"".join(iter_palmetto_request_body(build_palmetto_payload(address, known_kwh_usage=usage), block_size=1000))
+    assert json.loads(body) == records_payload
+
+    usage['value'][0] = np.nan
+    body = b"".join(iter_palmetto_request_body(build_palmetto_payload(address, known_kwh_usage=usage)))
+    assert json.loads(body)['consumption']['actuals'][0]['value'] is None
+
+
 def test_palmetto_data_from_kwh(elec_usage):
     payload = series_to_palmetto_records(elec_usage)
     payload = payload[0:72]
@@ -46,7 +130,6 @@ def test_palmetto_data_from_kwh(elec_usage):
 
 def test_all_variants():
     import os
-    import time
     from utils import get_electricity_from_bayou_and_format_for_palmetto
     OUTFILE = get_test_root().parent / "data/scenario_data.csv"
     BAYOU_CUSTOMER_ID = int(os.getenv("BAYOU_CUSTOMER_ID_ANSHUL"))
@@ -61,31 +144,12 @@ def test_all_variants():
     battery_size_kwh = 0.0
     hvac_heating_capacity = 25.0
 
-    ev, hvac  = False, False
-
-    all_load_data = {}
-
-    for ev in [True, False]:
-        for hvac in [True, False]:
-            palmetto_start = time.time()
-            res = get_palmetto_data(
-                address=address,
-                granularity=granularity,
-                solar_size_kw=solar_size_kw,
-                batt_size_kwh=battery_size_kwh,
-                ev_charging_present=ev,
-                hvac_heat_pump_present=hvac,
-                hvac_heating_capacity=hvac_heating_capacity,
-                known_kwh_usage=interval_data
-            )
-            palmetto_end = time.time()
-            logging.info("Palmetto API call took: ", palmetto_end - palmetto_start)
-            df = pd.DataFrame.from_records(res).set_index(["from_datetime", "variable"])["value"].unstack("variable")
-            load_data = df["consumption.electricity"]
-            load_key = f"load__ev_{ev}__hvac_{hvac}"
-            all_load_data[load_key] = load_data
-
-    all_load_df = pd.DataFrame(all_load_data)
+    variants = get_equipment_variants(solar_size_kw=solar_size_kw, batt_size_kwh=battery_size_kwh,
+                                      hvac_heating_capacity=hvac_heating_capacity)
+    palmetto_start = time.time()
+    all_load_df = get_palmetto_variants(address, variants, known_kwh_usage=interval_data, granularity=granularity)
+    palmetto_end = time.time()
+    logging.info("Palmetto API calls took: ", palmetto_end - palmetto_start)
     all_load_df.to_csv(OUTFILE, float_format="%.3f")
     logger.info(f"Saved all load data to {OUTFILE}")
     print("Done")
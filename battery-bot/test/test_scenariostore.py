@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from billing import get_monthly_bills
+from scenariostore import (ScenarioStore, BASELINE, get_all_scenarios, get_scenario_name, get_scenario_inputs,
+                           get_effective_scenario, get_usage_hash, precompute_scenarios)
+from test.utils import REF_ELEC_LOAD_DATA_FILE
+
+
+def test_scenario_names():
+    scenarios = get_all_scenarios()
+    assert len(scenarios) == len(set(scenarios)) == 16
+    assert scenarios[0] == BASELINE == get_scenario_name()
+    assert scenarios[-1] == get_scenario_name(True, True, True, True) == 'pv-battery-ev-heat_pump'
+    assert get_scenario_inputs('pv-battery')['batt_size_kwh'] > 0
+    assert get_scenario_inputs(BASELINE)['solar_size_kw'] == 0
+    with pytest.raises(ValueError):
+        get_scenario_inputs('pv-wind')
+    # Without the Palmetto API, EV and heat pump don't change the solve
+    assert get_effective_scenario('pv-ev-heat_pump') == 'pv'
+    assert len(set(map(get_effective_scenario, scenarios))) == 4
+
+
+def test_precompute_and_read(tmp_path):
+    store = ScenarioStore(tmp_path)
+    usage_hash = get_usage_hash(REF_ELEC_LOAD_DATA_FILE)
+    scenarios = [BASELINE, 'pv-battery']
+    assert store.get_missing(usage_hash, scenarios) == scenarios
+
+    assert precompute_scenarios(REF_ELEC_LOAD_DATA_FILE, tmp_path, scenarios=scenarios) == scenarios
+    assert store.get_missing(usage_hash, scenarios) == []
+    # Stored scenarios are not solved again
+    assert precompute_scenarios(REF_ELEC_LOAD_DATA_FILE, tmp_path, scenarios=scenarios) == []
+
+    dispatch = store.read_dispatch(usage_hash, 'pv-battery')
+    assert (dispatch.dtypes == np.float32).all()
+    assert dispatch.index.max() - dispatch.index.min() <= pd.Timedelta(days=366)
+    bills = store.read_bills(usage_hash, 'pv-battery')
+    expected = get_monthly_bills(dispatch['P_grid'].astype(float), dispatch[['px_buy', 'px_sell']].astype(float))
+    np.testing.assert_allclose(bills, expected.iloc[:, 0], rtol=1e-4)
+    assert store.read_telemetry(usage_hash, 'pv-battery')['status'].eq('optimal').all()
+
+    all_bills = store.read_all_bills(usage_hash, scenarios)
+    assert sorted(all_bills.columns) == sorted(scenarios)
+    pd.testing.assert_series_equal(all_bills['pv-battery'], bills, check_names=False)
+    assert bills.sum() < all_bills[BASELINE].sum()
+
+    # Equivalent scenarios are read from the same solve rather than solved again
+    assert store.get_missing(usage_hash, ['pv-battery-ev']) == []
+    assert precompute_scenarios(REF_ELEC_LOAD_DATA_FILE, tmp_path, scenarios=['ev', 'pv-battery-heat_pump']) == []
+    assert len(store.read_all_bills(usage_hash).columns) == 8
+
+
+def test_eviction(tmp_path):
+    store = ScenarioStore(tmp_path, max_bytes=0)
+    dispatch = pd.DataFrame({'P_grid': 1.0, 'px_buy': 0.3, 'px_sell': 0.1},
+                            index=pd.date_range('2024-01-01', periods=48, freq='h', tz='US/Pacific'))
+    store.write('a', BASELINE, dispatch)
+    store.write('b', BASELINE, dispatch)
+    # Only the usage history just written is kept
+    assert not store.has('a', BASELINE) and store.has('b', BASELINE)
+
+    store.max_bytes = 10 * 2**20
+    store.write('a', BASELINE, dispatch)
+    assert store.has('a', BASELINE) and store.has('b', BASELINE)
+    time.sleep(0.01)
+    store.read_bills('b', BASELINE)  # 'a' is now the least recently used
+    store.max_bytes = (sum(f.stat().st_size for f in tmp_path.rglob('*') if f.is_file()) * 3) // 4
+    assert store.evict() == ['a']
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+import solar
+from solar import (write_binary_series, read_binary_series, get_ref_solar_data, get_package_root,
+                   SolarProfileStore)
+import pytest
+
+
+def test_binary_series_roundtrip(tmp_path):
+    for tz in ['US/Pacific', 'UTC-08:00']:
+        idx = pd.date_range('2024-03-09', periods=72, freq='1h', tz=tz)
+        s = pd.Series(np.linspace(0, 1, 72), index=idx, name='solar')
+        write_binary_series(s, tmp_path / 'weather.npy')
+        loaded = read_binary_series(tmp_path / 'weather.npy')
+        assert loaded.index.equals(s.index), "Index should survive the roundtrip, including DST transitions"
+        assert loaded.name == 'solar'
+        assert np.allclose(loaded.to_numpy(), s.to_numpy(), atol=1e-6)
+        # The values are memory-mapped rather than read into memory
+        values = loaded.to_numpy()
+        assert values.dtype == np.float64 and not values.flags.writeable
+        assert isinstance(values, np.memmap) or isinstance(values.base, np.memmap)
+
+
+def test_ref_solar_data_matches_csv():
+    csv_data = pd.read_csv(get_package_root() / 'data/weather_37.8_-122.4_2019_2021.csv', index_col=0, parse_dates=[0]).squeeze()
+    ref = get_ref_solar_data()
+    assert ref.index.equals(pd.DatetimeIndex(csv_data.index, tz=pd.Timestamp(csv_data.index[0]).tzinfo))
+    assert ref.dtype == np.float64
+    np.testing.assert_array_equal(ref.to_numpy(), csv_data.to_numpy())
+
+    # Callers get writable copies, and writes don't leak into the cached series
+    ref.iloc[:] = 0.0
+    assert get_ref_solar_data().sum() > 0
+    try:
+        solar.REF_SOLAR_DATA.iloc[0] = -1.0
+        assert solar.REF_SOLAR_DATA.iloc[0] == -1.0
+    finally:
+        del solar.REF_SOLAR_DATA
+
+
+class FakePVGIS:
+    """Local stand-in for get_expected_solar_output that counts calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, latitude, longitude, start_yr, end_yr, timezone, surface_tilt=None, surface_azimuth=180):
+        self.calls.append((latitude, longitude, surface_tilt, surface_azimuth))
+        idx = pd.date_range(f'{start_yr}-01-01', f'{end_yr}-12-31 23:00', freq='1h', tz=timezone)
+        return pd.Series(surface_tilt / 90 * np.clip(np.sin(np.pi * (idx.hour - 6) / 12), 0, None), index=idx, name='solar')
+
+
+def test_solar_profile_store(tmp_path):
+    fetch = FakePVGIS()
+    store = SolarProfileStore(tmp_path, fetch=fetch)
+
+    south = store.get(37.8, -122.4, 2019, 2019, 'US/Pacific')
+    assert store.get(37.8, -122.4, 2019, 2019, 'US/Pacific', surface_tilt=37.8).equals(south), "Tilt defaults to latitude"
+    flat = store.get(37.8, -122.4, 2019, 2019, 'US/Pacific', surface_tilt=10)
+    assert len(fetch.calls) == 2, "Orientation should be part of the key, and repeats should hit memory"
+    assert flat.sum() < south.sum()
+
+    fresh_store = SolarProfileStore(tmp_path, fetch=fetch)
+    assert fresh_store.get(37.8, -122.4, 2019, 2019, 'US/Pacific').equals(south), "Profiles should persist on disk"
+    assert len(fetch.calls) == 2
+
+    entry_bytes = sum(f.stat().st_size for f in tmp_path.iterdir()) / 2
+    small_store = SolarProfileStore(tmp_path, max_bytes=int(2.5 * entry_bytes), fetch=fetch)
+    small_store.get(37.8, -122.4, 2019, 2019, 'US/Pacific')  # most recently used survives eviction
+    small_store.get(40.0, -105.0, 2019, 2019, 'US/Mountain')
+    assert len(list(tmp_path.glob('*.npy'))) == 2, "Disk store should be trimmed to its size bound"
+    assert SolarProfileStore(tmp_path, fetch=fetch).get(37.8, -122.4, 2019, 2019, 'US/Pacific').equals(south)
+    assert len(fetch.calls) == 3
+
+
+def test_solar_profile_store_default_fetch(tmp_path):
+    # The reference profile comes from the bundled PVGIS export, through the store
+    store = SolarProfileStore(tmp_path)
+    profile = store.get(37.8, -122.4, 2019, 2021, 'US/Pacific')
+    pd.testing.assert_series_equal(profile, get_ref_solar_data())
+    assert [p.name for p in tmp_path.iterdir()] and not list(tmp_path.glob('.*')), "No temporary files left behind"
+    pd.testing.assert_series_equal(SolarProfileStore(tmp_path, fetch=None).get(37.8, -122.4, 2019, 2021, 'US/Pacific'),
+                                   profile)
+
+
+def test_write_binary_series_is_atomic(tmp_path, monkeypatch):
+    idx = pd.date_range('2024-03-09', periods=72, freq='1h', tz='US/Pacific')
+    s = pd.Series(np.linspace(0, 1, 72), index=idx, name='solar')
+    write_binary_series(s, tmp_path / 'weather.npy')
+
+    def crash(f, values):
+        f.write(b'partial')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, 'save', crash)
+    with pytest.raises(OSError):
+        write_binary_series(s * 2, tmp_path / 'weather.npy')
+    monkeypatch.undo()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['weather.json', 'weather.npy']
+    pd.testing.assert_series_equal(read_binary_series(tmp_path / 'weather.npy'), s, check_freq=False)
+
+    # A crash after the values but before the sidecar leaves them mismatched, which readers detect
+    np.save(tmp_path / 'weather.npy', np.zeros(48))
+    with pytest.raises(ValueError):
+        read_binary_series(tmp_path / 'weather.npy')
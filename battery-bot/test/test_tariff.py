@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from billing import get_monthly_fixed_charges
+from tariff import SIMPLE_TOU_TARIFF, compile_tariff, get_tariff_frame, get_price_matrix
+
+IDX = pd.date_range('2024-02-01', '2025-01-31 23:00', freq='h', tz='US/Pacific')
+
+SEASONAL_TARIFF = {
+    'name': 'Seasonal TOU',
+    'seasons': {'summer': [6, 7, 8, 9], 'winter': [1, 2, 3, 4, 5, 10, 11, 12]},
+    'buy': [
+        {'price': 0.30},
+        {'price': 0.45, 'start': '16:00', 'end': '20:59', 'days': 'weekday', 'seasons': ['winter']},
+        {'price': 0.60, 'start': '16:00', 'end': '20:59', 'days': 'weekday', 'seasons': ['summer']},
+        {'price': 0.20, 'start': '23:00', 'end': '05:59'},
+    ],
+    'sell': [{'price': 0.04}],
+    'fixed_charges': {'per_day': 0.5, 'per_month': 10.0},
+}
+
+
+def test_simple_tou_matches_between_time():
+    tariff = get_tariff_frame(SIMPLE_TOU_TARIFF, IDX)
+    px_buy = pd.Series(0.4, index=IDX)
+    px_buy.loc[px_buy.between_time('16:00', '21:00').index] = 0.52
+    px_sell = pd.Series(0.05, index=IDX)
+    px_sell.loc[px_sell.between_time('16:00', '22:00').index] = 0.20
+    np.testing.assert_array_equal(tariff['px_buy'], px_buy)
+    np.testing.assert_array_equal(tariff['px_sell'], px_sell)
+
+
+def test_seasonal_tariff():
+    px_buy = pd.Series(compile_tariff(SEASONAL_TARIFF, IDX)['px_buy'], index=IDX)
+    assert px_buy['2024-07-01 17:00'] == 0.60  # summer weekday peak
+    assert px_buy['2024-07-06 17:00'] == 0.30  # summer Saturday
+    assert px_buy['2024-11-04 20:00'] == 0.45  # winter weekday peak
+    assert px_buy['2024-11-04 21:00'] == 0.30
+    assert px_buy['2024-11-04 02:00'] == 0.20  # overnight period wraps past midnight
+    assert px_buy['2024-11-04 23:00'] == 0.20
+
+    assert get_monthly_fixed_charges(IDX, SEASONAL_TARIFF['fixed_charges']).sum() == pytest.approx(0.5 * 366 + 10.0 * 12)
+    assert get_price_matrix([SIMPLE_TOU_TARIFF, SEASONAL_TARIFF], IDX).shape == (2, len(IDX))
+
+
+def test_compiled_tariff_cache():
+    compiled = compile_tariff(SEASONAL_TARIFF, IDX)
+    assert compile_tariff(dict(SEASONAL_TARIFF), IDX.copy()) is compiled
+    assert not compiled['px_buy'].flags.writeable
+
+    with pytest.raises(ValueError):
+        compile_tariff({'buy': [{'price': 0.3, 'days': 'weekday'}], 'sell': [{'price': 0.0}]}, IDX)
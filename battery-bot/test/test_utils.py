@@ -1,7 +1,10 @@
 import numpy as np
 import pandas as pd
 
-from test.utils import elec_usage, ng_usage, ng_cost
+from test.utils import elec_usage, ng_usage, ng_cost, REF_ELEC_LOAD_DATA_FILE
+from solar import get_ref_solar_data
+from utils import (read_pge_meterdata, merge_solar_and_load_data, get_solar_shift_years, align_solar_data,
+                   series_to_palmetto_records, series_to_palmetto_usage, split_palmetto_usage)
 
 
 def validate_usage_data(s):
@@ -18,4 +21,64 @@ def test_ng_usage(ng_usage):
     validate_usage_data(ng_usage)
 
 def test_ng_cost(ng_cost):
-    validate_usage_data(ng_cost)
\ No newline at end of file
+    validate_usage_data(ng_cost)
+
+
+def test_read_pge_meterdata_chunks(tmp_path):
+    data = read_pge_meterdata(REF_ELEC_LOAD_DATA_FILE)
+    assert list(data.columns) == ['TYPE', 'USAGE (kWh)', 'COST']
+    assert data['COST'].dtype == float
+    pd.testing.assert_frame_equal(read_pge_meterdata(REF_ELEC_LOAD_DATA_FILE, chunksize=1000), data)
+
+    # Multi-service exports repeat the header row before each service's intervals
+    with open(REF_ELEC_LOAD_DATA_FILE, encoding='utf-8-sig') as f:
+        lines = f.readlines()
+    header = next(i for i, line in enumerate(lines) if line.startswith("TYPE,"))
+    fname = tmp_path / "multi_service.csv"
+    fname.write_text(''.join(lines[:header + 100] + [lines[header]] + lines[header + 100:]))
+    pd.testing.assert_frame_equal(read_pge_meterdata(fname, chunksize=64), data)
+
+
+def test_read_pge_meterdata_negative_cost(tmp_path):
+    fname = tmp_path / "export_credit.csv"
+    fname.write_text("TYPE,DATE,START TIME,END TIME,USAGE (kWh),COST,NOTES\n"
+                     "Electric usage,2024-02-01,00:00,00:59,3.00,$1.20\n"
+                     "Electric usage,2024-02-01,01:00,01:59,-1.25,-$0.50\n"
+                     "Electric usage,2024-02-01,02:00,02:59,-0.75,$-0.30\n")
+    data = read_pge_meterdata(fname)
+    np.testing.assert_allclose(data['COST'], [1.2, -0.5, -0.3])
+    np.testing.assert_allclose(data['USAGE (kWh)'], [3.0, -1.25, -0.75])
+
+
+def test_merge_solar_and_load_data(elec_usage):
+    solar = get_ref_solar_data()
+    solar_index = solar.index.copy()
+    site_data = merge_solar_and_load_data(elec_usage, solar)
+    assert solar.index.equals(solar_index), "the solar input should not be modified"
+    assert site_data.index.equals(elec_usage.index)
+    assert site_data['solar'].notnull().all()
+    hourly_mean = site_data['solar'].groupby(site_data.index.hour).mean()
+    assert hourly_mean[0] == 0 and hourly_mean[12] > 0, "solar should stay aligned to local time"
+
+    # Repeated merges for the same source and year reuse the aligned series
+    shift = get_solar_shift_years(elec_usage.index)
+    assert align_solar_data(solar, shift) is align_solar_data(solar.copy(), shift)
+
+    assert get_solar_shift_years(pd.date_range('2023-01-01', '2023-12-31 23:00', freq='h', tz='US/Pacific')) == 2019 - 2023
+    assert get_solar_shift_years(pd.date_range('2023-03-01', '2024-02-29', freq='h', tz='US/Pacific')) == 2020 - 2024
+
+
+def test_series_to_palmetto_records(elec_usage):
+    records = series_to_palmetto_records(elec_usage)
+    assert elec_usage.name == 'load', "the input series should not be renamed"
+    assert len(records) == len(elec_usage)
+    assert records[0] == {'from_datetime': '2024-02-01T00:00:00', 'to_datetime': '2024-02-01T01:00:00',
+                          'variable': 'consumption.electricity', 'value': elec_usage.iloc[0]}
+    # Wall-clock times across the spring-forward gap
+    dst = [r for r in records if r['from_datetime'] == '2024-03-10T01:00:00'][0]
+    assert dst['to_datetime'] == '2024-03-10T03:00:00'
+
+    usage = series_to_palmetto_usage(elec_usage)
+    chunks = split_palmetto_usage(usage, 1000)
+    assert sum(len(chunk['value']) for chunk in chunks) == len(elec_usage)
+    assert chunks[1]['from_datetime'][0] == records[1000]['from_datetime']
@@ -1,101 +1,201 @@
+import hashlib
+
+import numpy as np
 import pandas as pd
 
 from bayou import get_dataframe_of_electric_intervals_for_customer
+from cachestore import LRUCache
 from constants import TIMEZONE, FROM_DATETIME_PALMETTO_FUTURE
+from tariff import SIMPLE_TOU_TARIFF, get_tariff_frame
 
 
-def get_electricity_from_bayou_and_format_for_palmetto(bayou_customer_id: int) -> list:
+def get_electricity_from_bayou_and_format_for_palmetto(bayou_customer_id: int) -> dict:
     """
     Gets the electricity usage in intervals for the customer specified by `bayou_customer_id`, filters it to only
-    include intervals that occured before FROM_DATETIME_PALMETTO_FUTURE, and then formats the data into a list
-    of dicts that can be used for arg `known_kwh_usage` in func get_palmetto_data().
+    include intervals that occured before FROM_DATETIME_PALMETTO_FUTURE, and then formats the data as Palmetto usage
+    columns that can be used for arg `known_kwh_usage` in func get_palmetto_data().
     :param bayou_customer_id: Bayou integer ID number for the customer whose electricity usage is requested.
-    :return: List of dicts where each dict represents an interval of electricity usage, formatted to be ingested by Palmetto API.
+    :return: Palmetto usage columns (see get_palmetto_usage) for the customer's electricity usage.
     """
     intervals_df = get_dataframe_of_electric_intervals_for_customer(customer_id=bayou_customer_id)
     intervals_df = intervals_df.sort_values(by=['start'], ascending=True)
 
     interval_end_timestamp_without_tz = intervals_df['end'].dt.tz_localize(None)
     end_datetime = pd.to_datetime(FROM_DATETIME_PALMETTO_FUTURE)
-    intervals_df = intervals_df[interval_end_timestamp_without_tz < end_datetime].copy(deep=True)
+    intervals_df = intervals_df[interval_end_timestamp_without_tz < end_datetime]
+
+    return get_palmetto_usage(intervals_df['start'], intervals_df['end'], intervals_df['net_electricity_consumption'])
+
+
+def format_palmetto_timestamps(t) -> np.ndarray:
+    """
+    Local wall-clock times as 'YYYY-MM-DDTHH:MM:SS' strings. Each distinct date and time of day is formatted once and
+    the two are joined in one vectorized pass.
+    """
+    idx = pd.DatetimeIndex(t)
+    if idx.tz is not None:
+        idx = idx.tz_localize(None)
+    days, seconds = np.divmod(idx.values.astype('datetime64[s]').astype(np.int64), 86400)
+    unique_days, day_codes = np.unique(days, return_inverse=True)
+    unique_seconds, second_codes = np.unique(seconds, return_inverse=True)
+    day_strs = np.datetime_as_string(unique_days.astype('datetime64[D]')).astype(object) + 'T'
+    time_strs = np.array(['%02d:%02d:%02d' % (s // 3600, s // 60 % 60, s % 60) for s in unique_seconds.tolist()],
+                         dtype=object)
+    return day_strs[day_codes] + time_strs[second_codes]
+
+
+def get_palmetto_usage(from_datetime, to_datetime, value, variable: str = 'consumption.electricity') -> dict:
+    """
+    Usage history in the columnar form accepted for `known_kwh_usage` by palmetto.get_palmetto_data: equal-length
+    arrays of formatted interval start and end times and values, plus the Palmetto variable they measure.
+    Unlike a list of per-interval records, this serializes without building a dict per interval.
+    """
+    return {
+        'from_datetime': format_palmetto_timestamps(from_datetime),
+        'to_datetime': format_palmetto_timestamps(to_datetime),
+        'variable': variable,
+        'value': np.asarray(value, dtype=float),
+    }
+
+
+def series_to_palmetto_usage(s: pd.Series) -> dict:
+    """Palmetto usage columns for hourly usage indexed by interval start time"""
+    to_datetime = (s.index.tz_convert('UTC') + pd.Timedelta(hours=1)).tz_convert(s.index.tz)
+    return get_palmetto_usage(s.index, to_datetime, s.to_numpy())
 
-    intervals_df['from_datetime'] = intervals_df['start'].dt.strftime('%Y-%m-%dT%H:%M:%S')
-    intervals_df['to_datetime'] = intervals_df['end'].dt.strftime('%Y-%m-%dT%H:%M:%S')
-    intervals_df['variable'] = 'consumption.electricity'
-    intervals_df['value'] = intervals_df['net_electricity_consumption']
 
-    return intervals_df[['from_datetime', 'to_datetime', 'variable', 'value']].to_dict(orient='records')
+def palmetto_usage_to_records(usage: dict) -> list[dict]:
+    return [{'from_datetime': f, 'to_datetime': t, 'variable': usage['variable'], 'value': v}
+            for f, t, v in zip(usage['from_datetime'].tolist(), usage['to_datetime'].tolist(), usage['value'].tolist())]
 
 
 def series_to_palmetto_records(s: pd.Series) -> list[dict]:
-    s.name = 'value'
-    elec_usage = pd.DataFrame(s)
-    elec_usage['to_datetime'] = (elec_usage.index.tz_convert('UTC') + pd.DateOffset(hours=1)).tz_convert(elec_usage.index.tzinfo)
-    elec_usage["to_datetime"] = elec_usage["to_datetime"].dt.strftime('%Y-%m-%dT%H:%M:%S')
-    elec_usage['variable'] = 'consumption.electricity'
-    elec_usage = elec_usage.reset_index()
-    elec_usage['from_datetime'] = elec_usage['from_datetime'].dt.strftime('%Y-%m-%dT%H:%M:%S')
-    return elec_usage.to_dict(orient='records')
+    return palmetto_usage_to_records(series_to_palmetto_usage(s))
 
 
+def split_palmetto_usage(usage: dict, max_records: int) -> list[dict]:
+    """Split usage columns into consecutive time ranges of at most max_records intervals, for size-limited requests"""
+    n = len(usage['value'])
+    return [{key: col if isinstance(col, str) else col[i:i + max_records] for key, col in usage.items()}
+            for i in range(0, n, max_records)]
 
-def process_pge_meterdata(fname: str, extract_col='USAGE (kWh)') -> pd.Series:
-    header_row = None
-    with open(fname, 'r') as f:
-        for i, line in enumerate(f):
-            if line.startswith("TYPE,DATE,START TIME,END TIME"):
-                header_row = i
-                break
-    if header_row is None:
-        raise ValueError("Header row not found!")
-
-    sample_consumption = pd.read_csv(fname, parse_dates={'Datetime': ['DATE', 'START TIME']}, skiprows=header_row)
-    sample_consumption['Datetime'] = pd.DatetimeIndex(sample_consumption['Datetime']).tz_localize('US/Pacific', ambiguous='NaT', nonexistent='NaT')
-    sample_consumption = sample_consumption[sample_consumption['Datetime'].notnull()]
-    sample_consumption = sample_consumption.set_index('Datetime')
-    s = sample_consumption[extract_col].astype(str).str.replace('$', '').astype(float).rename('load')
 
+PGE_HEADER_PREFIX = "TYPE,DATE,START TIME,END TIME"
+
+
+def _parse_unique(values: pd.Series, parse) -> np.ndarray:
+    # Dates, start times and prices repeat heavily, so parse each distinct string once and broadcast back
+    codes, uniques = pd.factorize(values)
+    parsed = np.asarray(parse(pd.Series(uniques)))
+    return parsed[codes]
+
+
+def _parse_pge_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    # Multi-service exports repeat the header for each service; those rows fail to parse and are dropped
+    dates = _parse_unique(chunk['DATE'], lambda u: pd.to_datetime(u, format='%Y-%m-%d', errors='coerce'))
+    times = _parse_unique(chunk['START TIME'], lambda u: pd.to_timedelta(u + ':00', errors='coerce'))
+    data = {'TYPE': chunk['TYPE'].to_numpy()}
+    for col in chunk.columns.drop(['TYPE', 'DATE', 'START TIME', 'END TIME', 'NOTES'], errors='ignore'):
+        if chunk[col].dtype == object:
+            # Export credits are written '-$0.50', so the '$' is removed wherever it is
+            data[col] = _parse_unique(chunk[col],
+                                      lambda u: pd.to_numeric(u.str.replace('$', '', regex=False), errors='coerce'))
+        else:
+            data[col] = chunk[col].to_numpy()
+    parsed = pd.DataFrame(data, index=pd.DatetimeIndex(dates + times, name='Datetime'))
+    return parsed[parsed.index.notnull()]
+
+
+def iter_pge_meterdata(fname: str, chunksize: int = 100_000):
+    """
+    Stream a PG&E Green Button CSV export in a single pass, yielding DataFrames of up to chunksize rows.
+    Each frame is indexed by the tz-naive interval start time and has TYPE plus every numeric column of the export
+    (e.g. 'USAGE (kWh)' or 'USAGE (therms)', and 'COST' in dollars).
+    """
+    with open(fname, 'r', encoding='utf-8-sig') as f:
+        # Skip the account details above the header; readline keeps the file position where read_csv continues
+        line = f.readline()
+        while line and not line.startswith(PGE_HEADER_PREFIX):
+            line = f.readline()
+        if not line:
+            raise ValueError("Header row not found!")
+        columns = line.strip().split(',')
+        dtypes = {'TYPE': str, 'DATE': str, 'START TIME': str, 'END TIME': str, 'NOTES': str}
+        for chunk in pd.read_csv(f, names=columns, header=None, dtype=dtypes, chunksize=chunksize):
+            yield _parse_pge_chunk(chunk)
+
+
+def read_pge_meterdata(fname: str, chunksize: int = 100_000) -> pd.DataFrame:
+    """
+    Read a PG&E Green Button CSV export into one frame indexed by localized interval start time, with the usage and
+    COST columns as floats. Timestamps that don't exist or are ambiguous around DST changes are dropped.
+    """
+    data = pd.concat(iter_pge_meterdata(fname, chunksize=chunksize))
+    data.index = data.index.tz_localize('US/Pacific', ambiguous='NaT', nonexistent='NaT')
+    return data[data.index.notnull()]
+
+
+def trim_to_last_year(s: pd.Series) -> pd.Series:
     end_date = s.index[-1]
     if s.index[0] < (end_date - pd.DateOffset(years=1)):
         s = s.loc[end_date - pd.DateOffset(years=1):end_date]
     return s
 
 
-def merge_solar_and_load_data(elec_usage: pd.Series, solar_ac_estimate: pd.Series) -> pd.DataFrame:
-    elec_end_date = elec_usage.index[-1]
-    leap_day = None
-    for t in elec_usage.index:
-        if (t.month==2) & (t.day==29):
-            leap_day = t
-            break
-
-    if leap_day:
-        shift_by_yrs = 2020 - leap_day.year
-    elif elec_end_date.month == 12 & elec_end_date.day == 31:
-        shift_by_yrs = 2019 - elec_end_date.year
-    elif elec_end_date.month > 2:
-        shift_by_yrs = 2021 - elec_end_date.year
+def process_pge_meterdata(fname: str, extract_col='USAGE (kWh)') -> pd.Series:
+    return trim_to_last_year(read_pge_meterdata(fname)[extract_col].rename('load'))
+
+
+# Aligned solar series keyed on (content hash of the source series, year shift, timezone)
+_aligned_solar_cache = LRUCache(maxsize=32)
+
+
+def get_solar_shift_years(idx: pd.DatetimeIndex) -> int:
+    """
+    Number of years to shift the reference solar data (2019-2021) back by so that it covers the same calendar days
+    as idx, with a leap day in 2020 if idx has one.
+    """
+    is_leap_day = (idx.month == 2) & (idx.day == 29)
+    end_date = idx[-1]
+    if is_leap_day.any():
+        return 2020 - idx[is_leap_day.argmax()].year
+    elif (end_date.month == 12) and (end_date.day == 31):
+        return 2019 - end_date.year
+    elif end_date.month > 2:
+        return 2021 - end_date.year
     else:
-        shift_by_yrs = 2019 - elec_end_date.year
+        return 2019 - end_date.year
 
-    print("solar_ac_estimate")
-    print(solar_ac_estimate.head())
-    print("elec_usage")
-    print(elec_usage.head())
 
+def _hash_series(s: pd.Series) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(s.to_numpy()).tobytes())
+    h.update(s.index.asi8.tobytes())
+    h.update(str((s.name, s.dtype, s.index.tz)).encode())
+    return h.hexdigest()
 
-    solar_ac_estimate.index = (solar_ac_estimate.index.tz_convert('UTC') - pd.DateOffset(years=shift_by_yrs)).tz_convert(TIMEZONE)
-    solar_ac_estimate = solar_ac_estimate.resample('1h', closed='right').last().ffill()  # Deal with any gaps related to shifted DST; thankfully these are in the night
 
-    site_data = pd.DataFrame(elec_usage).join(solar_ac_estimate, how='left')
-    return site_data
+def align_solar_data(solar_ac_estimate: pd.Series, shift_by_yrs: int, timezone: str = TIMEZONE) -> pd.Series:
+    """
+    Shift the solar series back by shift_by_yrs years and resample it to hours in timezone. Results are memoized on
+    the series content, so aligning the same source for the same year again is a cache lookup. Treat the returned
+    series as read-only.
+    """
+    key = (_hash_series(solar_ac_estimate), shift_by_yrs, timezone)
+    aligned = _aligned_solar_cache.get(key)
+    if aligned is None:
+        index = (solar_ac_estimate.index.tz_convert('UTC') - pd.DateOffset(years=shift_by_yrs)).tz_convert(timezone)
+        aligned = solar_ac_estimate.set_axis(index)
+        aligned = aligned.resample('1h', closed='right').last().ffill()  # Deal with any gaps related to shifted DST; thankfully these are in the night
+        _aligned_solar_cache.put(key, aligned)
+    return aligned
 
 
-def build_tariff(idx: pd.DatetimeIndex) -> pd.DataFrame:
-    px_buy = pd.Series(0.4, index=idx, name='px_buy')
-    px_buy.loc[px_buy.between_time('16:00', '21:00').index] = 0.52
+def merge_solar_and_load_data(elec_usage: pd.Series, solar_ac_estimate: pd.Series) -> pd.DataFrame:
+    aligned = align_solar_data(solar_ac_estimate, get_solar_shift_years(elec_usage.index))
+    site_data = pd.DataFrame(elec_usage).join(aligned, how='left')
+    return site_data
 
-    px_sell = pd.Series(0.05, index=idx, name='px_sell')
-    px_sell.loc[px_sell.between_time('16:00', '22:00').index] = 0.20
 
-    return pd.DataFrame({'px_buy': px_buy, 'px_sell': px_sell})
+def build_tariff(idx: pd.DatetimeIndex) -> pd.DataFrame:
+    return get_tariff_frame(SIMPLE_TOU_TARIFF, idx)